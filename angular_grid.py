@@ -0,0 +1,72 @@
+# shared angular grid for the record generators
+# every revolution of the spiral steps theta from 0 to 2pi by the
+# same increment, so the thetas, their sines and cosines and the
+# number of steps are worked out once per increment and shared by
+# every ring, groove and cycle builder, revolution after revolution
+# and record after record
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import math
+import numpy
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+GRID_CACHE_SIZE = 8 # grids kept, one per increment (rpm, sample rate and divisor) in use
+CLOSING_TOLERANCE = 1e-6 # of an increment: a step this close to 2pi is the revolution's closing point, not another step
+grids = {} # (increment, closing) -> AngularGrid
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+# The steps of one revolution for a given theta increment.
+# thetas are accumulated one increment at a time in order, exactly
+# like a theta += increment loop, so the step count is the loop's.
+# With closing, a theta within CLOSING_TOLERANCE of an increment of 2pi
+# is the revolution's closing point rather than another step, so a
+# revolution of a whole number of steps (the stl generator's
+# --steps-per-rev) has that many, however the rounding of the last theta
+# goes. The laser generator's cycles keep the loop's count.
+# sines and cosines are read only arrays for numpy builders,
+# sine_list and cosine_list the same values as floats for per step loops
+class AngularGrid:
+  def __init__(self, increment, closing=False):
+    steps = int(2*math.pi/increment)+2 # always a little more than one revolution
+    thetas = numpy.cumsum(numpy.concatenate(([0.0], numpy.repeat(increment, steps)))) # cumsum adds in order, like the loop
+    self.increment = increment
+    self.thetas = thetas[thetas < 2*math.pi - (CLOSING_TOLERANCE*increment if closing else 0.0)]
+    self.count = len(self.thetas)
+    self.end = float(thetas[self.count]) # where the loop stops, the first theta past the revolution
+    self.sines = numpy.sin(self.thetas)
+    self.cosines = numpy.cos(self.thetas)
+    for table in (self.thetas, self.sines, self.cosines):
+      table.flags.writeable = False # shared, so nobody gets to change it
+    self.sine_list = self.sines.tolist()
+    self.cosine_list = self.cosines.tolist()
+
+#######################################
+#                                     #
+#        GEOMETRY FUNCTIONS           #
+#                                     #
+#######################################
+
+# Takes a theta increment (radians) and whether a step just short
+# of 2pi closes the revolution, and returns their AngularGrid,
+# building it the first time they are asked for
+def grid(increment, closing=False):
+  angles = grids.get((increment, closing))
+  if angles is None:
+    if len(grids) >= GRID_CACHE_SIZE:
+      grids.clear()
+    angles = grids[(increment, closing)] = AngularGrid(increment, closing)
+  return angles
@@ -0,0 +1,502 @@
+# shared audio decoding for the record generators
+# turns a .wav or .mp3 into a single channel of samples
+# normalized to the groove amplitude, using numpy instead
+# of per-sample python loops
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import os
+import struct
+import hashlib
+import fractions
+import numpy
+import pipeline
+from pydub import AudioSegment
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+# wav format tags we know how to decode
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# ways of turning several channels into one
+CHANNEL_LEFT = "left" # first channel only (the original behavior)
+CHANNEL_MEAN = "mean" # average of every channel
+CHANNEL_MID = "mid" # average of the front left/right pair, ignores any other channels
+CHANNEL_MODES = (CHANNEL_LEFT, CHANNEL_MEAN, CHANNEL_MID)
+
+# how many frames a streamed wav decodes at a time
+BLOCK_FRAMES = 2**20
+
+# decoded audio cache
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "making-records")
+HASH_CHUNK = 2**20 # bytes read at a time while hashing the input
+CACHE_LIMIT_MB = 2048 # the cache directory is trimmed to this, least recently used entries first
+
+# polyphase resampler
+RESAMPLE_ZEROS = 16 # zero crossings of the low-pass on each side, so 32 taps per output at the lower rate
+RESAMPLE_ROLLOFF = 0.95 # low-pass cutoff as a fraction of the lower of the two nyquist rates
+RESAMPLE_BETA = 8.0 # kaiser window shape, about 80 db of stopband
+RESAMPLE_CHUNK = 2**16 # output samples worked out per pass
+MAX_RATIO_DENOMINATOR = 1000 # rate ratios are approximated by up/down with down at most this
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Takes an open binary file positioned at the start of a wav
+# and walks its RIFF chunks. Returns a dict with the format tag,
+# channel count, sample rate, sample width in bytes and the
+# byte offset and length of the data chunk.
+# The wave module can't do this for float or extensible wavs.
+def read_wav_header(f):
+  riff, size, wave_id = struct.unpack("<4sI4s", f.read(12))
+  if riff != b"RIFF" or wave_id != b"WAVE":
+    raise ValueError("not a RIFF/WAVE file")
+
+  header = None
+  while True:
+    chunk = f.read(8)
+    if len(chunk) < 8:
+      raise ValueError("wav file has no data chunk")
+    chunk_id, chunk_size = struct.unpack("<4sI", chunk)
+
+    if chunk_id == b"fmt ":
+      fmt = f.read(chunk_size)
+      format_tag, channels, rate, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+      if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        # the real format tag is the first two bytes of the sub-format guid
+        format_tag = struct.unpack("<H", fmt[24:26])[0]
+      header = {
+        "format": format_tag,
+        "channels": channels,
+        "rate": float(rate),
+        "sampwidth": (bits+7)//8,
+      }
+    elif chunk_id == b"data":
+      if header is None:
+        raise ValueError("wav data chunk comes before its fmt chunk")
+      header["offset"] = f.tell()
+      header["size"] = chunk_size
+      return header
+    else:
+      f.seek(chunk_size, 1)
+
+    if chunk_size % 2: # chunks are padded to an even length
+      f.seek(1, 1)
+
+# Takes raw interleaved frame bytes and the layout described
+# by the wav header, and returns a (frames, channels) float64 array
+# in the file's own scale (normalization happens later)
+def decode_frames(raw, sampwidth, channels, is_float=False):
+  frame_size = sampwidth*channels
+  if not isinstance(raw, numpy.ndarray): # bytes, or a memory mapped slice
+    raw = numpy.frombuffer(raw, dtype=numpy.uint8)
+  raw = raw[:len(raw) - len(raw) % frame_size] # drop any partial frame
+
+  if is_float:
+    if sampwidth == 4:
+      data = raw.view("<f4")
+    elif sampwidth == 8:
+      data = raw.view("<f8")
+    else:
+      raise ValueError("unsupported float sample width: %d bytes" % sampwidth)
+  elif sampwidth == 1: # 8 bit wav is unsigned
+    data = raw.astype(numpy.int16) - 128
+  elif sampwidth == 2:
+    data = raw.view("<i2")
+  elif sampwidth == 3:
+    # pad each 24 bit sample into the top of an int32, then shift back down
+    # so the sign bit is extended for free
+    packed = raw.reshape(-1, 3)
+    padded = numpy.zeros((packed.shape[0], 4), dtype=numpy.uint8)
+    padded[:, 1:] = packed
+    data = padded.view("<i4").reshape(-1) >> 8
+  elif sampwidth == 4:
+    data = raw.view("<i4")
+  else:
+    raise ValueError("unsupported sample width: %d bytes" % sampwidth)
+
+  return data.astype(numpy.float64).reshape(-1, channels)
+
+# Takes a (frames, channels) array and returns a single channel
+# according to the given channel mode
+def downmix(frames, channels=CHANNEL_LEFT):
+  if channels == CHANNEL_LEFT or frames.shape[1] == 1:
+    return frames[:, 0]
+  elif channels == CHANNEL_MEAN:
+    return frames.mean(axis=1)
+  elif channels == CHANNEL_MID:
+    return (frames[:, 0] + frames[:, 1])*0.5
+  raise ValueError("unknown channel mode: %s" % channels)
+
+# Scales a single channel so its loudest sample sits at
+# +/- amplitude and returns it as float32.
+# Silence stays silent instead of dividing by zero.
+def normalize(data, amplitude):
+  peak = numpy.abs(data).max() if len(data) else 0.0
+  if peak == 0:
+    return numpy.zeros(len(data), dtype=numpy.float32)
+  return (data*(amplitude/peak)).astype(numpy.float32)
+
+# Returns True if the header describes float samples,
+# False for integer pcm, and raises for anything else
+def is_float_format(header):
+  if header["format"] == WAVE_FORMAT_IEEE_FLOAT:
+    return True
+  elif header["format"] == WAVE_FORMAT_PCM:
+    return False
+  raise ValueError("unsupported wav format tag: 0x%04x" % header["format"])
+
+# Opens a wav file (8/16/24/32 bit pcm or 32/64 bit float),
+# downmixes it to one channel and returns a float32 array
+# normalized to the given amplitude
+def decode_wav(filename, amplitude, channels=CHANNEL_LEFT):
+  with open(filename, "rb") as f:
+    header = read_wav_header(f)
+    raw = f.read(header["size"])
+
+  frames = decode_frames(raw, header["sampwidth"], header["channels"], is_float_format(header))
+  return normalize(downmix(frames, channels), amplitude)
+
+# Decodes an mp3 straight from memory with pydub (no .wav is written),
+# downmixes it to one channel and returns a float32 array
+# normalized to the given amplitude
+def decode_mp3(filename, amplitude, channels=CHANNEL_LEFT):
+  sound = AudioSegment.from_mp3(filename)
+  frames = decode_frames(sound.raw_data, sound.sample_width, sound.channels)
+  return normalize(downmix(frames, channels), amplitude)
+
+# Returns the name of the cache file for the decoded samples of the
+# given audio file: a hash of its contents plus the channel mode
+# and amplitude, so any change to either decodes again
+def cache_name(filename, amplitude, channels):
+  digest = hashlib.sha1()
+  with open(filename, "rb") as f:
+    chunk = f.read(HASH_CHUNK)
+    while chunk:
+      digest.update(chunk)
+      chunk = f.read(HASH_CHUNK)
+  return "%s_%s_%r.npy" % (digest.hexdigest(), channels, amplitude)
+
+# Saves decoded samples into the cache directory.
+# Writes to a temp file first so an interrupted run
+# never leaves a truncated .npy behind
+def write_cache(path, audio):
+  directory = os.path.dirname(path)
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  temp = "%s.%d.tmp" % (path, os.getpid())
+
+  if isinstance(audio, WavStream): # copy block by block, never holding it all
+    out = numpy.lib.format.open_memmap(temp, mode="w+", dtype=numpy.float32, shape=(len(audio),))
+    for start, block in audio.blocks():
+      out[start:start+len(block)] = block
+    out.flush()
+    del out
+  else:
+    with open(temp, "wb") as f:
+      numpy.save(f, audio)
+
+  os.rename(temp, path)
+  trim_cache(directory, CACHE_LIMIT_MB)
+
+# Marks a cache entry as just used, so trimming keeps it longest
+def touch_cache(path):
+  os.utime(path, None)
+
+# Deletes the least recently used .npy entries in the cache directory
+# until what is left comes to at most limit_mb. The newest entry,
+# the one just written, is always kept
+def trim_cache(directory, limit_mb):
+  entries = []
+  for name in os.listdir(directory):
+    path = os.path.join(directory, name)
+    if name.endswith(".npy") and os.path.isfile(path):
+      info = os.stat(path)
+      entries.append((info.st_mtime, info.st_size, path))
+  entries.sort()
+  total = sum(size for used, size, path in entries)
+  for used, size, path in entries[:-1]:
+    if total <= limit_mb*2**20:
+      break
+    try:
+      os.remove(path)
+      total -= size
+    except OSError: # another run got there first
+      pass
+
+# Opens the given .wav or .mp3
+# and returns a float32 array of the amplitudes
+# at every sample point of the audio.
+# With stream set, wavs are read through a WavStream over the
+# memory mapped file instead of being decoded all at once.
+# With a cache_dir, decoded samples are kept there as .npy
+# and later runs on the same file load them instead of decoding
+# (memory mapped when streaming).
+# A streamed wav decodes up to prefetch blocks ahead
+# in a background thread while the last ones are used
+def load_audio(filename, amplitude, channels=CHANNEL_LEFT, stream=False, cache_dir=None, prefetch=0):
+
+  if cache_dir is not None:
+    path = os.path.join(cache_dir, cache_name(filename, amplitude, channels))
+    if os.path.exists(path):
+      touch_cache(path)
+      return numpy.load(path, mmap_mode="r" if stream else None)
+
+  if filename[-4:] == ".mp3":
+    audio = decode_mp3(filename, amplitude, channels)
+  elif stream:
+    audio = WavStream(filename, amplitude, channels, prefetch=prefetch)
+  else:
+    audio = decode_wav(filename, amplitude, channels)
+
+  if cache_dir is not None:
+    write_cache(path, audio)
+    if stream:
+      return numpy.load(path, mmap_mode="r")
+  return audio
+
+# Takes the source and target sample rates and returns the
+# (up, down) integers of the nearest simple ratio between them
+def rate_ratio(source_rate, target_rate):
+  ratio = fractions.Fraction(float(target_rate)/source_rate).limit_denominator(MAX_RATIO_DENOMINATOR)
+  if ratio.numerator == 0:
+    raise ValueError("can't resample %r hz down to %r hz" % (source_rate, target_rate))
+  return (ratio.numerator, ratio.denominator)
+
+# Takes the up/down ratio and returns the (up, taps) polyphase bank of a
+# kaiser windowed sinc low-pass at the lower of the two nyquist rates,
+# row p holding every up-th tap from p, and the filter's delay in
+# upsampled samples. The taps add up to up, so each phase has unity gain
+def polyphase_filter(up, down):
+  factor = max(up, down)
+  half = RESAMPLE_ZEROS*factor
+  n = numpy.arange(-half, half+1)
+  h = RESAMPLE_ROLLOFF*numpy.sinc(RESAMPLE_ROLLOFF*n/float(factor))*numpy.kaiser(2*half+1, RESAMPLE_BETA)
+  h *= up/h.sum()
+  taps = -(-len(h)//up)
+  padded = numpy.zeros(taps*up)
+  padded[:len(h)] = h
+  return (padded.reshape(taps, up).T.copy(), half)
+
+# Returns samples [start, stop) of an array, memory map or SampleStream as float64
+def read_window(source, start, stop):
+  if isinstance(source, SampleStream):
+    return numpy.asarray(source.window(start, stop), dtype=numpy.float64)
+  return numpy.asarray(source[start:stop], dtype=numpy.float64)
+
+# Takes a source length and the two rates and returns how many
+# samples resampling it gives, ceil(length*up/down)
+def resampled_length(length, source_rate, target_rate):
+  (up, down) = rate_ratio(source_rate, target_rate)
+  return -(-length*up//down)
+
+# Resamples a single channel (array, memory map or WavStream) from
+# source_rate to target_rate with a polyphase fir low-pass, so nothing
+# above the new nyquist folds back down as aliasing.
+# Works through the output a chunk at a time, reading the source only
+# forwards, and yields (first output index, float32 block) in order,
+# ceil(len*up/down) samples in all.
+# Each output is a dot product of one filter phase with the samples around it,
+# done as strided slices of the source: one vector operation per tap
+def resample_blocks(source, source_rate, target_rate, chunk=RESAMPLE_CHUNK):
+  (up, down) = rate_ratio(source_rate, target_rate)
+  length = len(source)
+  if up == down:
+    for start in range(0, length, chunk):
+      yield start, read_window(source, start, min(start+chunk, length)).astype(numpy.float32)
+    return
+
+  (bank, half) = polyphase_filter(up, down)
+  taps = bank.shape[1]
+  out_length = -(-length*up//down)
+  chunk = max(chunk, 1024*up) # every phase still gets long vectors
+
+  buffer_start = 0 # source samples read so far, kept from buffer_start on
+  buffer = numpy.zeros(0)
+  for start in range(0, out_length, chunk):
+    stop = min(start+chunk, out_length)
+    first = (start*down + half)//up - (taps-1) # oldest source sample this chunk needs
+    last = ((stop-1)*down + half)//up # newest
+
+    # the source samples first..last, zero outside the signal
+    buffer_end = buffer_start + len(buffer)
+    fresh = read_window(source, min(max(buffer_end, 0), length), min(last+1, length))
+    buffer = numpy.concatenate((buffer[max(first-buffer_start, 0):], fresh))
+    buffer_start = max(first, 0)
+    window = numpy.zeros(last+1-first)
+    window[buffer_start-first:buffer_start-first+len(buffer)] = buffer[:last+1-buffer_start]
+
+    block = numpy.zeros(stop-start)
+    for offset in range(min(up, stop-start)): # outputs offset, offset+up, ... share one phase
+      count = len(range(offset, stop-start, up))
+      t = (start+offset)*down + half
+      phase = t % up
+      base = t//up - first
+      total = numpy.zeros(count)
+      for m in range(taps):
+        coefficient = bank[phase, m]
+        if coefficient != 0:
+          total += coefficient*window[base-m:base-m+down*(count-1)+1:down]
+      block[offset::up] = total
+    yield start, block.astype(numpy.float32)
+
+# Resamples a single channel the way resample_blocks does
+# and returns the whole track as one float32 array
+def resample(source, source_rate, target_rate, chunk=RESAMPLE_CHUNK):
+  out = numpy.empty(resampled_length(len(source), source_rate, target_rate), dtype=numpy.float32)
+  for start, block in resample_blocks(source, source_rate, target_rate, chunk):
+    out[start:start+len(block)] = block
+  return out
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+# The reading side of a track that is worked out a block at a time
+# instead of being held whole. A subclass sets length and scale and
+# yields (first index, normalized float32 block) from blocks().
+# Indexing (by position or by an ascending index array) works like
+# the whole array as long as reads move forward through the track,
+# which is how the grooves consume it. Moving back starts over
+class SampleStream:
+  def __len__(self):
+    return self.length
+
+  # forgets the block being read, the next read starts from the first block
+  def rewind(self):
+    self.current = None # generator feeding __getitem__
+    self.block_start = 0
+    self.block = numpy.zeros(0, dtype=numpy.float32)
+
+  # makes sure the current block holds frame i,
+  # pulling more blocks from the generator as needed
+  def seek(self, i):
+    if i < self.block_start: # moved backwards, start over
+      self.current = None
+    if self.current is None:
+      self.current = self.blocks()
+      self.block_start, self.block = next(self.current)
+    while i >= self.block_start + len(self.block):
+      self.block_start, self.block = next(self.current)
+
+  # returns the normalized samples in [start, stop) as one array,
+  # even when they straddle a block boundary
+  def window(self, start, stop):
+    pieces = []
+    i = start
+    while i < stop:
+      self.seek(i)
+      offset = i - self.block_start
+      piece = self.block[offset:offset + stop - i]
+      pieces.append(piece)
+      i += len(piece)
+    if len(pieces) == 1:
+      return pieces[0]
+    return numpy.concatenate(pieces) if pieces else numpy.zeros(0, dtype=numpy.float32)
+
+  # accepts a single index or an ascending array of indices
+  def __getitem__(self, i):
+    if isinstance(i, numpy.ndarray):
+      if len(i) == 0:
+        return numpy.zeros(0, dtype=numpy.float32)
+      if i.min() < 0 or i.max() >= self.length:
+        raise IndexError("sample index out of range")
+      start = int(i.min())
+      return self.window(start, int(i.max()) + 1)[i - start]
+
+    if i < 0:
+      i += self.length
+    if i < 0 or i >= self.length:
+      raise IndexError("sample index out of range")
+
+    self.seek(i)
+    return self.block[i - self.block_start]
+
+# A memory mapped view of a wav's data chunk that never decodes
+# more than one block of frames at a time.
+# The first pass over the blocks finds the peak for normalization,
+# after that blocks() yields normalized float32 blocks lazily.
+# Indexing works as SampleStream describes.
+# With prefetch set, that many blocks are decoded ahead in a
+# background thread, so decoding overlaps whatever reads them
+class WavStream(SampleStream):
+  def __init__(self, filename, amplitude, channels=CHANNEL_LEFT, block_frames=BLOCK_FRAMES, prefetch=0):
+    with open(filename, "rb") as f:
+      header = read_wav_header(f)
+      f.seek(0, 2)
+      available = f.tell() - header["offset"] # some writers leave the data size unset
+
+    self.channels = channels
+    self.block_frames = block_frames
+    self.prefetch = prefetch
+    self.sampwidth = header["sampwidth"]
+    self.num_channels = header["channels"]
+    self.is_float = is_float_format(header)
+    self.frame_size = self.sampwidth*self.num_channels
+    self.length = min(header["size"], available)//self.frame_size
+    self.data = numpy.memmap(filename, dtype=numpy.uint8, mode="r",
+      offset=header["offset"], shape=(self.length*self.frame_size,))
+
+    # first pass: find the loudest sample
+    peak = 0.0
+    for start, block in self.raw_blocks():
+      if len(block):
+        peak = max(peak, numpy.abs(block).max())
+    self.scale = amplitude/peak if peak else 0.0
+
+    self.rewind()
+
+  # yields (first frame index, downmixed float64 block) in file order
+  def raw_blocks(self):
+    for start in range(0, self.length, self.block_frames):
+      stop = min(start + self.block_frames, self.length)
+      raw = self.data[start*self.frame_size:stop*self.frame_size]
+      frames = decode_frames(raw, self.sampwidth, self.num_channels, self.is_float)
+      yield start, downmix(frames, self.channels)
+
+  # yields (first frame index, normalized float32 block) in file order
+  def blocks(self):
+    blocks = ((start, (block*self.scale).astype(numpy.float32)) for start, block in self.raw_blocks())
+    if self.prefetch:
+      return pipeline.prefetch(blocks, self.prefetch)
+    return blocks
+
+# A track resampled with resample_blocks and normalized to the given
+# amplitude, worked out a chunk at a time as it is read, so the
+# resampled track is never held whole.
+# The first pass resamples it only to find the peak for normalization,
+# so streaming costs one more resampling pass than resample() does.
+# Indexing works as SampleStream describes, and gives the same samples
+# as normalize(resample(...))
+class ResampledStream(SampleStream):
+  def __init__(self, source, source_rate, target_rate, amplitude, chunk=RESAMPLE_CHUNK):
+    self.source = source
+    self.rates = (source_rate, target_rate)
+    self.chunk = chunk
+    self.length = resampled_length(len(source), source_rate, target_rate)
+
+    peak = 0.0
+    for start, block in resample_blocks(source, source_rate, target_rate, chunk):
+      if len(block):
+        peak = max(peak, numpy.abs(block).max())
+    self.scale = amplitude/peak if peak else 0.0
+    self.rewind()
+
+  # yields (first index, normalized float32 block) in order
+  def blocks(self):
+    return ((start, (block*self.scale).astype(numpy.float32))
+      for start, block in resample_blocks(self.source, self.rates[0], self.rates[1], self.chunk))
@@ -0,0 +1,329 @@
+# benchmark harness for the record generators
+# renders synthetic audio (sine sweeps, noise, silence) of a few
+# lengths at each rpm through both generators, timing every stage
+# separately, and saves the results as json so runs can be compared.
+# every output is hashed and, given a reference run, checked against
+# it so an optimization can't quietly change the geometry:
+#   python benchmark.py --output before.json
+#   (make changes)
+#   python benchmark.py --reference before.json --output after.json
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import io
+import os
+import sys
+import ast
+import json
+import time
+import wave
+import shutil
+import hashlib
+import platform
+import argparse
+import tempfile
+import resource
+import subprocess
+import collections
+import multiprocessing
+import numpy
+import audio_processing
+import records
+import stl_generator
+import laser_cut_generator
+try:
+  from reportlab import rl_config
+  rl_config.invariant = 1 # no timestamps or random ids, so the same drawing hashes the same
+except ImportError: # only needed for pdf output
+  pass
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+SIGNALS = ("sweep", "noise", "silence")
+LENGTHS = (10, 60, 300) # seconds
+RPMS = (33.3, 45.0, 78.0)
+GENERATORS = ("stl", "laser") # stl stages: decode, resample, shape, grooves, write. laser: decode, plan, draw
+
+SAMPLE_RATE = 44100
+SWEEP_RANGE = (20.0, 20000.0) # hz, swept exponentially over the whole signal
+SIGNAL_LEVEL = 0.9 # peak of the synthetic signals, full scale is 1
+NOISE_SEED = 1234 # fixed so noise renders hash the same every run
+HASH_CHUNK = 2**20
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Returns the given kind of synthetic signal (sweep, noise or silence)
+# as a float64 array of the given number of seconds, full scale 1
+def synth_signal(kind, seconds, rate=SAMPLE_RATE):
+  count = int(seconds*rate)
+  if kind == "sweep":
+    (start, stop) = SWEEP_RANGE
+    t = numpy.arange(count)/float(rate)
+    rate_of_change = numpy.log(stop/start)/seconds
+    return SIGNAL_LEVEL*numpy.sin(2*numpy.pi*start*(numpy.exp(t*rate_of_change) - 1)/rate_of_change)
+  elif kind == "noise":
+    return numpy.random.RandomState(NOISE_SEED).uniform(-SIGNAL_LEVEL, SIGNAL_LEVEL, count)
+  elif kind == "silence":
+    return numpy.zeros(count)
+  raise ValueError("unknown signal: %s" % kind)
+
+# Takes a float signal (full scale 1) and returns
+# the bytes of a mono 16 bit wav of it, built in memory
+def wav_bytes(signal, rate=SAMPLE_RATE):
+  buf = io.BytesIO()
+  out = wave.open(buf, "wb")
+  out.setnchannels(1)
+  out.setsampwidth(2)
+  out.setframerate(rate)
+  out.writeframes(numpy.round(signal*32767).astype("<i2").tobytes())
+  out.close()
+  return buf.getvalue()
+
+# Returns the md5 of the given files' contents, in order
+def hash_files(filenames):
+  digest = hashlib.md5()
+  for filename in filenames:
+    with open(filename, "rb") as f:
+      chunk = f.read(HASH_CHUNK)
+      while chunk:
+        digest.update(chunk)
+        chunk = f.read(HASH_CHUNK)
+  return digest.hexdigest()
+
+# Returns the peak resident memory of this process so far in megabytes
+def peak_rss_mb():
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak/(1024.0*1024.0) if sys.platform == "darwin" else peak/1024.0 # bytes on mac, kilobytes elsewhere
+
+# Returns the commit the tree is at, or None outside a git checkout
+def git_commit():
+  try:
+    return subprocess.check_output(["git", "rev-parse", "HEAD"],
+      cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.STDOUT).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+# Takes "name=value" strings and returns a dict of generator globals
+# to override, with the values read as python literals
+def parse_overrides(items):
+  overrides = collections.OrderedDict()
+  for item in items:
+    name, _, value = item.partition("=")
+    try:
+      overrides[name] = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+      overrides[name] = value # bare strings like meshFormat=ply
+  return overrides
+
+# Sets each override on the generator module that has a global
+# of that name (after configure(), so it wins over the spec)
+def apply_overrides(generator, overrides):
+  for name, value in overrides.items():
+    if hasattr(generator, name):
+      setattr(generator, name, value)
+
+#######################################
+#                                     #
+#             BENCHMARKS              #
+#                                     #
+#######################################
+
+# Returns the key a case is matched on between runs
+def case_key(case):
+  return "%s/%s/%ds/%grpm" % (case["generator"], case["signal"], case["seconds"], case["rpm"])
+
+# Runs in its own process so peak memory is per case.
+# Takes the case dict (generator, signal, seconds, rpm, overrides, workdir),
+# renders it one stage at a time and returns the case with the
+# seconds and peak memory after each stage and the output hash added
+def run_case(case):
+  workdir = case["workdir"]
+  wav = os.path.join(workdir, "%s_%ds.wav" % (case["signal"], case["seconds"]))
+  with open(wav, "wb") as f:
+    f.write(wav_bytes(synth_signal(case["signal"], case["seconds"])))
+
+  stages = collections.OrderedDict()
+  memory = collections.OrderedDict()
+  def stage(name, func, *args):
+    start = time.time()
+    result = func(*args)
+    stages[name] = time.time() - start
+    memory[name] = peak_rss_mb()
+    return result
+
+  stdout = sys.stdout
+  sys.stdout = open(os.devnull, "w") # the generators print progress per groove/file
+  try:
+    spec = records.RecordSpec(rpm=case["rpm"])
+    if case["generator"] == "stl":
+      gen = stl_generator
+      gen.configure(spec)
+      apply_overrides(gen, case["overrides"])
+      gen.updateRate() # in case rateDivisor or stepsPerRev was overridden
+      output = os.path.join(workdir, "record." + gen.meshFormat)
+
+      audio = stage("decode", audio_processing.load_audio, wav, gen.amplitude, gen.channelMode, gen.streamAudio, None)
+      gen.resetState()
+      audio_tuple = stage("resample", gen.resampleAudio, (audio, len(audio)))
+      stage("shape", set_up_shape, gen, audio_tuple, output)
+      stage("grooves", gen.drawGrooves, audio_tuple)
+      stage("write", gen.writeMesh, output)
+      files = [output]
+    else:
+      gen = laser_cut_generator
+      gen.configure(spec)
+      apply_overrides(gen, case["overrides"])
+
+      audio = stage("decode", audio_processing.load_audio, wav, gen.amplitude, gen.channel_mode, gen.stream_audio, None)
+      jobs = stage("plan", gen.planFiles, len(audio), os.path.join(workdir, "record"))
+      files = stage("draw", draw_files, gen, jobs)
+  finally:
+    sys.stdout.close()
+    sys.stdout = stdout
+
+  result = dict((name, value) for name, value in case.items() if name != "workdir")
+  result["samples"] = len(audio)
+  result["stages"] = stages
+  result["total"] = sum(stages.values())
+  result["peak_rss_mb"] = memory
+  result["output_files"] = len(files)
+  result["output_bytes"] = sum(os.path.getsize(filename) for filename in files)
+  result["output_hash"] = hash_files(files)
+  return result
+
+# Sets up the stl generator's record the way drawRecord does before
+# the grooves: the decimation tolerance (None unless decimateMicrons or
+# triangleBudget is set), the mesh writer or store and the base shape
+def set_up_shape(gen, audio_tuple, output):
+  gen.decimateTolerance = gen.adaptiveTolerance(audio_tuple)
+  if gen.streamMesh:
+    gen.meshWriter = gen.openMeshWriter(output)
+  else:
+    gen.meshStore = gen.openMeshStore(audio_tuple[1])
+  gen.setUpRecordShape()
+
+# Draws the laser files planned by planFiles the way drawSpiral does
+# and returns their names
+def draw_files(gen, jobs):
+  if gen.workers > 1:
+    pool = multiprocessing.Pool(gen.workers)
+    drawn = pool.map(gen.drawFile, jobs, 1)
+    pool.close()
+    pool.join()
+  else:
+    drawn = [gen.drawFile(job) for job in jobs]
+  return [filename for filename, report in drawn]
+
+# Runs a case in a fresh child process (not a pool worker,
+# since the generators may start pools of their own)
+# and returns its result, or raises if it failed
+def run_isolated(case):
+  (receiver, sender) = multiprocessing.Pipe(False)
+  def child():
+    try:
+      sender.send(("ok", run_case(case)))
+    except Exception as error:
+      sender.send(("error", "%s: %s" % (type(error).__name__, error)))
+  process = multiprocessing.Process(target=child)
+  process.start()
+  (status, result) = receiver.recv()
+  process.join()
+  if status != "ok":
+    raise RuntimeError("%s failed: %s" % (case_key(case), result))
+  return result
+
+# Takes this run's result and the matching reference result (or None)
+# and returns the printed summary line
+def summary(result, reference):
+  stages = " ".join("%s %.2fs" % item for item in result["stages"].items())
+  line = "%-28s %s | total %.2fs, peak %.0f MB" % (case_key(result), stages, result["total"],
+    max(result["peak_rss_mb"].values()))
+  if reference is not None:
+    line += ", %.2fx" % (reference["total"]/result["total"] if result["total"] else 0.0)
+    line += ", output matches" if result["output_hash"] == reference["output_hash"] else ", OUTPUT DIFFERS"
+  return line
+
+#######################################
+#                                     #
+#                MAIN                 #
+#                                     #
+#######################################
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="times each stage of the record generators on synthetic audio")
+  parser.add_argument("--generators", nargs="+", choices=GENERATORS, default=list(GENERATORS))
+  parser.add_argument("--signals", nargs="+", choices=SIGNALS, default=list(SIGNALS))
+  parser.add_argument("--lengths", nargs="+", type=int, default=list(LENGTHS), help="seconds of audio")
+  parser.add_argument("--rpms", nargs="+", type=float, default=list(RPMS))
+  parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="NAME=VALUE",
+    help="override a generator global for every case, e.g. vectorEngine=False or workers=4")
+  parser.add_argument("--output", default="benchmark_results.json", help="where to save the results")
+  parser.add_argument("--reference", help="earlier results to compare times and output hashes against")
+  parser.add_argument("--keep", action="store_true", help="keep the rendered files")
+  args = parser.parse_args(argv)
+
+  reference = {}
+  if args.reference:
+    with open(args.reference) as f:
+      reference = dict((case_key(case), case) for case in json.load(f)["cases"])
+
+  overrides = parse_overrides(args.overrides)
+  workdir = tempfile.mkdtemp(prefix="making-records-bench-")
+  results = []
+  mismatches = 0
+  try:
+    for generator in args.generators:
+      for signal in args.signals:
+        for seconds in args.lengths:
+          for rpm in args.rpms:
+            casedir = os.path.join(workdir, "%s_%s_%ds_%grpm" % (generator, signal, seconds, rpm))
+            os.mkdir(casedir)
+            case = {"generator": generator, "signal": signal, "seconds": seconds, "rpm": rpm,
+              "overrides": overrides, "workdir": casedir}
+            result = run_isolated(case)
+            match = reference.get(case_key(result))
+            if match is not None:
+              result["reference_match"] = result["output_hash"] == match["output_hash"]
+              mismatches += not result["reference_match"]
+            results.append(result)
+            print(summary(result, match))
+            if not args.keep:
+              shutil.rmtree(casedir)
+  finally:
+    if args.keep:
+      print("rendered files kept in %s" % workdir)
+    else:
+      shutil.rmtree(workdir, ignore_errors=True)
+
+  report = {
+    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "commit": git_commit(),
+    "python": platform.python_version(),
+    "numpy": numpy.__version__,
+    "platform": platform.platform(),
+    "cpus": multiprocessing.cpu_count(),
+    "overrides": overrides,
+    "reference": args.reference,
+    "cases": results,
+  }
+  with open(args.output, "w") as f:
+    json.dump(report, f, indent=2)
+  print("results saved to %s" % args.output)
+
+  if mismatches:
+    print("%d outputs differ from the reference" % mismatches)
+    return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,160 @@
+# per stage metrics for the record generators
+# records wall time, cpu time (this process and any worker
+# processes it waited on) and peak memory for each stage of
+# a render, plus whatever the stage counted (samples, triangles)
+# so it can report throughput and an eta from it.
+# one stage can be run under cProfile to see where its time goes
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import sys
+import json
+import time
+import pstats
+import cProfile
+import resource
+import collections
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+PROFILE_LINES = 25 # functions listed for a profiled stage
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Returns the cpu seconds used so far by this process
+# and by the child processes it has waited on
+def cpu_seconds():
+  own = resource.getrusage(resource.RUSAGE_SELF)
+  children = resource.getrusage(resource.RUSAGE_CHILDREN)
+  return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+# Returns the peak resident memory in megabytes of this process
+# and of the largest child process waited on, so far
+def peak_rss_mb():
+  scale = 1024.0*1024.0 if sys.platform == "darwin" else 1024.0 # bytes on mac, kilobytes elsewhere
+  own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/scale
+  children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/scale
+  return (own, children)
+
+# Takes a number of seconds and returns it as h:mm:ss or m:ss
+def format_seconds(seconds):
+  minutes, seconds = divmod(int(round(seconds)), 60)
+  hours, minutes = divmod(minutes, 60)
+  if hours:
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
+  return "%d:%02d" % (minutes, seconds)
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+# Collects the metrics of one render, stage by stage.
+# start(name) begins a stage (ending the one before it),
+# count() adds to the current stage's counters and stop() ends it.
+# Stages started more than once add up.
+class Metrics:
+  def __init__(self, profile_stage=None):
+    self.profile_stage = profile_stage
+    self.profiler = None
+    self.stages = collections.OrderedDict()
+    self.current = None
+    self.created = time.time()
+
+  # begins the named stage
+  def start(self, name):
+    if self.current is not None:
+      self.stop()
+    stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "counts": collections.OrderedDict()})
+    stage["started"] = time.time()
+    stage["cpu_started"] = cpu_seconds()
+    self.current = name
+    if name == self.profile_stage:
+      self.profiler = cProfile.Profile()
+      self.profiler.enable()
+
+  # adds the given amounts (samples=..., triangles=...) to the current stage
+  def count(self, **amounts):
+    if self.current is None:
+      return
+    counts = self.stages[self.current]["counts"]
+    for name, amount in amounts.items():
+      counts[name] = counts.get(name, 0) + amount
+
+  # ends the current stage, adding any final counts first
+  def stop(self, **amounts):
+    if self.current is None:
+      return
+    self.count(**amounts)
+    stage = self.stages[self.current]
+    stage["wall"] += time.time() - stage.pop("started")
+    stage["cpu"] += cpu_seconds() - stage.pop("cpu_started")
+    stage["peak_rss_mb"], stage["children_peak_rss_mb"] = peak_rss_mb()
+    self.current = None
+
+    if self.profiler is not None:
+      self.profiler.disable()
+      print("profile of the %s stage:" % self.profile_stage)
+      pstats.Stats(self.profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(PROFILE_LINES)
+      self.profiler = None
+
+  # returns the seconds the current stage has run so far
+  def elapsed(self):
+    if self.current is None:
+      return 0.0
+    stage = self.stages[self.current]
+    return stage["wall"] + time.time() - stage["started"]
+
+  # takes how many units of the current stage are done out of the total
+  # and returns the estimated time left at the rate so far, to tack onto
+  # a progress message (empty until there is a rate to go by)
+  def eta(self, done, total):
+    if done <= 0 or done >= total:
+      return ""
+    return ", about %s left" % format_seconds(self.elapsed()/done*(total - done))
+
+  # returns {stage name: {wall, cpu, peak memory, counts, rates}}
+  # with a rate per second for everything counted
+  def summary(self):
+    stages = collections.OrderedDict()
+    for name, stage in self.stages.items():
+      summary = collections.OrderedDict()
+      for key in ("wall", "cpu", "peak_rss_mb", "children_peak_rss_mb", "counts"):
+        if key in stage:
+          summary[key] = stage[key]
+      summary["rates"] = collections.OrderedDict((count, amount/stage["wall"])
+        for count, amount in stage["counts"].items() if stage["wall"] > 0)
+      stages[name] = summary
+    return stages
+
+  # prints one line per stage
+  def report(self):
+    total = 0.0
+    for name, stage in self.summary().items():
+      total += stage["wall"]
+      line = "%-14s %8.2fs wall %8.2fs cpu %7.0f MB peak" % (name, stage["wall"], stage["cpu"], stage.get("peak_rss_mb", 0))
+      for count, rate in stage["rates"].items():
+        line += ", %.0f %s/s" % (rate, count)
+      print(line)
+    print("%-14s %8.2fs wall" % ("total", total))
+
+  # writes the summary, plus any extra fields given, to filename as json
+  def write(self, filename, **extra):
+    data = collections.OrderedDict()
+    data["created"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.created))
+    data.update(extra)
+    data["stages"] = self.summary()
+    with open(filename, "w") as f:
+      json.dump(data, f, indent=2)
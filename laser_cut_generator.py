@@ -4,12 +4,15 @@
 #                                      #
 ########################################
 import math
-import sys
-import os
-import wave
-import struct
-from pydub import AudioSegment
-from reportlab.pdfgen import canvas
+import argparse
+import multiprocessing
+import numpy
+import audio_processing
+import angular_grid
+import laser_output
+import toolpath
+import pipeline
+import instrumentation
 
 ########################################
 #                                      #
@@ -18,6 +21,9 @@ from reportlab.pdfgen import canvas
 ########################################
 rpm = 45.0 # options are 33.3, 45, or 78
 sampling_rate = 44100.0 # default sampling rate for mp3
+channel_mode = audio_processing.CHANNEL_LEFT # which channels to use: left, mean or mid
+stream_audio = False # memory map the wav and decode it in blocks, keeps memory flat for long sides
+audio_cache_dir = audio_processing.DEFAULT_CACHE_DIR # where decoded audio is kept between runs, None turns the cache off
 dpi = 1200.0
 cutter_width = 32 # HAL printer bed width in inches
 cutter_height = 18 # HAL printer bed height in inches
@@ -29,6 +35,14 @@ outer_rad = 5.75 # outermost groove radius in inches
 cutlines = True
 drawBoundingBox = False
 num_grooves_per_file = 5 # splits the grooves into multiple files
+simplify_pixels = None # simplify each cycle to within this many dpi pixels of the full spiral instead of thinning it to min_distance (--tolerance)
+workers = 1 # processes rendering pdfs in parallel (--workers)
+pipeline_mode = False # write each file from its own thread while the spiral is worked out, and stream the audio when it isn't cached, through bounded queues (--pipeline)
+output_format = "pdf" # pdf, svg, dxf or gcode (--format)
+metrics_file = None # write the stage timings, memory and throughput here as json (--metrics)
+profile_stage = None # run this stage under cProfile and print where its time goes (--profile)
+metrics = instrumentation.Metrics() # stage timings of the record being drawn
+audio_filename = None # the audio file given in the program args
 sec_per_min = 60
 scale_num = 72.0 #amplifies the data to fit a standard 11.8" record
 amplitude = 10.0/dpi*scale_num
@@ -38,6 +52,15 @@ size = (cutter_width*scale_num, cutter_height*scale_num)
 theta_increments = math.pi*2.0/theta_per_cycle
 rad_increments = (2.0*amplitude+spacing)/theta_per_cycle
 index_increments = int((sampling_rate*sec_per_min/rpm)/theta_per_cycle)
+not_started = (float("nan"), float("nan")) # circle data points before the spiral starts, never drawn
+
+# every setting above with its default. configure() puts them all back before each
+# library render, so nothing one render or the program args changed carries over
+# (amplitude and the other dpi based sizes are worked out again from dpi)
+setting_names = ("rpm", "sampling_rate", "channel_mode", "stream_audio", "audio_cache_dir", "dpi", "cutter_width",
+	"cutter_height", "theta_per_cycle", "diameter", "hole_rad", "inner_rad", "outer_rad", "cutlines", "drawBoundingBox",
+	"num_grooves_per_file", "simplify_pixels", "workers", "pipeline_mode", "output_format", "metrics_file", "profile_stage")
+setting_defaults = dict((name, globals()[name]) for name in setting_names)
 
 ########################################
 #                                      #
@@ -52,73 +75,103 @@ class CircleData:
 		self.index = ind
 		self.end = e
 
+	# returns the arguments that recreate this circle data
+	def state(self):
+		return (self.points, self.radius, self.index, self.end)
+
 ########################################
 #                                      #
 #            IO FUNCTIONS              #
 #                                      #
 ########################################
 
-# Opens the filename given in the program args,
-# converts to wav if neccesary,
-# then returns a list of floats representing
+# Opens the filename given in the program args
+# and returns a float32 array representing
 # the amplitudes at every sample point of the audio
+# (or a WavStream reading it lazily when streaming)
+# and the length of that array
 def process_audio_data():
 
-  filename = sys.argv[1]
-  audioData = [] # list of floats to return
-
-  if filename[-4:] == ".mp3": # convert mp3 files
-
-    # resaves the file as a .wav so that
-    # it can be re-read as a .wav
-    path = os.getcwd()
-    sound = AudioSegment.from_mp3(path + "/" + filename)
-    sound.export(path + "/" + filename[:-4] + ".wav", format="wav")
-    filename = filename[:-4] + ".wav" # change the filename to match
-
-  # read file and get data
-  w = wave.open(filename, 'r')
-  numframes = w.getnframes()
-
-  frame = w.readframes(numframes)# w.getnframes()
-  frameInt = map(ord, list(frame))# turn into array
-
-  # separate left and right channels and merge bytes
-  frameOneChannel = [0]*numframes # initialize list of one channel of wave
-  for i in range(numframes):
-      frameOneChannel[i] = frameInt[4*i+1]*2**8+frameInt[4*i] # separate channels and store one channel in new list
-      if frameOneChannel[i] > 2**15:
-          frameOneChannel[i] = (frameOneChannel[i]-2**16)
-      elif frameOneChannel[i] == 2**15:
-          frameOneChannel[i] = 0
-      else:
-          frameOneChannel[i] = frameOneChannel[i]
-
-  # convert to list of floats
-  for i in range(numframes):
-      audioData.append(frameOneChannel[i])
-  
-  # normalize audio data to given bitdepth
-  # first find max val
-  maxval = 0
-  for data in audioData:
-    maxval = max(abs(data),maxval)
-
-  # normalize amplitude to max val
-  for i in range(numframes):
-    audioData[i]*=amplitude/maxval
-  
-  return (audioData,numframes)
+  metrics.start("decode")
+  audioData = audio_processing.load_audio(audio_filename, amplitude, channel_mode, stream_audio or pipeline_mode, audio_cache_dir,
+    pipeline.QUEUE_DEPTH if pipeline_mode else 0)
+  metrics.stop(samples=len(audioData))
+
+  return (audioData,len(audioData))
+
+# Reads the program args into the globals they override
+def parseArgs():
+	global audio_filename, workers, output_format, metrics_file, profile_stage, simplify_pixels, pipeline_mode
+
+	parser = argparse.ArgumentParser(description="turns a .wav or .mp3 into laser cutter pdfs of a record")
+	parser.add_argument("filename", help="the .wav or .mp3 to cut into the record")
+	parser.add_argument("--workers", type=int, default=workers,
+		help="processes rendering pdfs in parallel (default %(default)s)")
+	parser.add_argument("--format", choices=sorted(laser_output.BACKENDS), default=output_format,
+		help="file type to write for the cutter (default %(default)s)")
+	parser.add_argument("--metrics", metavar="FILE", default=metrics_file,
+		help="write stage timings, memory and throughput to FILE as json")
+	parser.add_argument("--profile", choices=("decode", "plan", "draw"), default=profile_stage,
+		help="run one stage under cProfile and print where its time goes")
+	parser.add_argument("--tolerance", type=float, metavar="PIXELS", default=simplify_pixels,
+		help="keep only the points needed to stay within PIXELS dpi pixels of the full resolution spiral")
+	parser.add_argument("--pipeline", action="store_true", default=pipeline_mode,
+		help="write each file from its own thread while the spiral is worked out, a bounded number of paths behind")
+	args = parser.parse_args()
+
+	audio_filename = args.filename
+	workers = max(1, args.workers)
+	output_format = args.format
+	metrics_file = args.metrics
+	profile_stage = args.profile
+	simplify_pixels = args.tolerance
+	pipeline_mode = args.pipeline
+
+# Starts a new set of metrics for the next record,
+# call it before loading the audio
+def resetState():
+	global metrics
+
+	metrics = instrumentation.Metrics(profile_stage)
+
+# Takes a RecordSpec and any other settings by name (workers=4,
+# simplify_pixels=1...), puts every setting back to its default in
+# setting_defaults, then sets the ones the spec gives and the named ones,
+# and recomputes the globals derived from them. The settings are
+# module globals, so only one render can be set up at a time
+def configure(spec, **settings):
+	global amplitude, min_distance, spacing, size, theta_increments, rad_increments, index_increments
+
+	unknown = sorted(set(settings) - set(setting_names))
+	if unknown:
+		raise TypeError("unknown laser_cut_generator settings: " + ", ".join(unknown))
+	values = dict(setting_defaults)
+	for name, value in (("rpm", spec.rpm), ("dpi", spec.dpi), ("diameter", spec.diameter), ("inner_rad", spec.inner_rad),
+			("outer_rad", spec.outer_rad), ("channel_mode", spec.channels), ("output_format", spec.format)):
+		if value is not None:
+			values[name] = value
+	values.update(settings)
+	globals().update(values)
+
+	amplitude = (10.0/dpi if spec.amplitude is None else spec.amplitude)*scale_num
+	min_distance = 6.0/dpi*scale_num
+	spacing = 10.0/dpi*scale_num
+	size = (cutter_width*scale_num, cutter_height*scale_num)
+	theta_increments = math.pi*2.0/theta_per_cycle
+	rad_increments = (2.0*amplitude+spacing)/theta_per_cycle
+	index_increments = int((sampling_rate*sec_per_min/rpm)/theta_per_cycle)
 
 # Creates and returns a canvas with default settings
-# for laser cutting
+# for laser cutting, through the backend for output_format.
+# Drawing goes through a toolpath stage that joins the spiral
+# into continuous polylines and orders them for the least travel.
+# In pipeline mode the backend writes from its own thread
 def newCanvas(filename, num):
-	c = canvas.Canvas(filename+str(num)+".pdf")
-	c.setLineWidth(0.001)
-	c.setStrokeColorRGB(0,0,0)
-	c.setPageSize(size)
-
-	return c
+	backend = laser_output.BACKENDS[output_format]
+	canvas = backend(filename+str(num)+"."+backend.extension, size)
+	if pipeline_mode:
+		canvas = pipeline.WriterThread(canvas)
+	return toolpath.Toolpath(canvas)
 
 #######################################
 #                                     #
@@ -126,91 +179,259 @@ def newCanvas(filename, num):
 #                                     #
 #######################################
 
+# Returns the shared angular grid for theta_increments: the theta
+# steps of one cycle with their sines and cosines, worked out once
+# instead of every cycle
+def cycleGrid():
+	return angular_grid.grid(theta_increments)
+
+# Takes the point the spiral left off at and the x and y
+# arrays of the next cycle's candidate points. Returns the
+# indices of the points to keep: the first one further than
+# min_distance from the start point (any point, if the spiral
+# hasn't started), then each next one further than
+# min_distance from the previously kept one
+def thinPoints(start, x_vals, y_vals):
+	(x_last, y_last) = start
+	count = len(x_vals)
+	min_distance_sq = min_distance**2
+
+	if math.isnan(x_last): # not_started, every point is far enough
+		far = numpy.ones(count, dtype=bool)
+	else:
+		far = ((x_last - x_vals)**2 + (y_last - y_vals)**2) > min_distance_sq
+	if not far.any():
+		return []
+
+	# stride[i] is how many steps after point i the first point
+	# far enough from it is (0 if there is none this cycle)
+	stride = numpy.zeros(count, dtype=numpy.int64)
+	unresolved = numpy.arange(count)
+	step = 1
+	while len(unresolved):
+		ahead = unresolved + step
+		unresolved = unresolved[ahead < count]
+		ahead = ahead[ahead < count]
+		far_enough = ((x_vals[unresolved] - x_vals[ahead])**2 + (y_vals[unresolved] - y_vals[ahead])**2) > min_distance_sq
+		stride[unresolved[far_enough]] = step
+		unresolved = unresolved[~far_enough]
+		step += 1
+
+	# follow the strides from the first kept point
+	kept = []
+	i = int(numpy.argmax(far))
+	stride = stride.tolist()
+	while True:
+		kept.append(i)
+		if stride[i] == 0:
+			break
+		i += stride[i]
+	return kept
+
+# Takes x and y arrays of a polyline and the tolerance (points)
+# and returns a boolean array of the points Douglas-Peucker keeps:
+# the ends, then the furthest point of every stretch that strays
+# more than the tolerance from the straight cut between its kept ends,
+# until none does. Every stretch is split in the same numpy pass
+def simplifyPolyline(x_vals, y_vals, tolerance):
+	count = len(x_vals)
+	keep = numpy.zeros(count, dtype=bool)
+	keep[0] = keep[-1] = True
+	positions = numpy.arange(count)
+
+	while True:
+		kept = numpy.flatnonzero(keep)
+		if len(kept) == count:
+			break
+		stretch = numpy.minimum(numpy.searchsorted(kept, positions, side="right") - 1, len(kept) - 2)
+		start = kept[stretch]
+		end = kept[stretch + 1]
+		dx = x_vals[end] - x_vals[start]
+		dy = y_vals[end] - y_vals[start]
+		length_sq = dx*dx + dy*dy
+		offset_x = x_vals - x_vals[start]
+		offset_y = y_vals - y_vals[start]
+		along = numpy.clip((offset_x*dx + offset_y*dy)/numpy.where(length_sq > 0, length_sq, 1.0), 0.0, 1.0)
+		distance = numpy.hypot(offset_x - along*dx, offset_y - along*dy) # from the nearest point of the straight cut
+		distance[keep] = 0.0
+
+		furthest = numpy.maximum.reduceat(distance, kept[:-1])[stretch]
+		split = (distance > tolerance) & (distance == furthest)
+		if not split.any():
+			break
+		first = numpy.unique(stretch[split], return_index=True)[1] # one split per stretch
+		keep[numpy.flatnonzero(split)[first]] = True
+	return keep
+
+# Takes the point the spiral left off at, the x and y arrays of the
+# next cycle's points and the tolerance (points). Returns the indices
+# of the points to keep so the path from the start point through them
+# stays within the tolerance of the one through every point
+def simplifyPoints(start, x_vals, y_vals, tolerance):
+	if math.isnan(start[0]): # the spiral hasn't started, there is nothing to lead in from
+		return numpy.flatnonzero(simplifyPolyline(x_vals, y_vals, tolerance)).tolist()
+	keep = simplifyPolyline(numpy.concatenate(([start[0]], x_vals)), numpy.concatenate(([start[1]], y_vals)), tolerance)
+	return numpy.flatnonzero(keep[1:]).tolist()
+
+# Takes a canvas and lists of x and y coordinates and
+# draws the polyline through them as a single path.
+# Segments touching a nan point are left out, that is
+# where the spiral hasn't started yet (not_started),
+# so the path is handed over as runs of connected points,
+# found with numpy and sliced out whole
+def drawPolyline(canvas, x_vals, y_vals):
+	x_array = numpy.asarray(x_vals, dtype=numpy.float64)
+	y_array = numpy.asarray(y_vals, dtype=numpy.float64)
+	drawn = numpy.concatenate(([False], ~numpy.isnan(x_array) & ~numpy.isnan(y_array), [False]))
+	edges = numpy.flatnonzero(drawn[1:] != drawn[:-1]) # where each run of drawn points starts and ends
+	runs = [(x_array[start:end].tolist(), y_array[start:end].tolist())
+		for start, end in zip(edges[0::2], edges[1::2]) if end - start > 1]
+	canvas.polylines(runs)
+
 # takes in a radius to start at as well as the points
-# to start at on the circle and draw one cycle of a
-# spiral onto the canvas's pdf.
-# Returns the locations of the last points drawn
-# as a tuple to know where to continue the spiral
-def drawOneCircle(canvas, circle_data):
-	theta = float(0)
-	(x_last, y_last) = circle_data.points
+# to start at on the circle and works out one cycle of
+# the spiral without drawing it. Updates the circle data
+# to where the cycle ends and returns the x and y lists
+# of the polyline to draw (None if no point was kept)
+def spiralCycle(circle_data):
 	radius = circle_data.radius
 	index = circle_data.index
 	last_cycle = circle_data.end
-	rad_calculation = radius
-
-	while theta < math.pi*2:
-		if not last_cycle:
-			rad_calculation = radius
-		if index != -1.0:
-			index += index_increments
-		x_val = 6*scale_num+rad_calculation*math.cos(theta)
-		y_val = 6*scale_num-rad_calculation*math.sin(theta)
-
-		if ((x_last - x_val)**2 +(y_last-y_val)**2)>min_distance**2:
-			if (x_last != 0.0 and y_last != 0.0) and (x_val != 0.0 and y_val != 0.0):
-				canvas.line(x_last, y_last, x_val, y_val)
-			x_last = x_val
-			y_last = y_val
-
-		if not last_cycle:
-			radius -= rad_increments
-		theta += theta_increments
+
+	angles = cycleGrid()
+	count = angles.count
+	if last_cycle: # a closed circle at the current radius
+		radii = numpy.repeat(radius, count)
+	else: # radius before each step, then the radius after the cycle
+		radii = numpy.subtract.accumulate(numpy.concatenate(([radius], numpy.repeat(rad_increments, count))))
+		radius = float(radii[-1])
+		radii = radii[:-1]
+	x_vals = 6*scale_num+radii*angles.cosines
+	y_vals = 6*scale_num-radii*angles.sines
+
+	polyline = None
+	if simplify_pixels is None:
+		kept = thinPoints(circle_data.points, x_vals, y_vals)
+	else:
+		kept = simplifyPoints(circle_data.points, x_vals, y_vals, simplify_pixels/dpi*scale_num)
+	if kept:
+		x_path = [circle_data.points[0]] + x_vals[kept].tolist()
+		y_path = [circle_data.points[1]] + y_vals[kept].tolist()
+		polyline = (x_path, y_path)
+		circle_data.points = (x_path[-1], y_path[-1])
 
 	if index == -1.0:
 		index = 0.0
-	circle_data.points = (x_last, y_last)
+	else:
+		index += count*index_increments
 	circle_data.radius = radius
 	circle_data.index = index
 
+	return polyline
+
+# takes in a radius to start at as well as the points
+# to start at on the circle and draw one cycle of a
+# spiral onto the canvas's pdf as one path.
+# Returns the locations of the last points drawn
+# as a tuple to know where to continue the spiral
+def drawOneCircle(canvas, circle_data):
+	polyline = spiralCycle(circle_data)
+	if polyline is not None:
+		drawPolyline(canvas, polyline[0], polyline[1])
+
 	return circle_data
 
 # Takes in a canvas and draws red cutlines for
 # the outer edge of the record and the inner small
 # hole. Returns the updated canvas
 def drawCutlines(canvas):
-	canvas.setStrokeColorRGB(255,0,0)
+	canvas.set_color(255,0,0)
 
-	canvas.circle(6*scale_num,6*scale_num, hole_rad*scale_num/2, stroke=1, fill=0)
-	canvas.circle(6*scale_num,6*scale_num, diameter*scale_num/2, stroke=1, fill=0)
+	canvas.circle(6*scale_num,6*scale_num, hole_rad*scale_num/2)
+	canvas.circle(6*scale_num,6*scale_num, diameter*scale_num/2)
 
 	return canvas
 
 # Takes in a set of points and draws them with
 # Connecting lines in a spiral on a series of
-# pdf files
-def drawSpiral((points_data, points_length)):
-	stripped_filename = sys.argv[1][:-4]
-	radius = outer_rad*scale_num
-	last_points = (0.0,0.0)
-	index = -1.0
-	num_grooves = 0.0
-
-	cur_data = CircleData(last_points,radius,index, False)
-
-	c = newCanvas(stripped_filename, 0)
-
-	while radius > inner_rad*scale_num and index < points_length-theta_per_cycle*index_increments:
-		cur_data = drawOneCircle(c, cur_data)
+# pdf files named after output_name. The file boundaries
+# are planned first, then each file is drawn on its own,
+# in a pool of worker processes when there is more than one.
+# Returns the list of files written
+def drawSpiral((points_data, points_length), output_name):
+	metrics.start("plan")
+	jobs = planFiles(points_length, output_name)
+	metrics.start("draw")
+
+	if workers > 1:
+		pool = multiprocessing.Pool(workers)
+		drawn = pool.imap(drawFile, jobs, 1)
+	else:
+		pool = None
+		drawn = (drawFile(job) for job in jobs)
+
+	filenames = []
+	toolpaths = []
+	for filename, report in drawn:
+		filenames.append(filename)
+		toolpaths.append(report)
+		print("Finished %s (%d of %d), %d paths, cut %s, travel %s%s" % (filename, len(filenames), len(jobs), report["paths"],
+			instrumentation.format_seconds(report["cut_seconds"]), instrumentation.format_seconds(report["travel_seconds"]),
+			metrics.eta(len(filenames), len(jobs))))
+
+	if pool is not None:
+		pool.close()
+		pool.join()
+	metrics.stop(samples=points_length)
+
+	metrics.report()
+	if metrics_file is not None:
+		metrics.write(metrics_file, output=filenames, samples=points_length, toolpaths=toolpaths)
+	return filenames
+
+# Walks the spiral without drawing it to find where
+# each pdf starts. Returns one job per file: (output name,
+# file number, circle data state at the start of the file,
+# number of spiral cycles in it, whether it is the last file)
+def planFiles(points_length, output_name):
+	cur_data = CircleData(not_started, outer_rad*scale_num, -1.0, False)
+	num_grooves = 0
+	jobs = []
+	file_start = cur_data.state()
+
+	while cur_data.radius > inner_rad*scale_num and cur_data.index < points_length-theta_per_cycle*index_increments:
+		spiralCycle(cur_data)
 		num_grooves += 1
 		if num_grooves % num_grooves_per_file == 0:
-			c.save()
-			print("Finished a pdf")
-			file_number = str(int(num_grooves / num_grooves_per_file))
-			c = newCanvas(stripped_filename,file_number)
-		last_points = cur_data.points
-		radius = cur_data.radius
-		index = cur_data.index
-
-	cur_data.index = -1.0
-	cur_data = drawOneCircle(c,cur_data)
-	cur_data.index = -1.0
-	cur_data.end = True
-	cur_data = drawOneCircle(c,cur_data)
-
-	if cutlines:
-		c = drawCutlines(c)
+			jobs.append((output_name, len(jobs), file_start, num_grooves_per_file, False))
+			file_start = cur_data.state()
+
+	jobs.append((output_name, len(jobs), file_start, num_grooves % num_grooves_per_file, True))
+	return jobs
+
+# Takes in a job from planFiles and draws that file's
+# spiral cycles onto a new pdf. The last file also gets
+# the locked groove and the cutlines. Returns the file's name
+# and its toolpath report (paths, cut and travel lengths and times)
+def drawFile(job):
+	(output_name, file_number, state, cycles, last_file) = job
+	c = newCanvas(output_name, file_number)
+	cur_data = CircleData(*state)
+
+	for i in range(cycles):
+		cur_data = drawOneCircle(c, cur_data)
+
+	if last_file:
+		cur_data.index = -1.0
+		cur_data = drawOneCircle(c,cur_data)
+		cur_data.index = -1.0
+		cur_data.end = True
+		cur_data = drawOneCircle(c,cur_data)
+
+		if cutlines:
+			c = drawCutlines(c)
 	c.save()
+	return (c.filename, c.report())
 
 ########################################
 #                                      #
@@ -218,11 +439,12 @@ def drawSpiral((points_data, points_length)):
 #                                      #
 ########################################
 def main():
-	full_filename = sys.argv[1]
-	stripped_filename = full_filename[:-4] # removes the .txt extension
-	
+	parseArgs()
+	resetState()
+
 	audio_data = process_audio_data()
-	drawSpiral(audio_data)
+	drawSpiral(audio_data, audio_filename[:-4])
 
 
-main()
+if __name__ == "__main__":
+	main()
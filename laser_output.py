@@ -0,0 +1,198 @@
+# output backends for the laser cut generator
+# every backend takes the same drawing calls (polylines, circles, colors)
+# in pdf points, 72 per inch from the bottom left corner of the bed.
+# pdf goes through reportlab, the others stream straight to disk
+# as the spiral is drawn, so their memory use stays flat
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+try:
+  from reportlab.pdfgen import canvas
+except ImportError: # only needed for pdf output
+  canvas = None
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+POINTS_PER_INCH = 72.0
+MM_PER_INCH = 25.4
+FORMAT_CHUNK = 2**16 # points formatted per string operation
+
+# g-code settings (grbl style laser)
+GCODE_FEED = 600 # cutting feed rate in mm/min
+GCODE_POWER = 1000 # spindle value for the laser while cutting, grbl's default max
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Writes pairs of coordinates through the given printf style
+# format, which takes one x and one y. Formats a chunk of points
+# per string operation instead of one at a time
+def write_points(f, line, x_vals, y_vals, chunk=FORMAT_CHUNK):
+  for start in range(0, len(x_vals), chunk):
+    xs = x_vals[start:start+chunk]
+    ys = y_vals[start:start+chunk]
+    values = [None]*(2*len(xs))
+    values[0::2] = xs
+    values[1::2] = ys
+    f.write(line*len(xs) % tuple(values))
+
+# Takes rgb values (anything over 1 counts as full) and
+# returns the matching #rrggbb string
+def hex_color(r, g, b):
+  return "#%02x%02x%02x" % tuple(int(round(255*min(max(v, 0), 1))) for v in (r, g, b))
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+# Draws onto a reportlab canvas, one pdf path per polyline call
+class PdfBackend:
+  extension = "pdf"
+
+  def __init__(self, filename, size):
+    self.filename = filename
+    if canvas is None:
+      raise ImportError("pdf output needs reportlab")
+    self.c = canvas.Canvas(filename)
+    self.c.setLineWidth(0.001)
+    self.c.setStrokeColorRGB(0,0,0)
+    self.c.setPageSize(size)
+
+  def set_color(self, r, g, b):
+    self.c.setStrokeColorRGB(r, g, b)
+
+  # takes a list of (x list, y list) runs and strokes them as one path,
+  # through reportlab's public path calls only
+  def polylines(self, runs):
+    path = self.c.beginPath()
+    lineTo = path.lineTo
+    for x_vals, y_vals in runs:
+      path.moveTo(x_vals[0], y_vals[0])
+      for point in zip(x_vals[1:], y_vals[1:]):
+        lineTo(*point)
+    self.c.drawPath(path, stroke=1, fill=0)
+
+  def circle(self, x, y, r):
+    self.c.circle(x, y, r, stroke=1, fill=0)
+
+  def save(self):
+    self.c.save()
+
+# Streams an svg the size of the cutter bed, in points,
+# flipping y so it still counts up from the bottom
+class SvgBackend:
+  extension = "svg"
+
+  def __init__(self, filename, size):
+    self.filename = filename
+    (self.width, self.height) = size
+    self.color = "#000000"
+    self.f = open(filename, "w")
+    self.f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+      '<svg xmlns="http://www.w3.org/2000/svg" width="%gin" height="%gin" viewBox="0 0 %g %g">\n'
+      % (self.width/POINTS_PER_INCH, self.height/POINTS_PER_INCH, self.width, self.height))
+
+  def set_color(self, r, g, b):
+    self.color = hex_color(r, g, b)
+
+  def polylines(self, runs):
+    if not runs:
+      return
+    self.f.write('<path fill="none" stroke="%s" stroke-width="0.001" d="' % self.color)
+    for x_vals, y_vals in runs:
+      y_vals = [self.height - y for y in y_vals]
+      self.f.write("M%.4f %.4f" % (x_vals[0], y_vals[0]))
+      write_points(self.f, "L%.4f %.4f", x_vals[1:], y_vals[1:])
+    self.f.write('"/>\n')
+
+  def circle(self, x, y, r):
+    self.f.write('<circle fill="none" stroke="%s" stroke-width="0.001" cx="%.4f" cy="%.4f" r="%.4f"/>\n'
+      % (self.color, x, self.height - y, r))
+
+  def save(self):
+    self.f.write("</svg>\n")
+    self.f.close()
+
+# Streams an ascii dxf (R12 entities, so nearly anything imports it) in inches.
+# The spiral goes on layer SPIRAL, anything drawn after a
+# color change goes on layer CUTLINES in the nearest aci color
+class DxfBackend:
+  extension = "dxf"
+
+  def __init__(self, filename, size):
+    self.filename = filename
+    self.layer = "SPIRAL"
+    self.color = 7 # black/white
+    self.f = open(filename, "w")
+    self.f.write("0\nSECTION\n2\nENTITIES\n")
+
+  def set_color(self, r, g, b):
+    self.layer = "CUTLINES"
+    self.color = 1 if r > 0 and g <= 0 and b <= 0 else 7 # red, or black/white
+
+  def polylines(self, runs):
+    for x_vals, y_vals in runs:
+      self.f.write("0\nPOLYLINE\n8\n%s\n62\n%d\n66\n1\n10\n0.0\n20\n0.0\n30\n0.0\n" % (self.layer, self.color))
+      write_points(self.f, "0\nVERTEX\n8\n" + self.layer + "\n10\n%.6f\n20\n%.6f\n30\n0.0\n",
+        [x/POINTS_PER_INCH for x in x_vals], [y/POINTS_PER_INCH for y in y_vals])
+      self.f.write("0\nSEQEND\n8\n%s\n" % self.layer)
+
+  def circle(self, x, y, r):
+    self.f.write("0\nCIRCLE\n8\n%s\n62\n%d\n10\n%.6f\n20\n%.6f\n30\n0.0\n40\n%.6f\n"
+      % (self.layer, self.color, x/POINTS_PER_INCH, y/POINTS_PER_INCH, r/POINTS_PER_INCH))
+
+  def save(self):
+    self.f.write("0\nENDSEC\n0\nEOF\n")
+    self.f.close()
+
+# Streams grbl style g-code in millimetres, absolute positioning.
+# The laser is off (M5) for every rapid move and on (M4, dynamic power)
+# only while tracing a polyline or circle
+class GcodeBackend:
+  extension = "gcode"
+
+  def __init__(self, filename, size):
+    self.filename = filename
+    self.scale = MM_PER_INCH/POINTS_PER_INCH
+    self.f = open(filename, "w")
+    self.f.write("G21 (millimetres)\nG90 (absolute)\nM5\n")
+
+  def set_color(self, r, g, b):
+    self.f.write("(cutlines)\n")
+
+  def polylines(self, runs):
+    for x_vals, y_vals in runs:
+      self.f.write("G0 X%.4f Y%.4f\nM4 S%d\n" % (x_vals[0]*self.scale, y_vals[0]*self.scale, GCODE_POWER))
+      self.f.write("G1 F%d\n" % GCODE_FEED)
+      write_points(self.f, "G1 X%.4f Y%.4f\n",
+        [x*self.scale for x in x_vals[1:]], [y*self.scale for y in y_vals[1:]])
+      self.f.write("M5\n")
+
+  def circle(self, x, y, r):
+    (x, y, r) = (x*self.scale, y*self.scale, r*self.scale)
+    self.f.write("G0 X%.4f Y%.4f\nM4 S%d\nG2 X%.4f Y%.4f I%.4f J0 F%d\nM5\n"
+      % (x + r, y, GCODE_POWER, x + r, y, -r, GCODE_FEED))
+
+  def save(self):
+    self.f.write("M5\nG0 X0 Y0\nM2\n")
+    self.f.close()
+
+# backend for each --format
+BACKENDS = {
+  "pdf": PdfBackend,
+  "svg": SvgBackend,
+  "dxf": DxfBackend,
+  "gcode": GcodeBackend,
+}
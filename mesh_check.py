@@ -0,0 +1,411 @@
+# mesh integrity checks for the stl generator's records
+# reads a generated mesh (stl, ply, obj or 3mf) or takes its
+# vertex and face arrays, welds vertices that share a position
+# and checks the surface with numpy, a chunk at a time, in about
+# two seconds and 170 MB per million triangles:
+#   holes (edges with only one triangle), non-manifold edges
+#   (more than two), degenerate and zero area triangles, flipped
+#   winding (neighbours that disagree on which side is out) and
+#   folds (neighbours doubled back over each other, which is what
+#   overlapping groove rings look like)
+# every problem is reported with the grooves it turns up in
+#   python mesh_check.py record.stl
+#   python mesh_check.py record.stl --dpi 300 --outer-rad 5.5
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import os
+import re
+import sys
+import math
+import zipfile
+import argparse
+import collections
+import numpy
+import mesh_output
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+ZERO_AREA = 1e-6 # triangles with twice their area under this times their longest edge squared count as zero area
+FOLD_COSINE = -0.9 # neighbours whose normals (made to agree on winding) are further apart than this are folded over
+LOCATIONS_SHOWN = 5 # example locations printed per problem
+GROOVES_SHOWN = 12 # groove numbers printed per problem
+READ_CHUNK = 2**20 # lines parsed at a time from the text formats, triangles read at a time from stl
+CHECK_CHUNK = 2**22 # vertices welded and edges sorted per sort
+LOOKBACK = 4 # vertices just before each one that it is compared with before sorting
+POSITION_HASH = 0x9E3779B97F4A7C15 # odd multiplier mixing a position's coordinate bits into its hash
+NORMAL_CHUNK = 2**18 # faces whose normals are worked out at a time
+
+# what each check is called in reports, in report order
+PROBLEMS = collections.OrderedDict([
+  ("holes", "boundary edges (holes)"),
+  ("non_manifold", "non-manifold edges"),
+  ("degenerate", "degenerate triangles"),
+  ("zero_area", "zero area triangles"),
+  ("flipped", "flipped winding edges"),
+  ("folded", "folded over edges (ring overlap)"),
+])
+FAILING = ("holes", "non_manifold", "flipped") # problems no clean render has, any of them fails the check
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Takes the lines of a text mesh that start with the given prefix
+# ("v ", "f ", or an xml tag) and returns the numbers on them as an
+# (n, 3) array, a chunk of lines per numpy call
+def parse_rows(lines, pattern, dtype):
+  rows = []
+  for start in range(0, len(lines), READ_CHUNK):
+    text = b" ".join(pattern.sub(b" ", line) for line in lines[start:start+READ_CHUNK])
+    rows.append(numpy.array(text.split(), dtype=dtype).reshape(-1, 3))
+  return numpy.concatenate(rows) if rows else numpy.zeros((0, 3), dtype=dtype)
+
+# Reads a binary ply as written by mesh_output
+# and returns its (vertices, faces)
+def read_ply(filename):
+  with open(filename, "rb") as f:
+    counts = {}
+    line = f.readline()
+    while line and line.strip() != b"end_header":
+      words = line.split()
+      if words[0] == b"element":
+        counts[words[1]] = int(words[2])
+      line = f.readline()
+    vertices = numpy.fromfile(f, dtype="<f4", count=3*counts[b"vertex"]).reshape(-1, 3)
+    faces = numpy.fromfile(f, dtype=mesh_output.PLY_FACE, count=counts[b"face"])["indices"]
+  return (vertices, faces)
+
+# Reads an obj and returns its (vertices, faces)
+def read_obj(filename):
+  with open(filename, "rb") as f:
+    lines = f.read().splitlines()
+  vertices = parse_rows([line for line in lines if line.startswith(b"v ")], re.compile(b"^v "), numpy.float32)
+  faces = parse_rows([line for line in lines if line.startswith(b"f ")], re.compile(b"^f |/[0-9]*"), numpy.int64)
+  return (vertices, faces - 1) # obj counts from 1
+
+# Reads a 3mf package as written by mesh_output
+# and returns its (vertices, faces)
+def read_3mf(filename):
+  package = zipfile.ZipFile(filename)
+  lines = package.read("3D/3dmodel.model").splitlines()
+  package.close()
+  outside_quotes = re.compile(b'^[^"]*"|"[^"]*"|"[^"]*$') # leaves the attribute values
+  vertices = parse_rows([line for line in lines if b"<vertex " in line], outside_quotes, numpy.float32)
+  faces = parse_rows([line for line in lines if b"<triangle " in line], outside_quotes, numpy.int64)
+  return (vertices, faces)
+
+# Reads a binary stl and returns its (vertices, faces), three vertices
+# per triangle. weld() joins them up. The triangles are read
+# READ_CHUNK at a time, so only their vertices are held in memory
+def read_stl(filename):
+  count = (os.path.getsize(filename) - 84)//mesh_output.STL_TRIANGLE.itemsize
+  vertices = numpy.empty((3*count, 3), dtype=numpy.float32)
+  with open(filename, "rb") as f:
+    f.seek(84)
+    for start in range(0, count, READ_CHUNK):
+      triangles = numpy.fromfile(f, dtype=mesh_output.STL_TRIANGLE, count=min(READ_CHUNK, count - start))
+      vertices[3*start:3*(start + len(triangles))] = triangles["vertices"].reshape(-1, 3)
+  return (vertices, numpy.arange(len(vertices), dtype=index_type(len(vertices))).reshape(-1, 3))
+
+# Reads a mesh file of any format mesh_output writes
+# and returns its (vertices, faces)
+def read_mesh(filename):
+  readers = {"stl": read_stl, "ply": read_ply, "obj": read_obj, "3mf": read_3mf}
+  extension = filename.rsplit(".", 1)[-1].lower()
+  if extension not in readers:
+    raise ValueError("can't check .%s files, only %s" % (extension, ", ".join(sorted(readers))))
+  return readers[extension](filename)
+
+#######################################
+#                                     #
+#        GEOMETRY FUNCTIONS           #
+#                                     #
+#######################################
+
+# Returns the smallest integer type (int32 or int64)
+# that can number count vertices or faces
+def index_type(count):
+  return numpy.int32 if count < 2**31 else numpy.int64
+
+# Takes (n,3) positions and returns the bits of each one's
+# float32 coordinates as (n,3) uint32, -0.0 and 0.0 being the same place
+def position_bits(points):
+  points = numpy.asarray(points, dtype=numpy.float32) + numpy.float32(0.0)
+  return points.view(numpy.uint32).reshape(-1, 3)
+
+# Takes (vertices, faces) and returns them with every set of vertices
+# at exactly the same (float32) position joined into one, the way a
+# slicer sees the surface, numbered in the order they first turn up
+# (so neighbouring edges get nearby numbers and sort quickly),
+# and the faces renumbered to match.
+# A vertex at the same place as one of the LOOKBACK vertices just before
+# it (most of them, in a triangle strip) is joined to that one. The rest
+# are joined by sorting one 64 bit hash of each position, a bucket of about
+# CHECK_CHUNK hashes at a time so the sort's temporaries stay small, only
+# falling back to sorting a bucket by x, y and z if two different positions
+# in it share a hash
+def weld(vertices, faces):
+  vertices = numpy.asarray(vertices)
+  bucket_bits = max(0, int(math.ceil(math.log(max(len(vertices), 1)/float(CHECK_CHUNK), 2))))
+  source = numpy.arange(len(vertices), dtype=index_type(len(vertices))) # the vertex each one is joined to
+  (leads, hashes, buckets) = ([], [], []) # of the vertices left to sort, and the top bits of their hashes
+  for start in range(0, len(vertices) or 1, CHECK_CHUNK): # once even with no vertices
+    before = min(start, LOOKBACK)
+    bits = position_bits(vertices[start-before:start+CHECK_CHUNK])
+    chunk = bits[:, 0].astype(numpy.uint64)
+    for column in (1, 2):
+      chunk *= numpy.uint64(POSITION_HASH)
+      chunk ^= bits[:, column]
+    # the multiplier is odd, so the same hash, x and z means the same y too
+    (x, z) = (bits[:, 0].copy(), bits[:, 2].copy())
+    lead = numpy.ones(len(bits) - before, dtype=bool)
+    for back in range(1, LOOKBACK + 1):
+      skip = max(0, back - before) # rows with nothing that far back
+      (now, then) = (slice(before + skip, len(bits)), slice(before + skip - back, len(bits) - back))
+      matched = numpy.flatnonzero((chunk[now] == chunk[then]) & (x[now] == x[then]) & (z[now] == z[then]) & lead[skip:]) + skip
+      source[start + matched] = start + matched - back
+      lead[matched] = False
+    lead = numpy.flatnonzero(lead)
+    leads.append((start + lead).astype(source.dtype))
+    hashes.append(chunk[before:][lead])
+    if bucket_bits:
+      buckets.append((hashes[-1] >> numpy.uint64(64 - bucket_bits)).astype(numpy.uint16))
+    else:
+      buckets.append(numpy.zeros(len(lead), dtype=numpy.uint16))
+  (leads, hashes, buckets) = (numpy.concatenate(leads), numpy.concatenate(hashes), numpy.concatenate(buckets))
+  while True: # follow each joined vertex back to the first of its run
+    further = numpy.take(source, source)
+    if numpy.array_equal(further, source):
+      break
+    source = further
+
+  renumber = numpy.empty(len(vertices), dtype=index_type(len(vertices)))
+  points = []
+  firsts = [] # the first vertex at each position
+  welded = 0
+  for bucket in range(2**bucket_bits):
+    picked = numpy.flatnonzero(buckets == bucket)
+    picked = picked[numpy.argsort(hashes[picked])]
+    order = leads[picked]
+    ordered = position_bits(numpy.take(vertices, order, axis=0))
+    ordered_hashes = hashes[picked]
+    new = numpy.ones(len(order), dtype=bool)
+    new[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+    if (new[1:] & (ordered_hashes[1:] == ordered_hashes[:-1])).any(): # a collision, the rows sharing a hash may be interleaved
+      resort = numpy.lexsort((ordered[:, 2], ordered[:, 1], ordered[:, 0]))
+      (order, ordered) = (order[resort], ordered[resort])
+      new[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+    renumber[order] = welded + numpy.cumsum(new) - 1
+    points.append(ordered[new].view(numpy.float32))
+    if len(order):
+      firsts.append(numpy.minimum.reduceat(order, numpy.flatnonzero(new)))
+    welded += len(points[-1])
+  del leads, hashes, buckets
+
+  # number the positions by where they first turn up instead of by hash
+  first = numpy.zeros(len(vertices), dtype=bool)
+  for positions in firsts:
+    first[positions] = True
+  numbers = numpy.cumsum(first, dtype=renumber.dtype)
+  numbers -= 1
+  numbers = numpy.concatenate([numbers[positions] for positions in firsts]) if firsts else numbers[:0]
+  welded_points = numpy.empty((welded, 3), dtype=numpy.float32)
+  welded_points[numbers] = numpy.concatenate(points)
+  del first, firsts, points
+  source = numpy.take(renumber, source)
+  del renumber
+  source = numpy.take(numbers, source)
+  return (welded_points, numpy.take(source, faces))
+
+# Takes (vertices, faces) and returns the (m,3) unnormalized normals
+# (twice the area long), twice the areas of the faces
+# and their longest edges squared
+def face_normals(vertices, faces):
+  corners = numpy.take(vertices, faces, axis=0).astype(numpy.float64)
+  sides = [corners[:, i] - corners[:, i-1] for i in range(3)]
+  normals = numpy.cross(sides[1], -sides[0])
+  longest = numpy.max([(side**2).sum(axis=1) for side in sides], axis=0)
+  return (normals, numpy.sqrt((normals**2).sum(axis=1)), longest)
+
+# Takes welded (vertices, faces) and returns {problem: face indices},
+# one face per problem edge, for each check in PROBLEMS.
+# The normals are worked out NORMAL_CHUNK faces at a time and the
+# edges sorted a range of vertices (about CHECK_CHUNK edges) at a time,
+# so the temporaries stay small next to the mesh itself
+def check_mesh(vertices, faces):
+  faces = numpy.asarray(faces, dtype=index_type(len(vertices)))
+  problems = collections.OrderedDict()
+
+  # triangles using a vertex twice, and triangles flattened to a line
+  degenerate = (faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2]) | (faces[:, 2] == faces[:, 0])
+  zero_area = numpy.zeros(len(faces), dtype=bool)
+  normals = numpy.empty((len(faces), 3), dtype=numpy.float32)
+  areas = numpy.empty(len(faces), dtype=numpy.float32)
+  for start in range(0, len(faces), NORMAL_CHUNK):
+    (chunk_normals, chunk_areas, longest) = face_normals(vertices, faces[start:start+NORMAL_CHUNK])
+    normals[start:start+NORMAL_CHUNK] = chunk_normals
+    areas[start:start+NORMAL_CHUNK] = chunk_areas
+    zero_area[start:start+NORMAL_CHUNK] = chunk_areas <= ZERO_AREA*longest
+  zero_area &= ~degenerate
+
+  # every edge of every proper triangle, keyed by its lower vertex.
+  # a triangle's edges are slots 3*face to 3*face+2
+  starts = faces.ravel()
+  ends = faces[:, [1, 2, 0]].ravel()
+  lows = numpy.minimum(starts, ends)
+  lows[numpy.repeat(degenerate, 3)] = -1 # in no range
+  found = dict((name, []) for name in ("holes", "non_manifold", "flipped", "folded"))
+  ranges = max(1, -(-len(lows)//CHECK_CHUNK))
+  limits = numpy.linspace(0, len(vertices), ranges + 1).astype(numpy.int64)
+  for (low, high) in zip(limits[:-1], limits[1:]):
+    # this range's edges, sorted so the triangles on each edge sit together
+    slots = numpy.flatnonzero((lows >= low) & (lows < high))
+    (edge_starts, edge_ends) = (starts[slots], ends[slots])
+    keys = numpy.minimum(edge_starts, edge_ends).astype(numpy.int64)*len(vertices) + numpy.maximum(edge_starts, edge_ends)
+    order = numpy.argsort(keys)
+    keys = keys[order]
+    forward = (edge_starts < edge_ends)[order] # which way round the triangle goes along the edge
+    owners = slots[order]//3
+    del slots, edge_starts, edge_ends, order
+
+    first = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = numpy.diff(numpy.concatenate((first, [len(keys)])))
+    pairs = first[counts == 2]
+
+    # two triangles on an edge should run along it in opposite directions,
+    # and once they agree on that their normals shouldn't point back at each other
+    flipped = forward[pairs] == forward[pairs + 1]
+    (a, b) = (owners[pairs], owners[pairs + 1])
+    products = numpy.take(areas, a).astype(numpy.float64)*numpy.take(areas, b)
+    cosines = (numpy.take(normals, a, axis=0)*numpy.take(normals, b, axis=0)).sum(axis=1, dtype=numpy.float64)
+    cosines /= numpy.where(products > 0, products, 1.0)
+    cosines[flipped] = -cosines[flipped]
+    folded = (cosines < FOLD_COSINE) & (products > 0)
+
+    found["holes"].append(owners[first[counts == 1]])
+    found["non_manifold"].append(owners[first[counts > 2]])
+    found["flipped"].append(a[flipped])
+    found["folded"].append(a[folded])
+
+  problems["holes"] = numpy.concatenate(found["holes"])
+  problems["non_manifold"] = numpy.concatenate(found["non_manifold"])
+  problems["degenerate"] = numpy.flatnonzero(degenerate)
+  problems["zero_area"] = numpy.flatnonzero(zero_area)
+  problems["flipped"] = numpy.concatenate(found["flipped"])
+  problems["folded"] = numpy.concatenate(found["folded"])
+  return problems
+
+# Takes (vertices, faces) and the groove layout
+# (center x, center y, radius of the first groove's outer edge, groove pitch)
+# and returns the groove number and angle (degrees) of each face's center.
+# faces outside the first groove get -1
+def groove_locations(vertices, faces, layout):
+  (center_x, center_y, outer_edge, pitch) = layout
+  centers = numpy.asarray(vertices, dtype=numpy.float64)[faces].mean(axis=1)
+  radii = numpy.hypot(centers[:, 0] - center_x, centers[:, 1] - center_y)
+  angles = numpy.arctan2(centers[:, 1] - center_y, centers[:, 0] - center_x) % (2*math.pi)
+  grooves = numpy.floor((outer_edge - radii)/pitch - angles/(2*math.pi)).astype(numpy.int64) # the spiral steps in a pitch a turn
+  return (numpy.maximum(grooves, -1), numpy.degrees(angles))
+
+# Takes welded (vertices, faces) and the groove layout (or None),
+# checks them and returns a report:
+# {"vertices", "triangles", "problems": {problem: {"count", "grooves", "locations"}}},
+# locations being (groove, degrees) examples from different grooves.
+# Only the faces with problems are located
+def check_welded(vertices, faces, layout=None):
+  report = collections.OrderedDict()
+  report["vertices"] = len(vertices)
+  report["triangles"] = len(faces)
+  report["problems"] = collections.OrderedDict()
+  problems = check_mesh(vertices, faces)
+  if layout is not None:
+    located = numpy.unique(numpy.concatenate(list(problems.values())))
+    (face_grooves, face_angles) = groove_locations(vertices, numpy.asarray(faces)[located], layout)
+  for name, indices in problems.items():
+    problem = collections.OrderedDict([("count", len(indices)), ("grooves", []), ("locations", [])])
+    if len(indices) and layout is not None:
+      where = numpy.searchsorted(located, indices)
+      (grooves, angles) = (face_grooves[where], face_angles[where])
+      (problem_grooves, firsts) = numpy.unique(grooves, return_index=True)
+      problem["grooves"] = problem_grooves.tolist()
+      firsts = numpy.sort(firsts)[:LOCATIONS_SHOWN] # the first one found in each of the first few grooves
+      problem["locations"] = [(int(grooves[i]), round(float(angles[i]), 2)) for i in firsts]
+    report["problems"][name] = problem
+  return report
+
+# Takes (vertices, faces) as generated or read and the groove layout
+# (or None), welds them and returns check_welded()'s report on them
+def check(vertices, faces, layout=None):
+  (vertices, faces) = weld(vertices, faces)
+  return check_welded(vertices, faces, layout)
+
+# Reads the mesh file and returns check_welded()'s report on it,
+# letting go of the mesh as read once it is welded
+def check_file(filename, layout=None):
+  (vertices, faces) = weld(*read_mesh(filename))
+  return check_welded(vertices, faces, layout)
+
+# Returns how a groove number reads in reports
+def groove_name(groove):
+  return "edge" if groove < 0 else "groove %d" % groove
+
+# Takes check()'s report and returns it as printable lines
+def report_lines(report):
+  lines = ["%d triangles, %d vertices once welded" % (report["triangles"], report["vertices"])]
+  for name, problem in report["problems"].items():
+    line = "  %-34s %10d" % (PROBLEMS[name] + ":", problem["count"])
+    if problem["grooves"]:
+      shown = ", ".join(groove_name(groove).split()[-1] for groove in problem["grooves"][:GROOVES_SHOWN])
+      more = len(problem["grooves"]) - GROOVES_SHOWN
+      line += "  in grooves " + shown + (" and %d more" % more if more > 0 else "")
+      line += "; e.g. " + ", ".join("%s at %.1f deg" % (groove_name(groove), angle) for groove, angle in problem["locations"])
+    lines.append(line)
+  return lines
+
+#######################################
+#                                     #
+#                MAIN                 #
+#                                     #
+#######################################
+
+# Reads the program args, checks each file and returns
+# the exit status, 1 if any file has holes, non-manifold edges or flipped winding.
+# The grooves are located from the record's spec flags, the ones
+# records.py batch takes that move them, the rest are the generator's defaults
+def main(argv=None):
+  import records, stl_generator # only for the groove layout
+
+  parser = argparse.ArgumentParser(description="checks generated record meshes for holes, bad triangles and overlapping grooves")
+  parser.add_argument("filenames", nargs="+", help=".stl, .ply, .obj or .3mf files to check")
+  parser.add_argument("--no-grooves", action="store_true", help="don't locate problems by groove number")
+  parser.add_argument("--dpi", type=float, help="the dpi the record was rendered at, which sets the groove width")
+  parser.add_argument("--diameter", type=float, help="record diameter in inches")
+  parser.add_argument("--outer-rad", type=float, help="outermost groove radius in inches")
+  parser.add_argument("--amplitude", type=float, help="groove amplitude in inches")
+  args = parser.parse_args(argv)
+
+  layout = None
+  if not args.no_grooves:
+    stl_generator.configure(records.RecordSpec(dpi=args.dpi, diameter=args.diameter, outer_rad=args.outer_rad,
+      amplitude=args.amplitude))
+    layout = stl_generator.grooveLayout()
+  status = 0
+  for filename in args.filenames:
+    report = check_file(filename, layout)
+    print("%s: %s" % (filename, "\n".join(report_lines(report))))
+    if any(report["problems"][name]["count"] for name in FAILING):
+      status = 1
+  return status
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,392 @@
+# mesh output for the stl generator
+# writes geometry to disk block by block as it is generated,
+# so the whole mesh never has to sit in memory at once.
+# stl takes triangle soup, ply/obj/3mf take indexed
+# vertices and faces so shared vertices are only written once
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import os
+import time
+import shutil
+import struct
+import zipfile
+import tempfile
+import numpy
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+STL_HEADER = b"binary STL written by making-records"
+FORMAT_CHUNK = 2**16 # rows formatted per string operation by the text writers
+STORE_CHUNK = 2**20 # triangles copied from a MeshStore to a writer at a time
+STORE_GROWTH = 1.5 # how much a full MeshStore grows by
+THREEMF_DATE = (1980, 1, 1, 0, 0, 0) # of every file in a 3mf package, so the same mesh always zips the same
+
+# about how many bytes each (vertex, triangle) takes in each format, for size estimates.
+# the text formats vary with the numbers written, 3mf with how well it deflates
+APPROX_BYTES = {
+  "stl": (0, 50),
+  "ply": (12, 13),
+  "obj": (34, 26),
+  "3mf": (16, 12),
+}
+
+# one binary stl triangle: normal, three vertices, attribute byte count (50 bytes)
+STL_TRIANGLE = numpy.dtype([
+  ("normal", "<f4", (3,)),
+  ("vertices", "<f4", (3, 3)),
+  ("attr", "<u2"),
+])
+
+# one binary ply face: vertex count then three indices (13 bytes)
+PLY_FACE = numpy.dtype([
+  ("count", "u1"),
+  ("indices", "<i4", (3,)),
+])
+
+THREEMF_CONTENT_TYPES = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+ <Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+ <Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>
+</Types>
+"""
+THREEMF_RELS = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+ <Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>
+"""
+THREEMF_MODEL_START = b"""<?xml version="1.0" encoding="UTF-8"?>
+<model unit="inch" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">
+ <resources>
+  <object id="1" type="model">
+   <mesh>
+    <vertices>
+"""
+THREEMF_MODEL_MIDDLE = b"""    </vertices>
+    <triangles>
+"""
+THREEMF_MODEL_END = b"""    </triangles>
+   </mesh>
+  </object>
+ </resources>
+ <build>
+  <item objectid="1"/>
+ </build>
+</model>
+"""
+
+#######################################
+#                                     #
+#        GEOMETRY FUNCTIONS           #
+#                                     #
+#######################################
+
+# Takes an (n,3,3) array of triangles and returns their
+# (n,3) unit normals following the right hand rule.
+# Degenerate triangles get a zero normal.
+def triangle_normals(triangles):
+  normals = numpy.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+  lengths = numpy.sqrt((normals**2).sum(axis=1))
+  lengths[lengths == 0] = 1.0
+  return normals/lengths[:, numpy.newaxis]
+
+# Takes a format and the vertex and triangle counts of a mesh
+# and returns about how many bytes the file will take
+def estimated_size(format, vertex_count, triangle_count):
+  (per_vertex, per_triangle) = APPROX_BYTES[format]
+  return 84 + per_vertex*vertex_count + per_triangle*triangle_count # 84: stl header and count, or near enough any other header
+
+# Takes an (n,3) vertex array and an (m,3) face array indexing into it,
+# and returns the m binary stl triangle records.
+# The normals are worked out from the float32 vertices the file stores,
+# so a mesh kept in a float32 MeshStore gets the same ones as a streamed one.
+# Kept separate from writing so worker processes can do the encoding.
+def encode_stl(vertices, faces):
+  triangles = numpy.asarray(vertices, dtype=numpy.float32)[faces].astype(numpy.float64)
+  records = numpy.zeros(len(faces), dtype=STL_TRIANGLE)
+  records["normal"] = triangle_normals(triangles)
+  records["vertices"] = triangles
+  return records
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+# Writes each row of a 2d array through the given printf style line format.
+# Formats a chunk of rows per string operation, which is much quicker
+# than numpy.savetxt's one call per row
+def write_rows(f, line, rows, chunk=FORMAT_CHUNK):
+  line += "\n"
+  for start in range(0, len(rows), chunk):
+    block = rows[start:start+chunk]
+    f.write(((line*len(block)) % tuple(block.ravel().tolist())).encode("ascii"))
+
+# Opens one of a writer's files: a new one, or when resuming from
+# a checkpoint ({filename: size} of every file), the existing one
+# cut back to the size it had then, ready to append to
+def open_part(filename, sizes=None):
+  if sizes is None:
+    return open(filename, "wb")
+  f = open(filename, "r+b")
+  f.truncate(sizes[filename])
+  f.seek(0, 2)
+  return f
+
+# Flushes the given open files all the way to disk
+# and returns {filename: size} for open_part
+def part_sizes(files):
+  sizes = {}
+  for f in files:
+    f.flush()
+    os.fsync(f.fileno())
+    sizes[f.name] = f.tell()
+  return sizes
+
+# Concatenates the given files onto the end of an open file
+# and deletes them
+def append_files(out, filenames):
+  for filename in filenames:
+    with open(filename, "rb") as f:
+      shutil.copyfileobj(f, out)
+    os.remove(filename)
+
+# Writes a binary stl incrementally.
+# Each call to write() appends the triangles of one mesh block,
+# close() goes back and fills in the triangle count in the header.
+# Every writer can checkpoint() what it has written so far, and
+# given that state back picks up from there, dropping anything after it
+class StlWriter:
+  def __init__(self, filename, state=None):
+    self.filename = filename
+    self.count = 0 if state is None else state["count"]
+    self.f = open_part(filename, state and state["sizes"])
+    if state is None:
+      self.f.write(STL_HEADER.ljust(80, b" "))
+      self.f.write(struct.pack("<I", 0)) # patched by close()
+
+  # takes an (n,3) vertex array and an (m,3) face array
+  # indexing into it, and appends the m triangles
+  def write(self, vertices, faces):
+    if len(faces) == 0:
+      return
+    self.write_records(encode_stl(vertices, faces))
+
+  # appends triangles already encoded by encode_stl
+  def write_records(self, records):
+    self.f.write(records.tobytes())
+    self.count += len(records)
+
+  def checkpoint(self):
+    return {"sizes": part_sizes([self.f]), "count": self.count}
+
+  def close(self):
+    self.f.seek(80)
+    self.f.write(struct.pack("<I", self.count))
+    self.f.close()
+
+# Writes a binary little endian ply incrementally.
+# Vertices and faces are spooled to temp files next to the output
+# since the header needs both counts before either list.
+class PlyWriter:
+  def __init__(self, filename, state=None):
+    self.filename = filename
+    self.vertex_count = 0 if state is None else state["vertex_count"]
+    self.face_count = 0 if state is None else state["face_count"]
+    self.vertex_file = open_part(filename + ".vertices.tmp", state and state["sizes"])
+    self.face_file = open_part(filename + ".faces.tmp", state and state["sizes"])
+
+  # takes an (n,3) vertex array, its vertices get the next n indices
+  def add_vertices(self, vertices):
+    self.vertex_file.write(numpy.asarray(vertices, dtype="<f4").tobytes())
+    self.vertex_count += len(vertices)
+
+  # takes an (m,3) face array of indices into all vertices added so far
+  def add_faces(self, faces):
+    records = numpy.empty(len(faces), dtype=PLY_FACE)
+    records["count"] = 3
+    records["indices"] = faces
+    self.face_file.write(records.tobytes())
+    self.face_count += len(faces)
+
+  def checkpoint(self):
+    return {"sizes": part_sizes([self.vertex_file, self.face_file]),
+      "vertex_count": self.vertex_count, "face_count": self.face_count}
+
+  def close(self):
+    self.vertex_file.close()
+    self.face_file.close()
+    with open(self.filename, "wb") as out:
+      out.write(("ply\n"
+        "format binary_little_endian 1.0\n"
+        "element vertex %d\n"
+        "property float x\n"
+        "property float y\n"
+        "property float z\n"
+        "element face %d\n"
+        "property list uchar int vertex_indices\n"
+        "end_header\n" % (self.vertex_count, self.face_count)).encode("ascii"))
+      append_files(out, [self.vertex_file.name, self.face_file.name])
+
+# Writes a wavefront obj incrementally.
+# Obj lets faces follow the vertices they use anywhere in the file,
+# so everything goes straight to the output.
+class ObjWriter:
+  def __init__(self, filename, state=None):
+    self.filename = filename
+    self.f = open_part(filename, state and state["sizes"])
+
+  def add_vertices(self, vertices):
+    write_rows(self.f, "v %.9g %.9g %.9g", numpy.asarray(vertices, dtype=numpy.float32))
+
+  def add_faces(self, faces):
+    write_rows(self.f, "f %d %d %d", numpy.asarray(faces) + 1) # obj counts from 1
+
+  def checkpoint(self):
+    return {"sizes": part_sizes([self.f])}
+
+  def close(self):
+    self.f.close()
+
+# Writes a 3mf package (zipped xml mesh, units in inches).
+# The vertex and triangle lists are spooled to temp files,
+# then stitched into the model and deflated into the zip on close.
+class ThreeMfWriter:
+  def __init__(self, filename, state=None):
+    self.filename = filename
+    self.vertex_file = open_part(filename + ".vertices.tmp", state and state["sizes"])
+    self.face_file = open_part(filename + ".faces.tmp", state and state["sizes"])
+
+  def add_vertices(self, vertices):
+    write_rows(self.vertex_file, '     <vertex x="%.9g" y="%.9g" z="%.9g"/>',
+      numpy.asarray(vertices, dtype=numpy.float32))
+
+  def add_faces(self, faces):
+    write_rows(self.face_file, '     <triangle v1="%d" v2="%d" v3="%d"/>', numpy.asarray(faces))
+
+  def checkpoint(self):
+    return {"sizes": part_sizes([self.vertex_file, self.face_file])}
+
+  def close(self):
+    self.vertex_file.close()
+    self.face_file.close()
+    model = self.filename + ".model.tmp"
+    with open(model, "wb") as out:
+      out.write(THREEMF_MODEL_START)
+      append_files(out, [self.vertex_file.name])
+      out.write(THREEMF_MODEL_MIDDLE)
+      append_files(out, [self.face_file.name])
+      out.write(THREEMF_MODEL_END)
+
+    package = zipfile.ZipFile(self.filename, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+    for name, content in (("[Content_Types].xml", THREEMF_CONTENT_TYPES), ("_rels/.rels", THREEMF_RELS)):
+      entry = zipfile.ZipInfo(name, THREEMF_DATE)
+      entry.compress_type = zipfile.ZIP_DEFLATED
+      entry.external_attr = 0o600 << 16
+      package.writestr(entry, content)
+    stamp = time.mktime(THREEMF_DATE + (0, 0, -1)) # the model is zipped from disk, dated by its local modification time
+    os.utime(model, (stamp, stamp))
+    package.write(model, "3D/3dmodel.model")
+    package.close()
+    os.remove(model)
+
+# Keeps a whole mesh in two preallocated arrays, float32 vertices and uint32
+# faces, instead of a list of blocks. Sized up front from the expected
+# counts, it only grows (by STORE_GROWTH) if they run over.
+# Given a directory, the arrays are memory mapped files there,
+# so a mesh bigger than memory pages out to disk instead of swapping
+class MeshStore:
+  def __init__(self, vertex_capacity, face_capacity, directory=None):
+    self.directory = directory
+    self.vertex_count = 0
+    self.face_count = 0
+    self.files = {}
+    self.vertices = self.allocate("vertices", numpy.float32, max(1, int(vertex_capacity)))
+    self.faces = self.allocate("faces", numpy.uint32, max(1, int(face_capacity)))
+
+  # returns a new (rows, 3) array of the given dtype,
+  # mapped onto a fresh temp file when there is a directory
+  def allocate(self, name, dtype, rows):
+    if self.directory is None:
+      return numpy.empty((rows, 3), dtype=dtype)
+    handle, filename = tempfile.mkstemp(prefix="mesh-", suffix="." + name, dir=self.directory)
+    os.close(handle)
+    self.files[name] = filename
+    return numpy.memmap(filename, dtype=dtype, mode="w+", shape=(rows, 3))
+
+  # grows the named array to hold at least rows rows, keeping what is in it.
+  # a mapped file is unmapped, extended and mapped again
+  def grow(self, name, rows):
+    array = getattr(self, name)
+    rows = max(rows, int(len(array)*STORE_GROWTH))
+    if self.directory is None:
+      grown = numpy.empty((rows, 3), dtype=array.dtype)
+      grown[:len(array)] = array
+      setattr(self, name, grown)
+      return
+    array.flush()
+    dtype = array.dtype
+    del array
+    setattr(self, name, None)
+    with open(self.files[name], "r+b") as f:
+      f.truncate(rows*3*dtype.itemsize)
+    setattr(self, name, numpy.memmap(self.files[name], dtype=dtype, mode="r+", shape=(rows, 3)))
+
+  # takes an (n,3) vertex array, its vertices get the next n indices
+  def add_vertices(self, vertices):
+    end = self.vertex_count + len(vertices)
+    if end > len(self.vertices):
+      self.grow("vertices", end)
+    self.vertices[self.vertex_count:end] = vertices
+    self.vertex_count = end
+
+  # takes an (m,3) face array of indices into all vertices added so far
+  def add_faces(self, faces):
+    end = self.face_count + len(faces)
+    if end > len(self.faces):
+      self.grow("faces", end)
+    self.faces[self.face_count:end] = faces
+    self.face_count = end
+
+  # forgets everything added so far, keeping the arrays to refill
+  def clear(self):
+    self.vertex_count = 0
+    self.face_count = 0
+
+  # copies the mesh to the given writer, a chunk at a time.
+  # stl gets each chunk of triangles with just their own vertices
+  def write_to(self, writer):
+    if hasattr(writer, "add_faces"):
+      for start in range(0, self.vertex_count, STORE_CHUNK):
+        writer.add_vertices(self.vertices[start:min(start+STORE_CHUNK, self.vertex_count)])
+      for start in range(0, self.face_count, STORE_CHUNK):
+        writer.add_faces(self.faces[start:min(start+STORE_CHUNK, self.face_count)].astype(numpy.int64))
+    else:
+      for start in range(0, self.face_count, STORE_CHUNK):
+        faces = self.faces[start:min(start+STORE_CHUNK, self.face_count)]
+        writer.write(self.vertices[faces.ravel()], numpy.arange(faces.size, dtype=numpy.int64).reshape(-1, 3))
+
+  # frees the arrays, deleting any files behind them
+  def close(self):
+    self.vertices = None
+    self.faces = None
+    for filename in self.files.values():
+      os.remove(filename)
+    self.files = {}
+
+# output writer for each format, by file extension
+WRITERS = {
+  "stl": StlWriter,
+  "ply": PlyWriter,
+  "obj": ObjWriter,
+  "3mf": ThreeMfWriter,
+}
+INDEXED_FORMATS = ("ply", "obj", "3mf") # writers taking add_vertices/add_faces instead of write
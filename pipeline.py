@@ -0,0 +1,149 @@
+# pipelined execution for the record generators
+# lets decoding, geometry and writing overlap instead of taking
+# turns: a stage runs in its own thread and hands its results on
+# through a bounded queue, so it can only get so far ahead of the
+# next stage and memory stays capped however long the record is
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import sys
+import threading
+try:
+  import queue
+except ImportError: # python 2
+  import Queue as queue
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+QUEUE_DEPTH = 8 # blocks a stage may get ahead of the next one
+POLL_SECONDS = 0.1 # how often a blocked stage checks whether it was abandoned
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Takes an iterable and the number of items it may run ahead, and
+# yields its items in order while a background thread works out the
+# next ones. An error in the thread is raised here, where the item
+# it failed on would have come out. Closing the generator early (or
+# dropping it) stops the thread
+def prefetch(items, depth=QUEUE_DEPTH):
+  pending = queue.Queue(max(1, depth))
+  stop = threading.Event()
+
+  def hand_on(entry): # put, unless the consumer has gone away
+    while not stop.is_set():
+      try:
+        pending.put(entry, timeout=POLL_SECONDS)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def produce():
+    try:
+      for item in items:
+        if not hand_on((True, item)):
+          return
+      hand_on((False, None))
+    except Exception:
+      hand_on((False, sys.exc_info()[1]))
+
+  thread = threading.Thread(target=produce)
+  thread.daemon = True
+  thread.start()
+  try:
+    while True:
+      (more, item) = pending.get()
+      if not more:
+        if item is not None:
+          raise item
+        return
+      yield item
+  finally:
+    stop.set()
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+# Wraps a mesh writer (or any other writer, such as a laser backend)
+# and makes its calls from a writer thread, fed through a bounded queue.
+# The caller only waits when the writer falls QUEUE_DEPTH blocks
+# behind. The blocks handed over must not be changed afterwards.
+# checkpoint() and close() (save() for a laser backend) wait for
+# everything queued to be written, and any error the writer hit
+# is raised from the next call
+class WriterThread:
+  def __init__(self, writer, depth=QUEUE_DEPTH):
+    self.writer = writer
+    self.pending = queue.Queue(max(1, depth))
+    self.error = None
+    self.thread = threading.Thread(target=self.run)
+    self.thread.daemon = True
+    self.thread.start()
+
+  # the writer thread: makes each queued call until told to stop
+  def run(self):
+    while True:
+      (name, args) = self.pending.get()
+      try:
+        if name is None:
+          return
+        if self.error is None or name in ("close", "save"): # skip the rest once one has failed, but still close
+          getattr(self.writer, name)(*args)
+      except Exception:
+        self.error = sys.exc_info()[1]
+      finally:
+        self.pending.task_done()
+
+  # queues a call to the writer
+  def send(self, name, *args):
+    self.raise_error()
+    self.pending.put((name, args))
+
+  # waits for every queued call to be made
+  def drain(self):
+    self.pending.join()
+    self.raise_error()
+
+  def raise_error(self):
+    if self.error is not None:
+      raise self.error
+
+  # any other method of the writer (write, add_vertices...) is queued,
+  # and only the writer's own methods are there, so hasattr still
+  # tells the kinds of writer apart
+  def __getattr__(self, name):
+    attribute = getattr(self.writer, name)
+    if not callable(attribute):
+      return attribute
+    return lambda *args: self.send(name, *args)
+
+  def checkpoint(self):
+    self.drain()
+    return self.writer.checkpoint()
+
+  def close(self):
+    self.finish("close")
+
+  def save(self):
+    self.finish("save")
+
+  # queues the writer's last call, then waits for the thread to make it and stop
+  def finish(self, name):
+    self.pending.put((name, ()))
+    self.pending.put((None, None))
+    self.thread.join()
+    self.raise_error()
@@ -0,0 +1,159 @@
+# raster previews of a record
+# splats points of the groove spiral (in inches) onto a top down
+# grid and keeps the mean groove floor height under each pixel,
+# then writes the result as a png. no imaging library needed,
+# the png is encoded with zlib straight from the numpy array,
+# a band of rows at a time for images too big to hold at once
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import zlib
+import struct
+import numpy
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_COMPRESSION = 6 # zlib level, the maps are mostly flat so this is plenty
+PNG_CHUNK = 2**24 # compressed bytes held before they go out as an IDAT chunk
+
+BACKGROUND = (0, 0, 0) # outside the record and in the center hole
+MARKER = (64, 128, 255) # guide circles, like the innermost groove radius
+WARNING = (255, 0, 0) # pixels where the groove floor goes through the bottom of the record
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Takes a png chunk type and its data and returns the chunk bytes
+def png_chunk(kind, data):
+  return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+# Writes an (h,w) grey or (h,w,3) rgb uint8 array as an 8 bit png,
+# row 0 at the top
+def write_png(filename, pixels):
+  pixels = numpy.asarray(pixels)
+  png = PngWriter(filename, pixels.shape[1], pixels.ndim == 3)
+  png.write_rows(pixels)
+  png.close()
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+# Writes a png a band of rows at a time, top row first:
+# 8 bit from uint8 rows, 16 bit from uint16 rows.
+# the compressed data goes out in IDAT chunks of PNG_CHUNK bytes,
+# and close() finishes the image once every row has been written
+class PngWriter:
+  def __init__(self, filename, width, rgb=False, bit_depth=8):
+    self.file = open(filename, "wb")
+    self.width = width
+    self.rgb = rgb
+    self.dtype = numpy.dtype(">u2") if bit_depth == 16 else numpy.dtype(numpy.uint8) # png is big endian
+    self.rows = 0
+    self.compressor = zlib.compressobj(PNG_COMPRESSION)
+    self.pending = [] # compressed data not yet in a chunk
+    self.pending_bytes = 0
+    self.file.write(PNG_SIGNATURE)
+    self.header_at = self.file.tell()
+    self.file.write(png_chunk(b"IHDR", self.header(0))) # the height goes in once it is known
+
+  # the IHDR data for an image the given number of rows high
+  def header(self, height):
+    return struct.pack(">IIBBBBB", self.width, height, self.dtype.itemsize*8, 2 if self.rgb else 0, 0, 0, 0)
+
+  # takes an (h,w) grey or (h,w,3) rgb array of the next h rows
+  def write_rows(self, pixels):
+    pixels = numpy.asarray(pixels).astype(self.dtype)
+    height = pixels.shape[0]
+    rows = numpy.zeros((height, 1 + pixels[0].nbytes), dtype=numpy.uint8) # each row starts with filter type 0
+    rows[:, 1:] = pixels.reshape(height, -1).view(numpy.uint8)
+    self.write_data(self.compressor.compress(rows.tobytes()))
+    self.rows += height
+
+  # holds compressed data until there is a chunk's worth, or all of it when ending
+  def write_data(self, data, ending=False):
+    self.pending.append(data)
+    self.pending_bytes += len(data)
+    if self.pending_bytes >= PNG_CHUNK or (ending and self.pending_bytes):
+      self.file.write(png_chunk(b"IDAT", b"".join(self.pending)))
+      self.pending = []
+      self.pending_bytes = 0
+
+  def close(self):
+    self.write_data(self.compressor.flush(), True)
+    self.file.write(png_chunk(b"IEND", b""))
+    self.file.seek(self.header_at)
+    self.file.write(png_chunk(b"IHDR", self.header(self.rows)))
+    self.file.close()
+
+# A size x size pixel top down map of a square extent inches across,
+# (0,0) at the bottom left like the generators' coordinates.
+# add() accumulates heights per pixel, so any number of points
+# can go in a chunk at a time, and heights() gives each pixel's mean
+class DepthMap:
+  def __init__(self, extent, size):
+    self.extent = float(extent)
+    self.size = size
+    self.sums = numpy.zeros(size*size)
+    self.counts = numpy.zeros(size*size)
+    self.markers = numpy.zeros(size*size, dtype=bool)
+
+  # takes x and y arrays (inches) and returns the flat pixel
+  # index of each point, or -1 for points off the map
+  def pixel_index(self, x, y):
+    column = numpy.floor(numpy.asarray(x)/self.extent*self.size).astype(numpy.int64)
+    row = self.size - 1 - numpy.floor(numpy.asarray(y)/self.extent*self.size).astype(numpy.int64)
+    inside = (column >= 0) & (column < self.size) & (row >= 0) & (row < self.size)
+    return numpy.where(inside, row*self.size + column, -1)
+
+  # adds points at x, y (inches) with the given heights
+  def add(self, x, y, heights):
+    index = self.pixel_index(x, y)
+    inside = index >= 0
+    self.sums += numpy.bincount(index[inside], weights=numpy.asarray(heights, dtype=numpy.float64)[inside],
+      minlength=self.sums.size)
+    self.counts += numpy.bincount(index[inside], minlength=self.counts.size)
+
+  # marks a circle of the given radius around (cx, cy) to draw over the map
+  def mark_circle(self, cx, cy, radius):
+    steps = max(16, int(8*numpy.pi*radius/self.extent*self.size)) # a few points per pixel
+    theta = numpy.linspace(0, 2*numpy.pi, steps, endpoint=False)
+    index = self.pixel_index(cx + radius*numpy.cos(theta), cy + radius*numpy.sin(theta))
+    self.markers[index[index >= 0]] = True
+
+  # returns the (size, size) mean height under each pixel,
+  # with the given fill height where nothing was added
+  def heights(self, fill):
+    heights = numpy.full(self.sums.size, float(fill))
+    hit = self.counts > 0
+    heights[hit] = self.sums[hit]/self.counts[hit]
+    return heights.reshape(self.size, self.size)
+
+  # returns the (size, size) radius of each pixel's center from (cx, cy)
+  def radii(self, cx, cy):
+    centers = (numpy.arange(self.size) + 0.5)*self.extent/self.size
+    return numpy.hypot(centers[numpy.newaxis, :] - cx, centers[::-1, numpy.newaxis] - cy)
+
+  # returns the map as an (size, size, 3) rgb image: heights from low (black)
+  # to high (white) shaded grey, pixels below limit in WARNING, marked circles
+  # in MARKER and pixels outside the given mask in BACKGROUND
+  def render(self, heights, low, high, mask, limit):
+    shade = numpy.clip((heights - low)/float(high - low), 0.0, 1.0)
+    image = numpy.repeat(numpy.round(255*shade).astype(numpy.uint8)[:, :, numpy.newaxis], 3, axis=2)
+    image[heights < limit] = WARNING
+    image[self.markers.reshape(self.size, self.size)] = MARKER
+    image[~mask] = BACKGROUND
+    return image
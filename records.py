@@ -0,0 +1,279 @@
+# library api for the record generators
+# describe a record with a RecordSpec and render it with
+# render_stl() or render_laser(), as many times as you like
+# from one process. Each render puts every generator setting
+# back to its default, applies its spec and any settings passed
+# by name, and starts from clean state, so nothing carries
+# over from one record to the next.
+# The generators keep their settings and the record being drawn
+# in module globals, so a process renders one record at a time:
+# don't call these from several threads at once. To render
+# several at once use processes, as the batch runner does.
+#
+# also a command line batch runner, so a whole album renders
+# in a few warm worker processes:
+#   python records.py batch album_dir --kind stl --workers 4
+#   python records.py batch tracks.txt --kind laser --format svg
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import os
+import sys
+import argparse
+import multiprocessing
+import numpy
+import audio_processing
+import laser_output
+import mesh_output
+import pipeline
+import stl_generator
+import laser_cut_generator
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+AUDIO_EXTENSIONS = (".wav", ".mp3")
+KINDS = ("stl", "laser")
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+# The parameters of one record. Lengths are in inches.
+# Anything left as None uses the generator's own default
+# (33.3 rpm/600 dpi for stl, 45 rpm/1200 dpi for laser).
+# format is the stl generator's mesh format (stl, ply, obj, 3mf)
+# or the laser generator's output format (pdf, svg, dxf, gcode).
+# steps_per_rev is how many groove samples the stl generator
+# resamples the audio to per revolution (the laser generator ignores it)
+class RecordSpec:
+  def __init__(self, rpm=None, dpi=None, diameter=None, inner_rad=None, outer_rad=None,
+      amplitude=None, channels=None, format=None, steps_per_rev=None):
+    self.rpm = rpm
+    self.dpi = dpi
+    self.diameter = diameter # of the whole record
+    self.inner_rad = inner_rad # innermost groove radius
+    self.outer_rad = outer_rad # outermost groove radius
+    self.amplitude = amplitude # of the loudest sample
+    self.channels = channels # channel mode: left, mean or mid
+    self.format = format
+    self.steps_per_rev = steps_per_rev
+
+  def __repr__(self):
+    return "RecordSpec(%s)" % ", ".join("%s=%r" % item for item in sorted(vars(self).items()) if item[1] is not None)
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Takes the audio to render (the path of a .wav or .mp3, or an array
+# of samples, (frames,) or (frames, channels)) and returns it as one
+# channel normalized to the given amplitude, the way the generators
+# load their program args
+def load(audio, amplitude, channels, stream, cache_dir, prefetch=0):
+  if isinstance(audio, (list, tuple, numpy.ndarray)):
+    frames = numpy.asarray(audio, dtype=numpy.float64)
+    if frames.ndim == 2:
+      frames = audio_processing.downmix(frames, channels)
+    return audio_processing.normalize(frames, amplitude)
+  return audio_processing.load_audio(audio, amplitude, channels, stream, cache_dir, prefetch)
+
+# Returns the output name for the audio: the given one, or else the
+# audio path without its extension. Arrays have no path to go by
+def output_name(audio, output):
+  if output is not None:
+    return output
+  if isinstance(audio, (list, tuple, numpy.ndarray)):
+    raise ValueError("an output name is needed when rendering an array of samples")
+  return os.path.splitext(audio)[0]
+
+# Renders a 3d printable record of the audio (a path or an array of samples)
+# with the given spec. output is the mesh file to write, by default the
+# audio's path with the mesh format's extension. workers processes
+# draw the grooves. Any other stl_generator setting can be given by
+# its name (streamMesh=False, decimateMicrons=5, pipelineMode=True...),
+# the rest are the defaults. Returns the name of the file written
+def render_stl(spec, audio, output=None, workers=1, **settings):
+  stl_generator.configure(spec, workers=max(1, workers), **settings)
+  if output is None:
+    output = output_name(audio, None) + "." + stl_generator.meshFormat
+
+  stl_generator.resetState()
+  stl_generator.metrics.start("decode")
+  audio_data = load(audio, stl_generator.amplitude, stl_generator.channelMode,
+    stl_generator.streamAudio or stl_generator.pipelineMode, stl_generator.audioCacheDir,
+    pipeline.QUEUE_DEPTH if stl_generator.pipelineMode else 0)
+  stl_generator.metrics.stop(samples=len(audio_data))
+  stl_generator.drawRecord((audio_data, len(audio_data)), output)
+  return output
+
+# Previews the stl render of the audio (a path or an array of samples)
+# with the given spec without drawing it: writes a depth map png to output,
+# by default the audio's path with _preview.png, and returns the expected
+# grooves, final radius, triangles, file size and any warnings
+def preview_stl(spec, audio, output=None, **settings):
+  stl_generator.configure(spec, **settings)
+  if output is None:
+    output = output_name(audio, None) + "_preview.png"
+
+  stl_generator.resetState()
+  stl_generator.metrics.start("decode")
+  audio_data = load(audio, stl_generator.amplitude, stl_generator.channelMode,
+    stl_generator.streamAudio, stl_generator.audioCacheDir)
+  stl_generator.metrics.stop(samples=len(audio_data))
+  return stl_generator.previewRecord((audio_data, len(audio_data)), output)
+
+# Rasterizes the top surface of the stl render of the audio (a path or
+# an array of samples) with the given spec into a dpi heightmap instead of
+# drawing its mesh. output is a .png (16 bit) or .raw (float32) file, by
+# default the audio's path with _heightmap.png, and a json descriptor of
+# the base shape goes next to it. Returns the descriptor
+def heightmap_stl(spec, audio, output=None, **settings):
+  stl_generator.configure(spec, **settings)
+  if output is None:
+    output = output_name(audio, None) + "_heightmap.png"
+
+  stl_generator.resetState()
+  stl_generator.metrics.start("decode")
+  audio_data = load(audio, stl_generator.amplitude, stl_generator.channelMode,
+    stl_generator.streamAudio, stl_generator.audioCacheDir)
+  stl_generator.metrics.stop(samples=len(audio_data))
+  return stl_generator.heightmapRecord((audio_data, len(audio_data)), output)
+
+# Renders laser cutter files of the audio (a path or an array of samples)
+# with the given spec. output is the name the numbered files are given,
+# by default the audio's path without its extension. workers processes
+# draw the files. Any other laser_cut_generator setting can be given
+# by its name (simplify_pixels=1, pipeline_mode=True...), the rest are
+# the defaults. Returns the list of files written
+def render_laser(spec, audio, output=None, workers=1, **settings):
+  laser_cut_generator.configure(spec, workers=max(1, workers), **settings)
+  output = output_name(audio, output)
+
+  laser_cut_generator.resetState()
+  laser_cut_generator.metrics.start("decode")
+  audio_data = load(audio, laser_cut_generator.amplitude, laser_cut_generator.channel_mode,
+    laser_cut_generator.stream_audio or laser_cut_generator.pipeline_mode, laser_cut_generator.audio_cache_dir,
+    pipeline.QUEUE_DEPTH if laser_cut_generator.pipeline_mode else 0)
+  laser_cut_generator.metrics.stop(samples=len(audio_data))
+  return laser_cut_generator.drawSpiral((audio_data, len(audio_data)), output)
+
+# Takes a directory or a manifest file and returns the tracks in it.
+# A directory gives every .wav and .mp3 in it, in name order.
+# A manifest lists one track path per line, relative to the manifest,
+# skipping blank lines and lines starting with #
+def find_tracks(path):
+  if os.path.isdir(path):
+    names = sorted(name for name in os.listdir(path) if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS)
+    return [os.path.join(path, name) for name in names]
+
+  tracks = []
+  with open(path) as f:
+    for line in f:
+      line = line.strip()
+      if line and not line.startswith("#"):
+        tracks.append(os.path.join(os.path.dirname(path), line))
+  return tracks
+
+# Runs in a batch worker process.
+# Takes (kind, spec, track, output dir or None), renders the
+# track and returns (track, files written, error message or None).
+# A failing track is reported instead of stopping the batch
+def render_track(job):
+  kind, spec, track, output_dir = job
+  output = None
+  if output_dir is not None:
+    output = os.path.join(output_dir, os.path.splitext(os.path.basename(track))[0])
+
+  try:
+    if kind == "stl":
+      if output is not None:
+        output += "." + (spec.format or stl_generator.settingDefaults["meshFormat"])
+      files = [render_stl(spec, track, output)]
+    else:
+      files = render_laser(spec, track, output)
+  except Exception as error:
+    return (track, [], "%s: %s" % (type(error).__name__, error))
+  return (track, files, None)
+
+# Renders every track of a directory or manifest with the same spec
+# in a pool of worker processes, each drawing whole records one after
+# another. Returns the number of tracks that failed
+def batch(path, kind, spec, workers=1, output_dir=None):
+  tracks = find_tracks(path)
+  if output_dir is not None and not os.path.isdir(output_dir):
+    os.makedirs(output_dir)
+  jobs = [(kind, spec, track, output_dir) for track in tracks]
+
+  if workers > 1:
+    pool = multiprocessing.Pool(min(workers, max(1, len(jobs))))
+    results = pool.imap_unordered(render_track, jobs)
+  else:
+    pool = None
+    results = (render_track(job) for job in jobs)
+
+  failed = 0
+  for done, (track, files, error) in enumerate(results):
+    if error is None:
+      print("[%d/%d] %s -> %s" % (done+1, len(jobs), track, ", ".join(files)))
+    else:
+      failed += 1
+      print("[%d/%d] %s failed: %s" % (done+1, len(jobs), track, error))
+
+  if pool is not None:
+    pool.close()
+    pool.join()
+  print("%d of %d tracks rendered" % (len(jobs)-failed, len(jobs)))
+  return failed
+
+# Reads the batch command's program args, runs it
+# and returns the exit status
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="renders records from the making-records generators")
+  commands = parser.add_subparsers(dest="command")
+  command = commands.add_parser("batch", help="render every track in a directory or manifest")
+  command.add_argument("path", help="a directory of .wav/.mp3 files, or a manifest listing one track per line")
+  command.add_argument("--kind", choices=KINDS, default="stl", help="what to render (default %(default)s)")
+  command.add_argument("--workers", type=int, default=1,
+    help="tracks rendered in parallel (default %(default)s)")
+  command.add_argument("--output-dir", help="where to write the results (default next to each track)")
+  command.add_argument("--format", choices=sorted(set(mesh_output.WRITERS) | set(laser_output.BACKENDS)),
+    help="output format, stl/ply/obj/3mf for stl, pdf/svg/dxf/gcode for laser")
+  command.add_argument("--rpm", type=float)
+  command.add_argument("--dpi", type=float)
+  command.add_argument("--diameter", type=float, help="record diameter in inches")
+  command.add_argument("--inner-rad", type=float, help="innermost groove radius in inches")
+  command.add_argument("--outer-rad", type=float, help="outermost groove radius in inches")
+  command.add_argument("--amplitude", type=float, help="groove amplitude in inches")
+  command.add_argument("--channels", choices=audio_processing.CHANNEL_MODES)
+  command.add_argument("--steps-per-rev", type=int, help="groove samples per revolution (stl only)")
+  args = parser.parse_args(argv)
+
+  formats = mesh_output.WRITERS if args.kind == "stl" else laser_output.BACKENDS
+  if args.format is not None and args.format not in formats:
+    parser.error("--format %s doesn't go with --kind %s" % (args.format, args.kind))
+
+  spec = RecordSpec(rpm=args.rpm, dpi=args.dpi, diameter=args.diameter, inner_rad=args.inner_rad,
+    outer_rad=args.outer_rad, amplitude=args.amplitude, channels=args.channels, format=args.format,
+    steps_per_rev=args.steps_per_rev)
+  failed = batch(args.path, args.kind, spec, max(1, args.workers), args.output_dir)
+  return 1 if failed else 0
+
+#######################################
+#                                     #
+#                MAIN                 #
+#                                     #
+#######################################
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -12,13 +12,25 @@
 #######################################
 import os
 import sys
-import wave
 import math
-import struct
 import copy
-from pydub import AudioSegment
+import zlib
+import json
+import pickle
+import shutil
+import hashlib
+import argparse
+import collections
+import multiprocessing
 import numpy
-from stl import mesh
+from numpy.lib.stride_tricks import as_strided
+import audio_processing
+import mesh_output
+import pipeline
+import angular_grid
+import instrumentation
+import preview
+import mesh_check
 
 #######################################
 #                                     #
@@ -43,6 +55,38 @@ recordBottom = 0.0 #height of bottom of record
 samplingRate = 44100.0 #(44.1khz audio initially)
 rpm = 33.3 #rev per min
 rateDivisor = 4.0 #how much we are downsampling by
+antiAlias = True #low-pass and resample the audio to samplingRate/rateDivisor up front instead of taking every rateDivisor-th sample (--no-anti-alias)
+stepsPerRev = None #groove samples (theta steps) per revolution, sets rateDivisor to match (--steps-per-rev)
+targetRate = None #or the sample rate to resample to, sets rateDivisor to match (--rate)
+channelMode = audio_processing.CHANNEL_LEFT #which channels to use: left, mean or mid
+streamAudio = False #memory map the wav, decode and resample it in blocks, keeps memory flat for long sides
+audioCacheDir = audio_processing.DEFAULT_CACHE_DIR #where decoded audio is kept between runs, None turns the cache off
+baseCacheDir = audio_processing.DEFAULT_CACHE_DIR #where the bottom and walls of the record are kept between runs, None turns the cache off
+vectorEngine = True #build each groove revolution with numpy instead of one theta step at a time
+streamMesh = True #write triangles to the output as each groove is drawn instead of keeping them all until the end
+memmapDir = None #when keeping them, keep them in memory mapped files in this directory instead of memory (--memmap)
+pipelineMode = False #write the mesh from a writer thread, and stream the audio decoding a few blocks ahead when it isn't cached or resampled, through bounded queues (--pipeline)
+meshFormat = "stl" #stl, or an indexed format that shares ring vertices between strips: ply, obj or 3mf
+workers = 1 #processes drawing grooves in parallel (--workers), 1 draws them all in this process
+grooveChunk = 4 #grooves a worker draws per task
+metricsFile = None #write each record's stage timings, memory and throughput here as json (--metrics)
+profileStage = None #run this stage under cProfile and print where its time goes (--profile)
+decimateMicrons = None #adaptive mode: drop ring vertices wherever the groove stays within this many microns without them (--tolerance)
+triangleBudget = None #adaptive mode: pick the tolerance that brings the record to about this many triangles (--triangles)
+maxDecimationSpan = 64 #most theta steps one edge may span in adaptive mode
+budgetSampleRevs = 16 #revolutions sampled to estimate the triangle count for a triangle budget
+budgetSampleSteps = 2048 #theta steps sampled from each of them
+checkMesh = False #check the written mesh for holes, bad triangles and overlapping grooves and report them by groove (--check)
+previewMode = False #rasterize a top down depth map and print the expected grooves, size etc. instead of drawing (--preview)
+previewSize = 2048 #pixels across the preview depth map
+previewChunk = 2**20 #theta steps rasterized at a time for the preview
+heightmapFormat = None #"png" or "raw": rasterize the top surface into a dpi heightmap plus a json descriptor of the base instead of drawing the mesh (--heightmap)
+heightmapChunk = 128 #rows of the heightmap rasterized at a time
+clipThreshold = 0.99 #samples this close to full amplitude count as (maybe) clipped in the preview
+checkpointEvery = 0 #grooves between checkpoints of the record being drawn, 0 turns them off (--checkpoint-every)
+checkpointDir = None #where the checkpoint directory goes, None puts it next to the output
+resume = False #carry on from the last checkpoint of an interrupted render of the same record (--resume)
+checkpointHashSamples = 65536 #samples from the start of the audio checked against the checkpoint's
 
 #groove parameters
 amplitude = 24.0*micronsPerLayer/micronsPerInch #amplitude of signal (in 16 micron steps)
@@ -55,6 +99,8 @@ secPerMin = 60.0 #seconds per minute
 thetaIter = (samplingRate*secPerMin)/(rateDivisor*rpm) #how many values of theta per cycle
 incrNum = 2.0*math.pi/thetaIter #calculcate angular incrementation amount
 samplenum = 0 #which audio sample we are currently on
+sampleStep = rateDivisor #distance in audioData between groove samples, 1 once the audio is resampled
+audioFilename = None #the audio file given in the program args
 
 #global vertex storage for quad stripping
 recordPerimeterUpper = []
@@ -68,9 +114,28 @@ grooveInnerUpper = []
 grooveInnerLower = []
 
 #global geometry storage
-vertices = [] #list of v3s
+meshStore = None #mesh_output.MeshStore holding the mesh until it is written when not streaming
 vertexCount = 0
-faces = [] #list of v3s (triangles)
+meshWriter = None #open mesh writer while streaming, blocks go straight to disk instead of into storage
+recentRings = collections.OrderedDict() #id(ring) -> (ring, length, vertex indices) for rings already in an indexed mesh
+recentRingLimit = 8 #plenty to share every ring between the strips on either side of it
+workerAudio = None #(audioData, audioLen) inherited by worker processes, too big to send with each task
+metrics = instrumentation.Metrics() #stage timings of the record being drawn
+checkpointWork = None #(directory, key) checkpoints of the record being drawn go to, None when neither checkpointing nor resuming
+checkpointBlocks = [] #(file, vertices, faces) of the stored mesh saved to the checkpoint directory so far, when not streaming
+decimateTolerance = None #tolerance (inches) the record being drawn is decimated to, None keeps every theta step
+recordBase = None #(key, (rings, vertices, faces)) of the last base record drawn, reused by the next record with the same key
+
+#every setting above with its default. configure() puts them all back before each
+#library render, so nothing one render or the program args changed carries over
+settingNames = ("dpi", "micronsPerLayer", "diameter", "innerHole", "innerRad", "outerRad", "recordHeight", "recordBottom",
+  "samplingRate", "rpm", "rateDivisor", "antiAlias", "stepsPerRev", "targetRate", "channelMode", "streamAudio",
+  "audioCacheDir", "baseCacheDir", "vectorEngine", "streamMesh", "memmapDir", "pipelineMode", "meshFormat", "workers",
+  "grooveChunk", "metricsFile", "profileStage", "decimateMicrons", "triangleBudget", "maxDecimationSpan",
+  "budgetSampleRevs", "budgetSampleSteps", "checkMesh", "previewMode", "previewSize", "previewChunk",
+  "heightmapFormat", "heightmapChunk", "clipThreshold", "checkpointEvery", "checkpointDir", "resume",
+  "checkpointHashSamples", "amplitude", "bevel", "depth", "recentRingLimit")
+settingDefaults = dict((name, globals()[name]) for name in settingNames)
 
 
 #######################################
@@ -79,10 +144,192 @@ faces = [] #list of v3s (triangles)
 #                                     #
 #######################################
 def main():
-  
-  setUpRecordShape() #draw basic shape of record
-  drawGrooves(processAudioData()) #draw in grooves
-  writeSTL() #output the result
+  parseArgs()
+  resetState()
+  if previewMode:
+    previewRecord(processAudioData(), audioFilename[:-4] + "_preview.png")
+  elif heightmapFormat is not None:
+    heightmapRecord(processAudioData(), audioFilename[:-4] + "_heightmap." + heightmapFormat)
+  else:
+    drawRecord(processAudioData(), audioFilename[:-4] + "." + meshFormat)
+
+#given the audio tuple and the filename to write,
+#draws a whole record and writes it out, then reports its metrics.
+#call resetState() before loading the audio,
+#so one process can draw any number of records one after another
+def drawRecord(audioTuple, outputFilename):
+  global meshWriter, meshStore, decimateTolerance
+
+  metrics.start("resample")
+  audioTuple = resampleAudio(audioTuple)
+  metrics.stop(samples=audioTuple[1])
+
+  metrics.start("shape")
+  decimateTolerance = adaptiveTolerance(audioTuple)
+  checkpoint = startCheckpoints(audioTuple, outputFilename)
+  try:
+    if not streamMesh:
+      meshStore = openMeshStore(audioTuple[1])
+    elif checkpoint is None:
+      meshWriter = openMeshWriter(outputFilename)
+    else: #only holds the base shape until the checkpoint replaces it
+      meshStore = mesh_output.MeshStore(0, 0)
+    setUpRecordShape() #draw basic shape of record
+    resumeFrom = None
+    if checkpoint is not None: #carry on from the checkpoint, it has the base shape and grooves so far
+      resumeFrom = restoreCheckpoint(checkpoint, outputFilename)
+    drawGrooves(audioTuple, resumeFrom) #draw in grooves
+    metrics.start("write")
+    writeMesh(outputFilename) #output the result
+    metrics.stop()
+  finally: #a failed render still deletes its memory mapped files
+    if meshStore is not None:
+      meshStore.close()
+      meshStore = None
+  finishCheckpoints()
+  stats = {}
+  if checkMesh:
+    metrics.start("check")
+    report = mesh_check.check_file(outputFilename, grooveLayout())
+    metrics.stop(triangles=report["triangles"])
+    print "\n".join(mesh_check.report_lines(report))
+    stats["problems"] = dict((name, problem["count"]) for name, problem in report["problems"].items())
+
+  metrics.report()
+  if metricsFile is not None:
+    metrics.write(metricsFile, output=outputFilename, samples=audioTuple[1], **stats)
+
+#given the audio tuple and the png filename to write, works out the spiral the
+#same way drawRecord would without building any geometry: rasterizes a top down
+#depth map of the grooves and returns (and prints) what the render would come to,
+#the groove count, the final radius, triangles, file size, and whatever looks wrong.
+#call resetState() before loading the audio, as for drawRecord
+def previewRecord(audioTuple, imageFilename):
+  global decimateTolerance
+
+  metrics.start("resample")
+  audioTuple = resampleAudio(audioTuple)
+  metrics.stop(samples=audioTuple[1])
+
+  metrics.start("preview")
+  audioData, audioLen = audioTuple
+  angles = angularGrid()
+  count = angles.count
+  radIncr = (grooveWidth+2*bevel*amplitude)/thetaIter
+  spiralGrooves = spiralGrooveCount(audioLen, count)
+  steps = (spiralGrooves+1)*count #the spiral grooves and then the penultimate one, at one radIncr per step
+  finalRadius = outerRad - steps*radIncr #where the circular locked groove ends up
+  floor = recordHeight-depth-amplitude
+
+  #splat the middle of the groove floor at each step, a chunk of steps at a time
+  depthMap = preview.DepthMap(diameter, previewSize)
+  lowest = floor
+  clipped = 0
+  for start in range(0, steps, previewChunk):
+    step = numpy.arange(start, min(start+previewChunk, steps), dtype=numpy.int64)
+    column = step % count
+    radius = outerRad - step*radIncr - grooveWidth/2
+    samplePositions = sampleStep*step
+    valid = samplePositions <= (audioLen-1)
+    samples = numpy.zeros(len(step))
+    if valid.any():
+      samples[valid] = numpy.asarray(audioData[samplePositions[valid].astype(numpy.int64)], dtype=numpy.float64)
+    depthMap.add(diameter/2+radius*angles.cosines[column], diameter/2+radius*angles.sines[column], floor+samples)
+    lowest = min(lowest, floor+samples.min())
+    clipped += int((numpy.abs(samples) >= clipThreshold*amplitude).sum())
+  lockedRadius = finalRadius - grooveWidth/2
+  depthMap.add(diameter/2+lockedRadius*angles.cosines, diameter/2+lockedRadius*angles.sines, numpy.repeat(floor, count))
+
+  depthMap.mark_circle(diameter/2, diameter/2, innerRad)
+  radii = depthMap.radii(diameter/2, diameter/2)
+  mask = (radii <= diameter/2) & (radii >= innerHole/2)
+  preview.write_png(imageFilename, depthMap.render(depthMap.heights(recordHeight), floor-amplitude, recordHeight, mask, recordBottom))
+
+  #what the full render would come to
+  decimateTolerance = adaptiveTolerance(audioTuple)
+  if decimateTolerance is None:
+    triangles = fullResolutionTriangles(spiralGrooves, count)
+  else:
+    triangles = triangleEstimator(audioTuple)(decimateTolerance)
+  indexedVertices = triangles/2 if indexedMesh() else 0 #strips that share their rings have about one vertex per two triangles
+
+  stats = collections.OrderedDict()
+  stats["preview"] = imageFilename
+  stats["grooves"] = spiralGrooves+2 #plus the penultimate and locked grooves
+  stats["final radius"] = finalRadius
+  stats["triangles"] = int(triangles)
+  stats["output size (MB)"] = mesh_output.estimated_size(meshFormat, indexedVertices, triangles)/1e6
+  stats["lowest groove floor"] = lowest
+  stats["clipped samples"] = clipped
+  warnings = []
+  if finalRadius < innerRad:
+    warnings.append("the grooves run past innerRad ("+str(innerRad)+") to "+str(round(finalRadius, 4)))
+  if finalRadius-grooveWidth-amplitude*bevel <= innerHole/2:
+    warnings.append("the grooves run into the center hole")
+  if lowest < recordBottom:
+    warnings.append("the groove floor goes through the bottom of the record (shown in red)")
+  if clipped > 0.001*max(audioLen, 1):
+    warnings.append(str(clipped)+" samples are at full amplitude, the audio may be clipped")
+  stats["warnings"] = warnings
+  metrics.stop(samples=min(int(sampleStep*steps), audioLen))
+
+  for name, value in stats.items():
+    if name != "warnings":
+      print name+": "+(str(round(value, 4)) if isinstance(value, float) else str(value))
+  for warning in warnings:
+    print "warning: "+warning
+  metrics.report()
+  if metricsFile is not None:
+    metrics.write(metricsFile, **stats)
+  return stats
+
+#given the audio tuple and the heightmap filename to write (.png or .raw),
+#rasterizes the top surface of the record instead of building its mesh:
+#its height at the center of every dpi pixel, a band of rows at a time, as a
+#16 bit png (0 is recordBottom, 65535 recordHeight) or raw little endian float32 inches.
+#writes a json descriptor of the base shape and the pixel grid next to it
+#and returns the descriptor. call resetState() before loading the audio, as for drawRecord
+def heightmapRecord(audioTuple, imageFilename):
+  metrics.start("resample")
+  audioTuple = resampleAudio(audioTuple)
+  metrics.stop(samples=audioTuple[1])
+
+  metrics.start("heightmap")
+  audioData, audioLen = audioTuple
+  count = angularGrid().count
+  radIncr = (grooveWidth+2*bevel*amplitude)/thetaIter
+  spiralGrooves = spiralGrooveCount(audioLen, count)
+  finalRadius = outerRad - (spiralGrooves+1)*count*radIncr #where the circular locked groove ends up
+  size = int(math.ceil(diameter*dpi))
+  centers = (numpy.arange(size)+0.5)/dpi #pixel centers in inches, left to right and bottom to top
+
+  raw = imageFilename.endswith(".raw")
+  if raw:
+    image = open(imageFilename, "wb")
+  else:
+    image = preview.PngWriter(imageFilename, size, bit_depth=16)
+  for top in range(0, size, heightmapChunk): #row 0 at the top, like the preview
+    heights = surfaceHeights(centers, centers[::-1][top:top+heightmapChunk], spiralGrooves, finalRadius,
+      audioData, audioLen, radIncr)
+    if raw:
+      heights.astype("<f4").tofile(image)
+    else:
+      image.write_rows(numpy.round((numpy.clip(heights, recordBottom, recordHeight)-recordBottom)/(recordHeight-recordBottom)*65535))
+  image.close()
+
+  descriptorFilename = imageFilename[:-4] + ".json"
+  descriptor = heightmapDescriptor(imageFilename, size, spiralGrooves, finalRadius)
+  with open(descriptorFilename, "w") as f:
+    json.dump(descriptor, f, indent=2)
+  metrics.stop(samples=min(int(sampleStep*(spiralGrooves+1)*count), audioLen), pixels=size*size)
+
+  print "heightmap: "+imageFilename+" ("+str(size)+"x"+str(size)+" pixels at "+str(dpi)+" dpi)"
+  print "descriptor: "+descriptorFilename
+  print "grooves: "+str(descriptor["grooves"]["count"])
+  metrics.report()
+  if metricsFile is not None:
+    metrics.write(metricsFile, output=imageFilename, samples=audioLen)
+  return descriptor
 
 
 #######################################
@@ -91,76 +338,383 @@ def main():
 #                                     #
 #######################################
 
-#uses numpy arrays to create a mesh from global vertices
-#then outputs that mesh as an stl
-def writeSTL():
-
-  vertex_array = numpy.array(vertices)
-  face_array = numpy.array(faces)
-
-  # Create the mesh
-  cube = mesh.Mesh(numpy.zeros(face_array.shape[0], dtype=mesh.Mesh.dtype))
-  for i, f in enumerate(face_array):
-    for j in range(3):
-      cube.vectors[i][j] = vertex_array[f[j],:]
-
-  # Write the mesh to file as an stl
-  filename = sys.argv[1]
-  cube.save(filename[:-4] + ".stl")
+#reads the program args into the globals they override
+def parseArgs():
+  global audioFilename, workers, metricsFile, profileStage, decimateMicrons, triangleBudget
+  global antiAlias, stepsPerRev, targetRate, previewMode, checkpointEvery, resume, memmapDir, streamMesh, pipelineMode, checkMesh
+  global heightmapFormat
+
+  parser = argparse.ArgumentParser(description="turns a .wav or .mp3 into a 3d printable record")
+  parser.add_argument("filename", help="the .wav or .mp3 to cut into the record")
+  parser.add_argument("--workers", type=int, default=workers,
+    help="processes drawing grooves in parallel (default %(default)s)")
+  parser.add_argument("--metrics", metavar="FILE", default=metricsFile,
+    help="write stage timings, memory and throughput to FILE as json")
+  parser.add_argument("--checkpoint-every", type=int, metavar="N", default=checkpointEvery,
+    help="save a checkpoint every N grooves so a long render can be resumed (default %(default)s, none)")
+  parser.add_argument("--resume", action="store_true", default=resume,
+    help="carry on from the last checkpoint of an interrupted render")
+  parser.add_argument("--memmap", metavar="DIR", default=memmapDir,
+    help="keep the mesh in memory mapped files in DIR and write it at the end, instead of streaming it")
+  parser.add_argument("--pipeline", action="store_true", default=pipelineMode,
+    help="draw and write at the same time, a bounded number of blocks apart. decoding only overlaps too "
+      "with the audio cache off and --no-anti-alias, otherwise the whole track is decoded and resampled first")
+  parser.add_argument("--check", action="store_true", default=checkMesh,
+    help="check the written mesh for holes, bad triangles and overlapping grooves")
+  parser.add_argument("--preview", action="store_true", default=previewMode,
+    help="write a quick depth map png and print what the render would come to, without drawing it")
+  parser.add_argument("--heightmap", choices=("png", "raw"), default=heightmapFormat,
+    help="write the top surface as a dpi heightmap (16 bit png or raw float32) and a json descriptor of the base, instead of the mesh")
+  parser.add_argument("--profile", choices=("decode", "resample", "preview", "heightmap", "shape", "grooves", "locked", "write", "check"), default=profileStage,
+    help="run one stage under cProfile and print where its time goes")
+  adaptive = parser.add_mutually_exclusive_group()
+  adaptive.add_argument("--tolerance", type=float, metavar="MICRONS", default=decimateMicrons,
+    help="drop ring vertices wherever the groove stays within MICRONS without them")
+  adaptive.add_argument("--triangles", type=int, metavar="N", default=triangleBudget,
+    help="decimate to about N triangles in all")
+  rate = parser.add_mutually_exclusive_group()
+  rate.add_argument("--steps-per-rev", type=int, metavar="N", default=stepsPerRev,
+    help="resample the audio to N groove samples per revolution")
+  rate.add_argument("--rate", type=float, metavar="HZ", default=targetRate,
+    help="resample the audio to HZ")
+  parser.add_argument("--no-anti-alias", dest="antiAlias", action="store_false", default=antiAlias,
+    help="take every rateDivisor-th sample instead of low-pass filtering and resampling")
+  args = parser.parse_args()
+
+  audioFilename = args.filename
+  decimateMicrons = args.tolerance
+  triangleBudget = args.triangles
+  workers = max(1, args.workers)
+  metricsFile = args.metrics
+  profileStage = args.profile
+  antiAlias = args.antiAlias
+  stepsPerRev = args.steps_per_rev
+  targetRate = args.rate
+  previewMode = args.preview
+  checkpointEvery = max(0, args.checkpoint_every)
+  resume = args.resume
+  memmapDir = args.memmap
+  pipelineMode = args.pipeline
+  checkMesh = args.check
+  heightmapFormat = args.heightmap
+  if memmapDir is not None:
+    streamMesh = False
+  updateRate()
+
+#takes a RecordSpec and any other settings by name (workers=4, streamMesh=False...),
+#puts every setting back to its default in settingDefaults, then sets the ones
+#the spec gives and the named ones, and recomputes the globals derived from them.
+#the settings are module globals, so only one render can be set up at a time
+def configure(spec, **settings):
+  global grooveWidth
+
+  unknown = sorted(set(settings) - set(settingNames))
+  if unknown:
+    raise TypeError("unknown stl_generator settings: " + ", ".join(unknown))
+  values = dict(settingDefaults)
+  for name, value in (("rpm", spec.rpm), ("dpi", spec.dpi), ("diameter", spec.diameter), ("innerRad", spec.inner_rad),
+      ("outerRad", spec.outer_rad), ("amplitude", spec.amplitude), ("channelMode", spec.channels),
+      ("meshFormat", spec.format), ("stepsPerRev", spec.steps_per_rev)):
+    if value is not None:
+      values[name] = value
+  values.update(settings)
+  if values["memmapDir"] is not None: #keeping the mesh in memory mapped files means not streaming it, as with --memmap
+    values["streamMesh"] = False
+  globals().update(values)
+
+  grooveWidth = 2.0/dpi
+  updateRate()
+
+#recomputes the globals that follow from samplingRate, rpm and rateDivisor,
+#setting rateDivisor from stepsPerRev or targetRate first when either is given
+def updateRate():
+  global rateDivisor, thetaIter, incrNum, sampleStep
+
+  if stepsPerRev is not None:
+    rateDivisor = (samplingRate*secPerMin)/(rpm*stepsPerRev)
+  elif targetRate is not None:
+    rateDivisor = samplingRate/targetRate
+  thetaIter = (samplingRate*secPerMin)/(rateDivisor*rpm)
+  incrNum = 2.0*math.pi/thetaIter
+  sampleStep = rateDivisor
+
+#returns a writer for meshFormat writing to the given filename,
+#or given a writer checkpoint, picking up that file where it left off.
+#in pipeline mode it writes from its own thread while the grooves are drawn
+def openMeshWriter(filename, state=None):
+  writer = mesh_output.WRITERS[meshFormat](filename, state)
+  if pipelineMode:
+    writer = pipeline.WriterThread(writer)
+  return writer
+
+#returns the directory checkpoints of the given output go in
+def checkpointPath(outputFilename):
+  if checkpointDir is None:
+    return outputFilename + ".checkpoint"
+  return os.path.join(checkpointDir, os.path.basename(outputFilename) + ".checkpoint")
+
+#given the audio tuple and the output filename, returns what a checkpoint must match
+#to carry on from it: the output, the audio (its length and a checksum of its start)
+#and every setting that changes the geometry
+def checkpointKey(audioTuple, outputFilename):
+  audioData, audioLen = audioTuple
+  head = numpy.asarray(audioData[numpy.arange(min(audioLen, checkpointHashSamples))], dtype=numpy.float64)
+  return (os.path.abspath(outputFilename), audioLen, zlib.crc32(head.tobytes()) & 0xffffffff,
+    rpm, dpi, diameter, innerHole, innerRad, outerRad, recordHeight, recordBottom, amplitude, depth, bevel,
+    rateDivisor, antiAlias, meshFormat, streamMesh, vectorEngine, decimateTolerance)
+
+#given the audio tuple and the output filename, gets checkpointing ready for the record
+#and returns the checkpoint to resume from, or None to start from scratch.
+#anything left from an earlier render is cleared out unless it is being resumed
+def startCheckpoints(audioTuple, outputFilename):
+  global checkpointWork
+
+  checkpointWork = None
+  del checkpointBlocks[:]
+  if not checkpointEvery and not resume:
+    return None
+
+  directory = checkpointPath(outputFilename)
+  key = checkpointKey(audioTuple, outputFilename)
+  checkpoint = None
+  try:
+    with open(os.path.join(directory, "state.pickle"), "rb") as f:
+      checkpoint = pickle.load(f)
+  except (IOError, EOFError, pickle.UnpicklingError):
+    if resume:
+      print "no checkpoint to resume from in "+directory+", starting from scratch"
+  if checkpoint is not None: #the interrupted render's memory mapped files, this one maps its own
+    for filename in checkpoint.get("storeFiles", []):
+      if os.path.exists(filename):
+        os.remove(filename)
+  if not resume:
+    checkpoint = None
+  elif checkpoint is not None and checkpoint["key"] != key:
+    print "the checkpoint in "+directory+" is of a different record or settings, starting from scratch"
+    checkpoint = None
+  if checkpoint is None:
+    shutil.rmtree(directory, ignore_errors=True)
+  if checkpointEvery and not os.path.isdir(directory):
+    os.makedirs(directory)
+  checkpointWork = (directory, key) #a resumed render deletes its checkpoint when done, even if it saves no more
+  return checkpoint
+
+#given the current groove num (int), the radius and sample the next groove starts at,
+#saves a checkpoint if one is due: the mesh so far (the output written so far when streaming,
+#else the storage blocks added since the last checkpoint) and what the next groove needs,
+#along with any memory mapped files, so a resumed or fresh render can delete them.
+#the state file is replaced only once everything it refers to is on disk
+def saveCheckpoint(grooveNum, radius, sampleNum):
+  if checkpointWork is None or not checkpointEvery or grooveNum % checkpointEvery:
+    return
+  directory, key = checkpointWork
+
+  state = {"key": key, "grooveNum": grooveNum, "radius": radius, "samplenum": sampleNum,
+    "lastEdge": lastEdge, "lastEdgeIndices": None, "vertexCount": vertexCount,
+    "storeFiles": sorted(meshStore.files.values()) if meshStore is not None else []}
+  entry = recentRings.get(id(lastEdge))
+  if entry is not None and entry[0] is lastEdge and entry[1] == len(lastEdge): #already in the indexed mesh
+    state["lastEdgeIndices"] = entry[2]
+
+  if meshWriter is not None:
+    state["writer"] = meshWriter.checkpoint()
+  else:
+    savedVertices, savedFaces = checkpointBlocks[-1][1:] if checkpointBlocks else (0, 0)
+    blockFile = "blocks%d.pickle" % grooveNum
+    with open(os.path.join(directory, blockFile), "wb") as f:
+      pickle.dump((numpy.array(meshStore.vertices[savedVertices:meshStore.vertex_count]),
+        numpy.array(meshStore.faces[savedFaces:meshStore.face_count])), f, pickle.HIGHEST_PROTOCOL)
+      f.flush()
+      os.fsync(f.fileno())
+    checkpointBlocks.append((blockFile, meshStore.vertex_count, meshStore.face_count))
+    state["blocks"] = list(checkpointBlocks)
+
+  stateFile = os.path.join(directory, "state.pickle")
+  with open(stateFile + ".tmp", "wb") as f:
+    pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+    f.flush()
+    os.fsync(f.fileno())
+  if os.path.exists(stateFile) and os.name == "nt": #no atomic replace there
+    os.remove(stateFile)
+  os.rename(stateFile + ".tmp", stateFile)
+
+#given a checkpoint from startCheckpoints and the output filename, puts the mesh
+#and the groove state back the way they were when it was saved
+#(throwing away whatever setUpRecordShape just added, it is in the checkpoint)
+#and returns (groove num, radius) for drawGrooves to carry on from
+def restoreCheckpoint(checkpoint, outputFilename):
+  global samplenum, lastEdge, vertexCount, meshWriter, meshStore
+
+  recentRings.clear()
+  meshStore.clear()
+  if "writer" in checkpoint:
+    meshStore.close()
+    meshStore = None
+    meshWriter = openMeshWriter(outputFilename, checkpoint["writer"])
+  else:
+    for blockFile, storedVertices, storedFaces in checkpoint["blocks"]:
+      with open(os.path.join(checkpointPath(outputFilename), blockFile), "rb") as f:
+        blockVertices, blockFaces = pickle.load(f)
+      meshStore.add_vertices(blockVertices)
+      meshStore.add_faces(blockFaces)
+    checkpointBlocks[:] = checkpoint["blocks"]
+
+  samplenum = checkpoint["samplenum"]
+  lastEdge = checkpoint["lastEdge"]
+  vertexCount = checkpoint["vertexCount"]
+  if checkpoint["lastEdgeIndices"] is not None:
+    recentRings[id(lastEdge)] = (lastEdge, len(lastEdge), checkpoint["lastEdgeIndices"])
+  print "resuming from groove "+str(checkpoint["grooveNum"])
+  return (checkpoint["grooveNum"], checkpoint["radius"])
+
+#once the record is written, deletes its checkpoints
+def finishCheckpoints():
+  global checkpointWork
+
+  if checkpointWork is not None:
+    shutil.rmtree(checkpointWork[0], ignore_errors=True)
+  checkpointWork = None
+  del checkpointBlocks[:]
+
+#returns True if the geometry is built as shared, indexed rings
+#rather than one self-contained block per quad strip
+def indexedMesh():
+  return meshFormat in mesh_output.INDEXED_FORMATS
+
+#given the length of the audio (after resampling), returns the MeshStore to keep the
+#record's mesh in, sized for it at full resolution: exactly for stl, closely for the
+#indexed formats, and more than enough when decimating. memory mapped in memmapDir if set
+def openMeshStore(audioLen):
+  count = angularGrid().count
+  spiralGrooves = spiralGrooveCount(audioLen, count)
+  triangles = fullResolutionTriangles(spiralGrooves, count)
+  if indexedMesh(): #about three new rings per groove, plus the base shape's, the locked groove's and the caps'
+    vertexCapacity = (3*spiralGrooves+14)*(count+1)
+  else: #every strip block has two more vertices than triangles
+    vertexCapacity = triangles + 2*(3*spiralGrooves+14)
+  return mesh_output.MeshStore(vertexCapacity, triangles, memmapDir)
+
+#returns the key of the base record (bottom and walls) for the current settings,
+#everything its geometry depends on: the record's size, the angular step and step count,
+#whether the rings are zipped by angle (decimating) and whether the mesh is indexed.
+#the first entry names the triangle layout, change it whenever the strips' triangles
+#change so bases cached by older versions are rebuilt instead of reused
+def recordBaseKey():
+  return repr(("wound outward", diameter, innerHole, recordHeight, recordBottom, incrNum, angularGrid().count, decimateTolerance is not None, indexedMesh()))
+
+#returns the base record for the current settings as buildRecordBase does,
+#the last record's if it has the same key, else the one saved in baseCacheDir
+#(memory mapped, nothing is rebuilt), else builds it and saves it there for next time
+def loadRecordBase():
+  global recordBase
+  key = recordBaseKey()
+  if recordBase is not None and recordBase[0] == key:
+    return recordBase[1]
+
+  paths = []
+  if baseCacheDir is not None:
+    name = "base_" + hashlib.sha1(key.encode()).hexdigest()
+    paths = [os.path.join(baseCacheDir, "%s_%s.npy" % (name, part)) for part in ("rings", "vertices", "faces")]
+  if paths and all(os.path.exists(path) for path in paths):
+    for path in paths:
+      audio_processing.touch_cache(path)
+    base = tuple(numpy.load(path, mmap_mode="r") for path in paths)
+  else:
+    base = buildRecordBase()
+    for path, array in zip(paths, base):
+      audio_processing.write_cache(path, array)
+
+  recordBase = (key, base)
+  return base
+
+#given the heightmap filename, its size in pixels, the number of spiral grooves
+#and the final radius, returns the json descriptor written next to it:
+#how to read the pixels, and the base shape the heightmap sits on
+def heightmapDescriptor(imageFilename, size, spiralGrooves, finalRadius):
+  descriptor = collections.OrderedDict()
+  descriptor["heightmap"] = os.path.basename(imageFilename)
+  descriptor["encoding"] = "float32 little endian" if imageFilename.endswith(".raw") else "16 bit png"
+  descriptor["units"] = "inch"
+  descriptor["width"] = size #pixels
+  descriptor["height"] = size
+  descriptor["dpi"] = dpi
+  descriptor["top_left"] = [0.0, size/dpi] #corner of the first pixel, rows run down (-y) from it
+  descriptor["height_range"] = [recordBottom, recordHeight] #png values 0 and 65535, floats are heights as they are
+  base = collections.OrderedDict()
+  base["shape"] = "disc with a center hole, flat bottom, the heightmap is its top surface"
+  base["center"] = [diameter/2, diameter/2]
+  base["diameter"] = diameter
+  base["hole_diameter"] = innerHole
+  base["top"] = recordHeight
+  base["bottom"] = recordBottom #and the height off the record and in the hole
+  descriptor["base"] = base
+  grooves = collections.OrderedDict()
+  grooves["count"] = spiralGrooves+2 #plus the penultimate and locked grooves
+  grooves["outer_radius"] = outerRad
+  grooves["final_radius"] = finalRadius
+  grooves["pitch"] = grooveWidth+2*bevel*amplitude
+  grooves["floor_width"] = grooveWidth
+  grooves["bevel_width"] = amplitude*bevel
+  grooves["floor_height"] = recordHeight-depth-amplitude #with the audio added
+  grooves["rpm"] = rpm
+  descriptor["grooves"] = grooves
+  return descriptor
+
+#returns where the grooves are, for locating mesh problems by groove:
+#(center x, center y, radius of the first groove's outer edge, groove pitch)
+def grooveLayout():
+  return (diameter/2, diameter/2, outerRad+amplitude*bevel, grooveWidth+2*bevel*amplitude)
+
+#outputs the global geometry in meshFormat to the given filename
+#from the mesh store, a chunk at a time.
+#when streaming, the blocks are already on disk
+#and this just finishes the file
+def writeMesh(filename):
+  global meshWriter, meshStore
+
+  if meshWriter is None:
+    meshWriter = openMeshWriter(filename)
+    meshStore.write_to(meshWriter)
+    meshStore.close()
+    meshStore = None
+
+  meshWriter.close()
+  meshWriter = None
 
 
 #opens the filename given in the program args
-#converts to wav if neccesary
-#then returns a list of floats representing
+#and returns a float32 array representing
 #the amplitudes at every sample point of the audio
-#and the length of that list (for efficiency)
+#(or a WavStream reading it lazily when streaming)
+#and the length of that array (for efficiency)
 def processAudioData():
 
-  filename = sys.argv[1]
-  audioData = [] #list of floats to return
-
-  if filename[-4:] == ".mp3": #convert mp3 files
-
-    #resaves the file as a .wav so that
-    #it can be re-read as a .wav
-    path = os.getcwd()
-    sound = AudioSegment.from_mp3(path + "/" + filename)
-    sound.export(path + "/" + filename[:-4] + ".wav", format="wav")
-    filename = filename[:-4] + ".wav" #change the filename to match
-
-  #read file and get data
-  w = wave.open(filename, 'r')
-  numframes = w.getnframes()
-
-  frame = w.readframes(numframes)#w.getnframes()
-  frameInt = map(ord, list(frame))#turn into array
-
-  #separate left and right channels and merge bytes
-  frameOneChannel = [0]*numframes#initialize list of one channel of wave
-  for i in range(numframes):
-      frameOneChannel[i] = frameInt[4*i+1]*2**8+frameInt[4*i]#separate channels and store one channel in new list
-      if frameOneChannel[i] > 2**15:
-          frameOneChannel[i] = (frameOneChannel[i]-2**16)
-      elif frameOneChannel[i] == 2**15:
-          frameOneChannel[i] = 0
-      else:
-          frameOneChannel[i] = frameOneChannel[i]
-
-  #convert to list of floats
-  for i in range(numframes):
-      audioData.append(frameOneChannel[i])
-  
-  #normalize audio data to given bitdepth
-  #first find max val
-  maxval = 0
-  for data in audioData:
-    maxval = max(abs(data),maxval)
-
-  #normalize amplitude to max val
-  for i in range(numframes):
-    audioData[i]*=amplitude/maxval
-  
-  return (audioData,numframes)
+  metrics.start("decode")
+  audioData = audio_processing.load_audio(audioFilename, amplitude, channelMode, streamAudio or pipelineMode, audioCacheDir,
+    pipeline.QUEUE_DEPTH if pipelineMode else 0)
+  metrics.stop(samples=len(audioData))
+
+  return (audioData,len(audioData))
+
+#given the audio tuple at samplingRate, returns it low-pass filtered and resampled
+#to one sample per theta step (samplingRate/rateDivisor, renormalized to amplitude)
+#so the grooves index it directly, and sets sampleStep to match.
+#with streamAudio it is resampled a chunk at a time as the grooves read it, never held whole.
+#with antiAlias off it comes back as it is and the grooves take every rateDivisor-th sample
+def resampleAudio(audioTuple):
+  global sampleStep
+
+  if not antiAlias:
+    sampleStep = rateDivisor
+    return audioTuple
+
+  if streamAudio:
+    audioData = audio_processing.ResampledStream(audioTuple[0], samplingRate, samplingRate/rateDivisor, amplitude)
+  else:
+    audioData = audio_processing.resample(audioTuple[0], samplingRate, samplingRate/rateDivisor)
+    audioData = audio_processing.normalize(audioData, amplitude)
+  sampleStep = 1.0
+  return (audioData,len(audioData))
 
 #######################################
 #                                     #
@@ -169,136 +723,440 @@ def processAudioData():
 #######################################
 
 #makes the geometry for the bottom and walls of the record
-#while leaving the top open so that the grooves can be drawn
+#while leaving the top open so that the grooves can be drawn.
+#the block is built once per base record key and written straight through after that
 def setUpRecordShape():
+  global lastEdge
   
-  #get vertices
-  theta = 0;
-  while (theta < 2*math.pi):
-    #outer edge of record
-    perimeterX = diameter/2+diameter/2*math.cos(theta)
-    perimeterY = diameter/2+diameter/2*math.sin(theta)
-    recordPerimeterUpper.append([perimeterX,perimeterY,recordHeight])
-    recordPerimeterLower.append([perimeterX,perimeterY,recordBottom])
-    #center hole
-    centerHoleX = diameter/2+innerHole/2*math.cos(theta)
-    centerHoleY = diameter/2+innerHole/2*math.sin(theta)
-    recordHoleUpper.append([centerHoleX,centerHoleY,recordHeight])
-    recordHoleLower.append([centerHoleX,centerHoleY,recordBottom])
-    theta += incrNum
-  
-  #close vertex lists (closed loops)
-  recordPerimeterUpper.append(recordPerimeterUpper[0])
-  recordPerimeterLower.append(recordPerimeterLower[0])
-  recordHoleUpper.append(recordHoleUpper[0])
-  recordHoleLower.append(recordHoleLower[0])
-  
+  rings, vertices, faces = loadRecordBase()
+  for storage, ring in zip((recordPerimeterUpper, recordPerimeterLower, recordHoleUpper, recordHoleLower), rings):
+    storage[:] = ring.tolist()
+
   #connect vertices
-  quadStrip(recordHoleUpper,recordHoleLower)
-  quadStrip(recordHoleLower,recordPerimeterLower)
-  quadStrip(recordPerimeterLower,recordPerimeterUpper)
+  if indexedMesh(): #each ring just before the first strip on it, as quadStrip would add them
+    n = len(recordHoleUpper)
+    stripEnds = numpy.searchsorted(faces.max(axis=1), (2*n, 3*n, 4*n)) #strip k joins rings k and k+1
+    firstIndex = vertexCount
+    addVertices(vertices[:n])
+    stripStart = 0
+    for k, stripEnd in enumerate(stripEnds):
+      addVertices(vertices[(k+1)*n:(k+2)*n])
+      addFaces(faces[stripStart:stripEnd]+firstIndex)
+      stripStart = stripEnd
+    for i, ring in enumerate((recordHoleUpper, recordHoleLower, recordPerimeterLower, recordPerimeterUpper)): #share them as ringIndices would
+      recentRings[id(ring)] = (ring, len(ring), numpy.arange(firstIndex+i*n, firstIndex+(i+1)*n, dtype=numpy.int64))
+  else:
+    addMeshBlock((vertices, faces+vertexCount))
   
   #to start, outer edge of record is the last egde we need to connect to with the outmost groove
-  lastEdge = copy.copy(recordPerimeterUpper)
+  lastEdge = shareRing(recordPerimeterUpper, copy.copy(recordPerimeterUpper))
   
   print "record drawn, starting grooves"
 
+#returns the bottom and walls of the record for the current settings as
+#(rings, vertices, faces): its four closed rings (perimeter upper, perimeter lower,
+#hole upper, hole lower) as one (4,n,3) array, and the vertex and face arrays of
+#the strips between them (hole wall, bottom, outer wall), faces counting from 0
+def buildRecordBase():
+  perimeterUpper = []
+  perimeterLower = []
+  holeUpper = []
+  holeLower = []
+
+  #get vertices
+  angles = angularGrid()
+  for cosineTheta, sineTheta in zip(angles.cosine_list, angles.sine_list):
+    #outer edge of record
+    perimeterX = diameter/2+diameter/2*cosineTheta
+    perimeterY = diameter/2+diameter/2*sineTheta
+    perimeterUpper.append([perimeterX,perimeterY,recordHeight])
+    perimeterLower.append([perimeterX,perimeterY,recordBottom])
+    #center hole
+    centerHoleX = diameter/2+innerHole/2*cosineTheta
+    centerHoleY = diameter/2+innerHole/2*sineTheta
+    holeUpper.append([centerHoleX,centerHoleY,recordHeight])
+    holeLower.append([centerHoleX,centerHoleY,recordBottom])
+
+  #the rings stay at full resolution even when decimating, so the walls
+  #meet the grooves and caps on every theta step and the topology doesn't change
+  
+  #close vertex lists (closed loops)
+  perimeterUpper.append(perimeterUpper[0])
+  perimeterLower.append(perimeterLower[0])
+  holeUpper.append(holeUpper[0])
+  holeLower.append(holeLower[0])
+  rings = numpy.array((perimeterUpper, perimeterLower, holeUpper, holeLower))
+
+  pairs = [(holeUpper,holeLower), (holeLower,perimeterLower), (perimeterLower,perimeterUpper)]
+  if not indexedMesh():
+    vertices, faces = stripBlock(pairs, 0)
+    return (rings, vertices, faces)
+
+  n = len(holeUpper) #each ring once, in the order the strips first use them
+  vertices = numpy.concatenate((rings[2], rings[3], rings[1], rings[0]))
+  indices = [numpy.arange(i*n, (i+1)*n, dtype=numpy.int64) for i in range(4)]
+  faces = numpy.concatenate([ringFaces(vl1, vl2, indices[i], indices[i+1]) for i, (vl1, vl2) in enumerate(pairs)])
+  return (rings, vertices, faces)
 
-#given two lists of vertices (3 element list of num),
+
+#given two lists of vertices (3 element list of num, or (n,3) arrays),
 #adds all the vertices to the global vertex storage
 #and adds the faces for the quad strip between them to global storage
+#(when indexed, rings already in the mesh are reused instead of copied)
 def quadStrip(vl1,vl2):
+  if indexedMesh():
+    addFaces(ringFaces(vl1,vl2))
+  else:
+    addMeshBlock(stripBlock([(vl1,vl2)], vertexCount))
+
+#given two rings, returns the faces of the strip between them in the indexed mesh,
+#adding either ring's vertices first if needed (unless their indices are given)
+def ringFaces(vl1, vl2, indices1=None, indices2=None):
+  if indices1 is None:
+    indices1 = ringIndices(vl1)
+  if indices2 is None:
+    indices2 = ringIndices(vl2)
+  if decimateTolerance is not None:
+    return zipTriangles(ringAngles(vl1), ringAngles(vl2), indices1, indices2)
+  return stripFaces(indices1,indices2)
+
+#given a list of (vl1,vl2) ring pairs and the global index of the first new vertex,
+#returns the vertex and face arrays for the quad strips between each pair, in order.
+#each strip interleaves its two rings (vl1[0],vl2[0],vl1[1],vl2[1]...)
+#and has two triangles per step, truncated to the shorter ring
+def stripBlock(pairs, nextIndex):
+  vertexBlocks = []
+  faceBlocks = []
+  for vl1, vl2 in pairs:
+    if decimateTolerance is not None: #rings may be sampled differently, zip them by angle
+      ringTriangles = zipTriangles(ringAngles(vl1), ringAngles(vl2))
+      if len(ringTriangles):
+        vertexBlocks.append(numpy.concatenate((numpy.asarray(vl1, dtype=numpy.float64).reshape(-1,3),
+          numpy.asarray(vl2, dtype=numpy.float64).reshape(-1,3))))
+        faceBlocks.append(ringTriangles+nextIndex)
+        nextIndex += len(vl1)+len(vl2)
+      continue
+
+    n = min(len(vl1),len(vl2)) #use the min to prevent index errors
+    if n == 0:
+      continue
+    strip = numpy.empty((2*n,3))
+    strip[0::2] = numpy.asarray(vl1[:n], dtype=numpy.float64) #first of each pair
+    strip[1::2] = numpy.asarray(vl2[:n], dtype=numpy.float64) #second of each pair
+    relativeIndex = nextIndex+2*numpy.arange(n-1, dtype=numpy.int64) #index of the first of each previous pair
+    stripTriangles = numpy.empty((2*(n-1),3), dtype=numpy.int64)
+    stripTriangles[0::2] = numpy.column_stack((relativeIndex,relativeIndex+2,relativeIndex+1)) #first triangle, wound the same way as the second
+    stripTriangles[1::2] = numpy.column_stack((relativeIndex+1,relativeIndex+2,relativeIndex+3)) #second triangle
+    vertexBlocks.append(strip)
+    faceBlocks.append(stripTriangles)
+    nextIndex += 2*n
+
+  if not vertexBlocks:
+    return (numpy.empty((0,3)), numpy.empty((0,3), dtype=numpy.int64))
+  return (numpy.concatenate(vertexBlocks), numpy.concatenate(faceBlocks))
+
+#given two arrays of ring vertex indices,
+#returns the faces of the quad strip between them,
+#the same triangles stripBlock makes but on shared vertices
+def stripFaces(ring1, ring2):
+  n = min(len(ring1),len(ring2))
+  if n < 2:
+    return numpy.empty((0,3), dtype=numpy.int64)
+  ringFaces = numpy.empty((2*(n-1),3), dtype=numpy.int64)
+  ringFaces[0::2] = numpy.column_stack((ring1[:n-1],ring1[1:n],ring2[:n-1])) #first triangle, wound the same way as the second
+  ringFaces[1::2] = numpy.column_stack((ring2[:n-1],ring1[1:n],ring2[1:n])) #second triangle
+  return ringFaces
+
+#given the angles of two rings' vertices (ascending from theta 0 round to the closing point)
+#and optionally their vertex indices, returns the triangles zipping the rings together.
+#each step advances along whichever ring's next vertex comes first,
+#so rings with different vertex counts still meet without gaps.
+#without indices, ring1's vertices count from 0 and ring2's follow on from len(ring1)
+def zipTriangles(angles1, angles2, indices1=None, indices2=None):
+  n = len(angles1)
+  m = len(angles2)
+  if n == 0 or m == 0 or n+m < 3:
+    return numpy.empty((0,3), dtype=numpy.int64)
+  if indices1 is None:
+    indices1 = numpy.arange(n, dtype=numpy.int64)
+    indices2 = numpy.arange(n, n+m, dtype=numpy.int64)
+
+  steps = numpy.argsort(numpy.concatenate((angles1[1:], angles2[1:])), kind="mergesort") #ties go to ring1 first
+  alongFirst = steps < n-1
+  i = numpy.cumsum(alongFirst) - alongFirst #ring1 vertex before each step
+  j = numpy.cumsum(~alongFirst) - ~alongFirst #ring2 vertex before each step
+  triangles = numpy.empty((len(steps),3), dtype=numpy.int64)
+  triangles[:,0] = indices1[i]
+  triangles[:,1] = numpy.where(alongFirst, indices1[numpy.minimum(i+1,n-1)], indices2[numpy.minimum(j+1,m-1)])
+  triangles[:,2] = indices2[j]
+  return triangles
+
+#given a ring of vertices (list or array) around the record's center,
+#returns the angle of each vertex, counting the closing point as 2pi
+def ringAngles(ring):
+  points = numpy.asarray(ring, dtype=numpy.float64).reshape(-1,3)
+  angles = numpy.arctan2(points[:,1]-diameter/2, points[:,0]-diameter/2) % (2*math.pi)
+  if len(angles) > 1 and angles[-1] < angles[-2]: #back round at theta 0
+    angles[-1] += 2*math.pi
+  return angles
+
+#given the tolerance (inches) and the radius of a ring (inches),
+#returns how many theta steps one straight edge can span
+#before the edge strays further than the tolerance from the circle
+def maxSpan(tolerance, radius):
+  if tolerance <= 0:
+    return 1
+  return int(max(1, min(maxDecimationSpan, math.sqrt(8*tolerance/radius)/incrNum))) #sagitta of the chord
+
+#given the heights along a ring (closing point included) and the longest span to try,
+#returns an (span, len(heights)-1) array whose [s-1,i] entry is the furthest any height
+#strays from the straight line from column i to column i+s, or any shorter span from i
+#(so it never decreases with s), and inf where i+s runs off the end.
+#with a tolerance given, stops early once no span that long is within it
+def spanErrors(heights, span, tolerance=None):
+  heights = numpy.ascontiguousarray(heights, dtype=numpy.float64)
+  count = len(heights)
+  errors = numpy.full((span, max(count-1,0)), numpy.inf)
+  errors[0] = 0.0
+  worst = numpy.zeros(max(count-1,0))
+  for s in range(2, span+1):
+    starts = count-s
+    if starts <= 0:
+      break
+    windows = as_strided(heights, shape=(starts, s+1), strides=(heights.strides[0], heights.strides[0]))
+    line = windows[:,:1] + (windows[:,-1:]-windows[:,:1])*(numpy.arange(1,s)/float(s))
+    worst[:starts] = numpy.maximum(worst[:starts], numpy.abs(windows[:,1:-1]-line).max(axis=1))
+    errors[s-1,:starts] = worst[:starts]
+    if tolerance is not None and (worst[:starts] > tolerance).all():
+      break
+  return errors
+
+#given span errors from spanErrors, the tolerance (inches) and the longest span allowed,
+#returns the ascending indices of the columns to keep: the first, then greedily
+#the furthest column whose straight line from the last kept one is within the tolerance
+def keptColumns(errors, tolerance, span):
+  reach = numpy.minimum((errors[:span] <= tolerance).sum(axis=0), span).tolist()
+  kept = [0]
+  i = 0
+  while i < len(reach):
+    i += max(reach[i], 1)
+    kept.append(i)
+  return numpy.array(kept, dtype=numpy.int64)
+
+#given the audio tuple, returns the tolerance (inches) to decimate the record to:
+#decimateMicrons, or for a triangleBudget the smallest tolerance estimated to meet it,
+#or None when adaptive mode is off (or the serial engine is in use)
+def adaptiveTolerance(audioTuple):
+  if not vectorEngine:
+    return None
+  if decimateMicrons is not None:
+    return decimateMicrons/micronsPerInch
+  if triangleBudget is None:
+    return None
+
+  estimate = triangleEstimator(audioTuple)
+
+  #bisect on the log of the tolerance, 0.001 to 10000 microns
+  low, high = math.log(0.001/micronsPerInch), math.log(10000.0/micronsPerInch)
+  if estimate(math.exp(high)) > triangleBudget:
+    print "a budget of "+str(triangleBudget)+" triangles is below what adaptive mode can reach, decimating as far as it goes"
+    return math.exp(high)
+  for step in range(24):
+    middle = (low+high)/2
+    if estimate(math.exp(middle)) > triangleBudget:
+      low = middle
+    else:
+      high = middle
+  print "decimating to within "+str(round(math.exp(high)*micronsPerInch, 3))+" microns for about "+str(triangleBudget)+" triangles"
+  return math.exp(high)
+
+#given the audio tuple, returns a function that takes a tolerance (inches)
+#and returns about how many triangles the record comes to decimated to it,
+#estimated from a stretch of a few revolutions' heights
+def triangleEstimator(audioTuple):
+  audioData, audioLen = audioTuple
+  count = angularGrid().count
+  steps = min(count, budgetSampleSteps)
+  revolutions = max(int(audioLen/(sampleStep*thetaIter)), 1)
+  radiusStep = grooveWidth+2*bevel*amplitude
+  sampled = []
+  for rev in numpy.unique(numpy.linspace(0, revolutions-1, min(revolutions, budgetSampleRevs)).astype(int)):
+    heights = revolutionHeights(steps, rev*count, audioData, audioLen)[0]
+    sampled.append((outerRad-rev*radiusStep+amplitude*bevel, spanErrors(heights, maxDecimationSpan)))
+
+  def estimate(tolerance):
+    keptPerStep = numpy.mean([(len(keptColumns(errors, tolerance, maxSpan(tolerance, radius)))-1)/float(steps-1)
+      for radius, errors in sampled])
+    columns = keptPerStep*count + 1
+    #about six triangles per column per groove (three strips plus the zip to the groove before),
+    #and the full resolution base shape's three strips and penultimate groove
+    return 6*columns*revolutions + 12*count
+  return estimate
+
+#given the number of spiral grooves and theta steps per revolution,
+#returns how many triangles the record comes to at full resolution:
+#three strips of two triangles per step for the base, every spiral groove and the locked groove,
+#the strip joining the first groove to the edge of the record, the strip joining the penultimate groove,
+#its merging part and the strip closing off the hole
+def fullResolutionTriangles(spiralGrooves, count):
+  changeTheta = 2*math.pi*(0.5*amplitude)/(amplitude+grooveWidth)
+  mergingSteps = int(changeTheta/incrNum)+1
+  return 6*count*(spiralGrooves+2) + 2*count + 2*count + 4*mergingSteps + 2*count + 6 #4 for the start cap, 2 where the ridge meets the floor
+
+#given the length of the audio and the theta steps per revolution,
+#returns how many spiral grooves drawGrooves draws before the penultimate one
+def spiralGrooveCount(audioLen, count):
+  limit = audioLen-sampleStep*thetaIter+1
+  if limit <= 0:
+    return 0
+  return int(math.ceil(limit/(sampleStep*count)))
+
+#given a ring of vertices (list or array),
+#returns the global indices of its vertices in the indexed mesh,
+#adding it first unless it is one of the recently added rings
+def ringIndices(ring):
+  key = id(ring)
+  entry = recentRings.get(key)
+  if entry is not None and entry[0] is ring and entry[1] == len(ring): #same ring, not appended to since
+    return entry[2]
+
+  indices = addVertices(numpy.asarray(ring, dtype=numpy.float64).reshape(-1,3))
+  recentRings[key] = (ring, len(ring), indices)
+  if len(recentRings) > recentRingLimit:
+    recentRings.popitem(last=False)
+  return indices
+
+#given a ring (list) and a copy of it, returns the copy, which shares
+#the ring's vertices in the indexed mesh if the ring is already in it,
+#instead of adding them again the next time it is strip'd
+def shareRing(ring, copied):
+  entry = recentRings.get(id(ring))
+  if entry is not None and entry[0] is ring and entry[1] == len(ring):
+    recentRings[id(copied)] = (copied, len(copied), entry[2])
+    if len(recentRings) > recentRingLimit:
+      recentRings.popitem(last=False)
+  return copied
+
+#given an (n,3) vertex array, adds it to the indexed mesh
+#and returns the global indices it was given
+def addVertices(points):
+  global vertexCount
+  if meshWriter is not None:
+    meshWriter.add_vertices(points)
+  else:
+    meshStore.add_vertices(points)
+  indices = numpy.arange(vertexCount, vertexCount+len(points), dtype=numpy.int64)
+  vertexCount += len(points)
+  return indices
+
+#given an (m,3) face array of global indices, adds it to the indexed mesh
+def addFaces(block):
+  metrics.count(triangles=len(block))
+  if meshWriter is not None:
+    meshWriter.add_faces(block)
+  else:
+    meshStore.add_faces(block)
 
+#given a (vertex array, face array) tuple whose faces already use global indices,
+#appends it to the global geometry storage,
+#or writes its triangles out right away when streaming
+def addMeshBlock(block):
   global vertexCount
-  nextIndex = vertexCount #the next index in the global struct
-
-  #starting pair of vertices
-  if (len(vl1)) > 0 and (len(vl2)) > 0:
-    vertices.append(vl1[0]) #at nextIndex
-    vertices.append(vl2[0]) #at nextIndex + 1
-    vertexCount += 2
-
-  for i in range(1,min(len(vl1),len(vl2))): #use the min to prevent index errors
-    vertices.append(vl1[i]) #first of new pair
-    vertices.append(vl2[i]) #second of new pair
-    vertexCount += 2
-    relativeIndex = nextIndex+(2*(i-1)) #index of the first of the previous pair
-    faces.append([relativeIndex,relativeIndex+1,relativeIndex+2]) #first triangle
-    faces.append([relativeIndex+1,relativeIndex+2,relativeIndex+3]) #second triangle
+  metrics.count(triangles=len(block[1]))
+  if meshWriter is not None:
+    meshWriter.write(block[0], block[1]-vertexCount)
+  else:
+    meshStore.add_vertices(block[0])
+    meshStore.add_faces(block[1])
+  vertexCount += len(block[0])
 
 #fills in the top of the record geometry
 #by generating all the grooves and filling the space between them
-def drawGrooves(audioTuple):
+def drawGrooves(audioTuple, resumeFrom=None):
   
   audioData = audioTuple[0]
   audioLen = audioTuple[1]
 
   grooveNum = 0 #which groove we are currently drawing
+  metrics.start("grooves")
   
   #DRAW GROOVES
   radius = outerRad #outermost radius (at 5.75") to start
   radIncr = (grooveWidth+2*bevel*amplitude)/thetaIter #calculate radial incrementation amount
-  totalgroovenum = int(audioLen/(rateDivisor*thetaIter))
+  totalgroovenum = int(audioLen/(sampleStep*thetaIter))
   
-  #first draw starting cap
-  stop1 = beginStartCap(radius, audioData[0])
+  if resumeFrom is None: #first draw starting cap
+    stop1 = beginStartCap(radius, audioData[0])
+  else: #or carry on from a checkpoint, always past the first groove
+    grooveNum, radius = resumeFrom
   
   #then spiral groove
-  while (rateDivisor*samplenum<(audioLen-rateDivisor*thetaIter+1)): #while we still have audio to write and we have not reached the innermost groove   #radius>innerRad &&
+  while (sampleStep*samplenum<(audioLen-sampleStep*thetaIter+1)): #while we still have audio to write and we have not reached the innermost groove   #radius>innerRad &&
     
-    clearGrooveStorage()
+    if vectorEngine:
+      radius = drawGrooveRev(radius, grooveNum, audioData, audioLen, radIncr)
+    else:
+      clearGrooveStorage()
 
-    theta=0
-    while (theta<2*math.pi): #for theta between 0 and 2pi
-      radius = iterate(theta, radius, grooveNum, audioData, audioLen, radIncr)
-      theta+=incrNum
+      for step in range(angularGrid().count): #for theta between 0 and 2pi
+        radius = iterate(step, radius, grooveNum, audioData, audioLen, radIncr)
 
-    completeGrooveRev(grooveNum, radius, audioData, audioLen)
-    connectVertices(grooveNum)
+      completeGrooveRev(grooveNum, radius, audioData, audioLen)
+      connectVertices(grooveNum)
 
     if (grooveNum==0): #complete beginning cap if neccesary
-      finishStartCap(radius, stop1)
+      finishStartCap(stop1)
 
     #tell me how much longer
     grooveNum+=1
-    print str(grooveNum)+" of "+str(totalgroovenum)+" grooves drawn"
+    print str(grooveNum)+" of "+str(totalgroovenum)+" grooves drawn"+metrics.eta(grooveNum, totalgroovenum)
+    saveCheckpoint(grooveNum, radius, samplenum)
+
+    if (workers>1 and vectorEngine): #past the start cap every groove stands alone, hand the rest to the pool
+      radius, grooveNum = drawGroovesParallel(radius, grooveNum, audioData, audioLen, radIncr, totalgroovenum)
 
 
   #the locked groove is made out of two intersecting grooves, one that spirals in, and one that creates a perfect circle.
   #the ridge between these grooves gets lower and lower until it disappears and the two grooves become one wide groove.
+  metrics.stop(samples=min(int(sampleStep*samplenum), audioLen))
+  metrics.start("locked")
   radius = drawPenultGroove(radius, grooveNum, audioData, audioLen, radIncr) #second to last groove
-  clearGrooveStorage()
 
-  theta=0
-  while (theta<2*math.pi): #draw last groove (circular locked groove)
-    iterate(theta, radius, grooveNum, [], 0, radIncr)
-    theta+=incrNum
+  if vectorEngine: #draw last groove (circular locked groove)
+    drawGrooveRev(radius, grooveNum, [], 0, 0.0) #no radial step, it is a perfect circle
+  else:
+    clearGrooveStorage()
 
-  completeGrooveRev(grooveNum, radius, [], 0)
-  connectVertices(grooveNum)
+    for step in range(angularGrid().count): #draw last groove (circular locked groove)
+      iterate(step, radius, grooveNum, [], 0, radIncr)
+
+    completeGrooveRev(grooveNum, radius, [], 0)
+    connectVertices(grooveNum)
 
   quadStrip(lastEdge,recordHoleUpper) #close remaining space between last groove and center hole
+  metrics.stop()
 
 #given the float list of audio samples,
 #returns the next sample, or 0 if there is none
 def getNextSampleElseZero(audioData,audioLen):
   global samplenum
   aud = 0
-  if (rateDivisor*samplenum>(audioLen-1)):
+  if (sampleStep*samplenum>(audioLen-1)):
     aud = 0
   else:
-    aud = audioData[int(rateDivisor*samplenum)]
+    aud = audioData[int(sampleStep*samplenum)]
   samplenum+=1 #increment sample num
   return aud
 
-#given the current theta and radius (floats),
+#given the current theta step (int) and radius (float),
 #the current groove num (int)
 #the float list of audioData,
 #appends vertecies calculated from from the next audio sample, 
 #then returns the next radius (float),
-def iterate(theta, radius, grooveNum, audioData, audioLen, radIncr):
-  sineTheta = math.sin(theta)
-  cosineTheta = math.cos(theta)
+def iterate(step, radius, grooveNum, audioData, audioLen, radIncr):
+  angles = angularGrid()
+  sineTheta = angles.sine_list[step]
+  cosineTheta = angles.cosine_list[step]
 
   #calculate height of groove
   grooveHeight = recordHeight-depth-amplitude
@@ -320,8 +1178,8 @@ def iterate(theta, radius, grooveNum, audioData, audioLen, radIncr):
 def completeGrooveRev(grooveNum, radius, audioData, audioLen):
    #add last value to grooves to complete one full rev (theta=0)
   grooveHeight = recordHeight-depth-amplitude
-  if (audioLen>0):
-    grooveHeight += audioData[int(rateDivisor*samplenum)]
+  if (audioLen>0 and sampleStep*samplenum<=(audioLen-1)): #0 past the end of the audio, like getNextSampleElseZero
+    grooveHeight += audioData[int(sampleStep*samplenum)]
   if (grooveNum==0): #if joining a groove to the edge of the record
     grooveOuterUpper.append(grooveInnerUpper[0])
 
@@ -329,6 +1187,281 @@ def completeGrooveRev(grooveNum, radius, audioData, audioLen):
   grooveInnerLower.append([diameter/2+(radius-grooveWidth),diameter/2,grooveHeight])
   grooveInnerUpper.append([diameter/2+radius-grooveWidth-amplitude*bevel,diameter/2,recordHeight])
 
+#returns the shared angular grid for incrNum: the theta steps of one revolution
+#with their sines and cosines, worked out once and used by every ring builder.
+#A step within rounding of 2pi closes the ring instead of adding a zero length
+#edge at its seam, so --steps-per-rev N gives exactly N steps
+def angularGrid():
+  return angular_grid.grid(incrNum, closing=True)
+
+#given the number of theta steps in a revolution, the first sample of the revolution and the audio,
+#returns the groove height at each step, the one that closes the revolution,
+#and the sample after the revolution, the same as calling getNextSampleElseZero once per step
+def revolutionHeights(count, sampleStart, audioData, audioLen):
+  grooveHeight = recordHeight-depth-amplitude
+  if (audioLen<=0): #no audio, flat groove
+    return (numpy.repeat(grooveHeight, count), grooveHeight, sampleStart)
+
+  samplePositions = sampleStep*numpy.arange(sampleStart, sampleStart+count, dtype=numpy.float64)
+  sampleIndex = samplePositions.astype(numpy.int64)
+  valid = samplePositions <= (audioLen-1)
+  samples = numpy.zeros(count)
+  if valid.any():
+    samples[valid] = numpy.asarray(audioData[sampleIndex[valid]], dtype=numpy.float64)
+  sampleEnd = sampleStart+count
+
+  lastHeight = grooveHeight
+  if (sampleStep*sampleEnd<=(audioLen-1)): #an audio length of whole revolutions has no sample after the last one
+    lastHeight += float(audioData[int(sampleStep*sampleEnd)])
+  return (grooveHeight + samples, lastHeight, sampleEnd)
+
+#given the radius at the start of a revolution (float), the number of steps in it
+#and the radIncr rate (float), returns the radius before each step
+#followed by the radius left after the revolution,
+#subtracted one step at a time just like iterate() does
+def revolutionRadii(radius, count, radIncr):
+  return numpy.subtract.accumulate(numpy.concatenate(([radius], numpy.repeat(radIncr, count))))
+
+#given an array of groove sample numbers (theta steps from the start of the spiral)
+#and the audio, returns the audio sample at each, 0 before the spiral and past the audio
+def samplesAt(steps, audioData, audioLen):
+  samplePositions = sampleStep*steps
+  valid = (steps >= 0) & (samplePositions <= (audioLen-1))
+  samples = numpy.zeros(len(steps))
+  if valid.any():
+    samples[valid] = numpy.asarray(audioData[samplePositions[valid].astype(numpy.int64)], dtype=numpy.float64)
+  return samples
+
+#given how far in (inches) from a groove's outer upper edge points are and the height
+#of the groove floor at each, returns the height of the groove's cross section there:
+#down the outer bevel, along the floor and up the inner bevel, recordHeight outside the groove
+def grooveProfile(inward, floorHeights):
+  edge = amplitude*bevel
+  cut = numpy.clip(numpy.minimum(inward, 2*edge+grooveWidth-inward)/edge, 0.0, 1.0) #0 at the top, 1 on the floor
+  return recordHeight - (recordHeight-floorHeights)*cut
+
+#given the x values (inches) of the pixel centers along a row and the y values of a band of rows,
+#returns the (rows, columns) height of the record's top surface under each pixel center:
+#recordHeight less the spiral groove and the circular locked groove wherever they cut in
+#(the lower of the two where they overlap, so the ridge between them drops away),
+#and recordBottom off the record and in the center hole.
+#between theta steps the groove floor is interpolated linearly, like the mesh's triangles
+def surfaceHeights(x, y, spiralGrooves, finalRadius, audioData, audioLen, radIncr):
+  angles = angularGrid()
+  edge = amplitude*bevel
+  dx = numpy.broadcast_to(x[numpy.newaxis,:]-diameter/2, (len(y), len(x)))
+  dy = numpy.broadcast_to(y[:,numpy.newaxis]-diameter/2, (len(y), len(x)))
+  squares = dx**2 + dy**2 #radii squared, only the grooved pixels need the square root
+  heights = numpy.full(squares.shape, float(recordHeight))
+
+  grooved = (squares <= (outerRad+edge)**2) & (squares >= max(finalRadius-grooveWidth-edge, 0.0)**2) #only these can be in a groove
+  if grooved.any():
+    r = numpy.sqrt(squares[grooved])
+    columns = (numpy.arctan2(dy[grooved], dx[grooved]) % (2*math.pi))/angles.increment #theta steps into the revolution
+    revs = numpy.floor(((outerRad+edge-r)/radIncr - columns)/angles.count) #the revolution just outside the pixel
+    steps = revs*angles.count + columns
+    first = numpy.floor(steps)
+    along = steps - first
+    floorHeights = recordHeight-depth-amplitude + (1-along)*samplesAt(first, audioData, audioLen) + along*samplesAt(first+1, audioData, audioLen)
+    spiral = grooveProfile(outerRad+edge-steps*radIncr-r, floorHeights)
+    spiral[(revs < 0) | (revs > spiralGrooves)] = recordHeight #before the start and past the penultimate groove
+    locked = grooveProfile(finalRadius+edge-r, recordHeight-depth-amplitude)
+    heights[grooved] = numpy.minimum(spiral, locked)
+
+  heights[(squares > (diameter/2)**2) | (squares < (innerHole/2)**2)] = recordBottom
+  return heights
+
+#given the current radius (float), the first sample of the revolution (int),
+#the current groove num (int), the audio data and the radIncr rate (float),
+#computes a whole groove revolution at once with numpy:
+#the same rings iterate() and completeGrooveRev() build one step at a time.
+#touches no global state, so it can run in a worker process.
+#returns the rings (outerUpper, only for groove 0, outerLower, innerLower, innerUpper),
+#the next radius (float) and the next sample (int)
+def grooveRings(radius, sampleStart, grooveNum, audioData, audioLen, radIncr):
+
+  angles = angularGrid()
+  count = angles.count
+  cosineTheta = angles.cosines
+  sineTheta = angles.sines
+
+  #radius before each step, then the radius left after the revolution
+  radii = revolutionRadii(radius, count, radIncr)
+  radius = radii[-1]
+  radii = radii[:-1]
+
+  grooveHeight, lastHeight, sampleEnd = revolutionHeights(count, sampleStart, audioData, audioLen)
+
+  def ring(ringRadii, heights):
+    points = numpy.empty((count+1,3))
+    points[:-1,0] = diameter/2+ringRadii*cosineTheta
+    points[:-1,1] = diameter/2+ringRadii*sineTheta
+    points[:-1,2] = heights
+    return points
+
+  #each ring gets the closing point at theta=0 that completeGrooveRev adds
+  outerLower = ring(radii, grooveHeight)
+  outerLower[-1] = [diameter/2+radius,diameter/2,lastHeight]
+  innerLower = ring(radii-grooveWidth, grooveHeight)
+  innerLower[-1] = [diameter/2+(radius-grooveWidth),diameter/2,lastHeight]
+  innerUpper = ring(radii-grooveWidth-amplitude*bevel, recordHeight)
+  innerUpper[-1] = [diameter/2+radius-grooveWidth-amplitude*bevel,diameter/2,recordHeight]
+
+  outerUpper = None
+  if (grooveNum==0): #if joining a groove to the edge of the record
+    outerUpper = ring(radii+amplitude*bevel, recordHeight)
+    outerUpper[-1] = innerUpper[0]
+
+  if decimateTolerance is not None: #keep the same columns in all four rings so they stay aligned
+    span = maxSpan(decimateTolerance, radii[0]+amplitude*bevel)
+    keep = keptColumns(spanErrors(outerLower[:,2], span, decimateTolerance), decimateTolerance, span)
+    outerLower, innerLower, innerUpper = outerLower[keep], innerLower[keep], innerUpper[keep]
+    if outerUpper is not None:
+      outerUpper = outerUpper[keep]
+
+  return ((outerUpper, outerLower, innerLower, innerUpper), radius, sampleEnd)
+
+#given the current groove num (int), the rings of its revolution
+#and the edge it joins to, returns the ring pairs to quad-strip
+#in the same order connectVertices() strips them
+def grooveRingPairs(grooveNum, rings, edge):
+  outerUpper, outerLower, innerLower, innerUpper = rings
+  if (grooveNum==0): #if joining a groove to the edge of the record
+    pairs = [(edge,outerUpper),(outerUpper,outerLower)]
+  else: #if joining a groove to another groove
+    pairs = [(edge,outerLower)]
+  return pairs + [(outerLower,innerLower),(innerLower,innerUpper)]
+
+#given the current groove num (int) and the rings of its revolution,
+#adds the strips connecting them to lastEdge and each other to the mesh
+#as one block, then makes the inner upper ring the new last edge
+def connectGrooveRings(grooveNum, rings):
+  global lastEdge
+
+  pairs = grooveRingPairs(grooveNum, rings, lastEdge)
+  if indexedMesh(): #neighbouring strips share their rings
+    addFaces(numpy.concatenate([ringFaces(vl1,vl2) for vl1, vl2 in pairs]))
+  else:
+    addMeshBlock(stripBlock(pairs, vertexCount))
+
+  #set new last edge
+  lastEdge = rings[3]
+
+#given the current radius (float), the current groove num (int),
+#the audio data and the radIncr rate (float),
+#draws a whole groove revolution at once with numpy
+#and connects it as one mesh block, advancing samplenum.
+#returns the next radius (float)
+def drawGrooveRev(radius, grooveNum, audioData, audioLen, radIncr):
+  global samplenum
+
+  rings, radius, samplenum = grooveRings(radius, samplenum, grooveNum, audioData, audioLen, radIncr)
+  connectGrooveRings(grooveNum, rings)
+
+  return radius
+
+#given the current radius (float), the current groove num (int),
+#the audio data, the radIncr rate (float) and the total groove count for progress,
+#draws every remaining spiral groove in a pool of worker processes.
+#each groove's starting radius and sample are worked out up front,
+#the workers build their grooves' blocks independently,
+#and the blocks are added here in groove order so the mesh matches the serial one.
+#returns the next radius (float) and groove num (int)
+def drawGroovesParallel(radius, grooveNum, audioData, audioLen, radIncr, totalgroovenum):
+  global samplenum, lastEdge, vertexCount, workerAudio
+
+  #starting point of every remaining groove, stepped exactly like the serial loop
+  count = angularGrid().count
+  starts = []
+  while (sampleStep*samplenum<(audioLen-sampleStep*thetaIter+1)):
+    starts.append((grooveNum+len(starts), radius, samplenum))
+    radius = revolutionRadii(radius, count, radIncr)[-1]
+    samplenum += count
+  grooveStarts = dict((start[0], start[1:]) for start in starts) #(radius, sample) each groove starts at, for checkpoints
+  grooveStarts[grooveNum+len(starts)] = (radius, samplenum)
+
+  #the first task joins onto the last edge drawn here,
+  #the others rebuild it from the start of the groove before theirs
+  mode = grooveTaskMode()
+  tasks = []
+  for i in range(0, len(starts), grooveChunk):
+    tasks.append((starts[i-1] if i>0 else lastEdge, starts[i:i+grooveChunk], radIncr, mode))
+
+  workerAudio = (audioData, audioLen) #set before the pool forks so the workers inherit it
+  pool = multiprocessing.Pool(workers)
+  pending = collections.deque() #only a few tasks in flight, so finished blocks can't pile up in memory
+  for task in tasks:
+    pending.append(pool.apply_async(drawGrooveTask, (task,)))
+    if len(pending) > 2*workers:
+      grooveNum = addGrooveResults(pending.popleft().get(), mode, grooveNum, totalgroovenum, grooveStarts)
+  while pending:
+    grooveNum = addGrooveResults(pending.popleft().get(), mode, grooveNum, totalgroovenum, grooveStarts)
+  pool.close()
+  pool.join()
+  workerAudio = None
+
+  return (radius, grooveNum)
+
+#returns how worker processes should hand back their grooves:
+#"rings" for indexed meshes (stitched here, indices are global),
+#"stl" already encoded when streaming an stl, or plain strip "blocks"
+def grooveTaskMode():
+  if indexedMesh():
+    return "rings"
+  elif meshWriter is not None:
+    return "stl"
+  return "blocks"
+
+#runs in a worker process.
+#given (the edge to join the first groove to, or the start of the groove before it,
+#the starts of this task's grooves, radIncr, mode),
+#draws the task's grooves in order and returns one result per groove:
+#its rings, or its strip block (indices from 0) / encoded stl records plus its inner upper ring
+def drawGrooveTask(task):
+  edge, starts, radIncr, mode = task
+  audioData, audioLen = workerAudio
+
+  if not isinstance(edge, numpy.ndarray): #rebuild the previous groove's inner upper ring
+    edge = grooveRings(edge[1], edge[2], edge[0], audioData, audioLen, radIncr)[0][3]
+
+  results = []
+  for grooveNum, radius, sampleStart in starts:
+    rings = grooveRings(radius, sampleStart, grooveNum, audioData, audioLen, radIncr)[0]
+    if mode == "rings":
+      results.append(rings)
+    else:
+      block = stripBlock(grooveRingPairs(grooveNum, rings, edge), 0)
+      if mode == "stl":
+        block = (len(block[0]), mesh_output.encode_stl(block[0], block[1]))
+      results.append((block, rings[3]))
+    edge = rings[3]
+  return results
+
+#given one task's results from drawGrooveTask, the mode they were drawn in,
+#the current groove num (int), the total groove count and the (radius, sample)
+#each groove starts at, adds them to the mesh in order and returns the next groove num (int)
+def addGrooveResults(results, mode, grooveNum, totalgroovenum, grooveStarts):
+  global lastEdge, vertexCount
+
+  for result in results:
+    if mode == "rings":
+      connectGrooveRings(grooveNum, result)
+    elif mode == "stl": #already encoded for the stl writer
+      (blockVertexCount, records), lastEdge = result
+      meshWriter.write_records(records)
+      vertexCount += blockVertexCount
+      metrics.count(triangles=len(records))
+    else:
+      block, lastEdge = result
+      addMeshBlock((block[0], block[1]+vertexCount))
+
+    #tell me how much longer
+    grooveNum+=1
+    print str(grooveNum)+" of "+str(totalgroovenum)+" grooves drawn"+metrics.eta(grooveNum, totalgroovenum)
+    saveCheckpoint(grooveNum, *grooveStarts[grooveNum])
+
+  return grooveNum
+
 #given the current groove num (int)
 #quad-strips the grooves to connect the vertices 
 def connectVertices(grooveNum):
@@ -347,7 +1480,7 @@ def connectVertices(grooveNum):
   quadStrip(grooveInnerLower,grooveInnerUpper)
   
   #set new last edge
-  lastEdge = copy.copy(grooveInnerUpper)
+  lastEdge = shareRing(grooveInnerUpper, copy.copy(grooveInnerUpper))
 
 #given the current radius (float), and an audio sample (float),
 #creates two stops (vector lists), quad-strips them,
@@ -360,24 +1493,48 @@ def beginStartCap(radius, firstSample): #this is a tiny piece of geometry that c
   stop2.append([diameter/2+radius,diameter/2,grooveHeight]) #outerlower
   stop2.append([diameter/2+(radius-grooveWidth),diameter/2,grooveHeight]) #innerlower
   stop1.append([(diameter/2+(radius-grooveWidth-amplitude*bevel)),diameter/2,recordHeight]) #innerupper
-  quadStrip(stop1,stop2) #draw triangles
+  quadStrip(stop2,stop1) #draw triangles, facing back along the groove
   return stop1
 
-#given the current radius (float), and a vertex list for the previous stop
+#given the vertex list for the previous stop
 #finishes the start cap by quad-stripping the given stop with outer perimeter
-def finishStartCap(radius, stop1):
+def finishStartCap(stop1):
   stop2 = []
   stop2.append([diameter,diameter/2,recordHeight]) #outer perimeter[0]
-  stop2.append([(diameter/2+radius+amplitude*bevel),(diameter/2),recordHeight]) #outer groove edge [2pi]
+  stop2.append(stop1[1]) #outer groove edge [2pi], the first groove's outer upper edge closes on its inner upper one
   #draw triangles
   quadStrip(stop1,stop2)
 
+#resets all the per-record globals (sample position, vertex
+#and geometry storage, metrics) so the next record starts from scratch
+def resetState():
+  global samplenum, sampleStep, lastEdge, vertexCount, meshWriter, meshStore, metrics, checkpointWork
+
+  metrics = instrumentation.Metrics(profileStage)
+  checkpointWork = None
+  del checkpointBlocks[:]
+  samplenum = 0
+  sampleStep = rateDivisor
+  lastEdge = []
+  vertexCount = 0
+  meshWriter = None
+  if meshStore is not None:
+    meshStore.close()
+  meshStore = None
+  for storage in (recordPerimeterUpper, recordPerimeterLower, recordHoleUpper, recordHoleLower,
+      grooveOuterUpper, grooveOuterLower, grooveInnerUpper, grooveInnerLower):
+    del storage[:]
+  recentRings.clear()
+
 #resets global groove vertex storage
+#(emptied in place, rebinding the names here would only make locals)
 def clearGrooveStorage():
-  grooveOuterUpper = []
-  grooveOuterLower = []
-  grooveInnerUpper = []
-  grooveInnerLower = []
+  for ring in (grooveOuterUpper, grooveOuterLower, grooveInnerUpper, grooveInnerLower):
+    recentRings.pop(id(ring), None) #about to be refilled, its indexed vertices are stale
+  del grooveOuterUpper[:]
+  del grooveOuterLower[:]
+  del grooveInnerUpper[:]
+  del grooveInnerLower[:]
 
 #given the current radius (float), the current grooveNum (int)
 #audio data (float list) and the radIncr rate (float)
@@ -393,25 +1550,30 @@ def drawPenultGroove(radius,grooveNum,audioData,audioLen,radIncr):
   clearGrooveStorage()
   
   ridge = []
-  theta = 0
-  while (theta<2*math.pi): #draw part of spiral groove, until theta = changeTheta
-    if (theta<=changeTheta):
-      sineTheta = math.sin(theta)
-      cosineTheta = math.cos(theta)
+  angles = angularGrid()
+  step = 0
+  while (step<angles.count): #draw part of spiral groove, until theta = changeTheta
+    if (angles.thetas[step]<=changeTheta):
+      sineTheta = angles.sine_list[step]
+      cosineTheta = angles.cosine_list[step]
       ridge.append([(diameter/2+(radius-grooveWidth-amplitude*bevel)*cosineTheta),
         (diameter/2+(radius-grooveWidth-amplitude*bevel)*sineTheta),ridgeHeight])
-      radius = iterate(theta, radius, grooveNum, audioData, audioLen, radIncr)
+      radius = iterate(step, radius, grooveNum, audioData, audioLen, radIncr)
       ridgeHeight -= ridgeDecrNum
     else:
       break #get out of this for loop is theat > changeTheta
       
-    theta+=incrNum
+    step+=1
   
   #complete rev w/o audio data 
   grooveHeight = recordHeight-depth-amplitude #zero point for the groove
   
-  sineTheta = math.sin(theta) #using theta from where we left off
-  cosineTheta = math.cos(theta)
+  if (step<angles.count): #using theta from where we left off
+    sineTheta = angles.sine_list[step]
+    cosineTheta = angles.cosine_list[step]
+  else: #the whole revolution went by
+    sineTheta = math.sin(angles.end)
+    cosineTheta = math.cos(angles.end)
   grooveOuterLower.append([(diameter/2+radius*cosineTheta),(diameter/2+radius*sineTheta),grooveHeight])
   grooveInnerLower.append([(diameter/2+(radius-grooveWidth)*cosineTheta),
     (diameter/2+(radius-grooveWidth)*sineTheta),grooveHeight])
@@ -419,18 +1581,28 @@ def drawPenultGroove(radius,grooveNum,audioData,audioLen,radIncr):
     (diameter/2+(radius-grooveWidth-amplitude*bevel)*sineTheta),grooveHeight])
   quadStrip(grooveOuterLower,grooveInnerLower)
   quadStrip(grooveInnerLower,ridge)
+  merge = len(ridge)-1 #where the ridge reaches the floor
+  radius -= radIncr
+  step+=1
   
-  while(theta<2*math.pi): #for theta between current position and 2pi
-    sineTheta = math.sin(theta)
-    cosineTheta = math.cos(theta)
+  while(step<angles.count): #for theta between current position and 2pi
+    sineTheta = angles.sine_list[step]
+    cosineTheta = angles.cosine_list[step]
     grooveOuterLower.append([(diameter/2+radius*cosineTheta),(diameter/2+radius*sineTheta),grooveHeight])    
     ridge.append([(diameter/2+radius*cosineTheta),(diameter/2+radius*sineTheta),grooveHeight])    
     radius -= radIncr
 
-    theta+=incrNum
+    step+=1
+
+  #close both at theta=0, where the locked groove starts
+  grooveOuterLower.append([diameter/2+radius,diameter/2,grooveHeight])
+  ridge.append(grooveOuterLower[-1])
 
   #connect vertices
   quadStrip(lastEdge,grooveOuterLower)
+  #fill the floor between the merge point (ridge, inner lower, outer lower in a line)
+  #and the next step of the wide groove, which the ridge goes on to
+  quadStrip([ridge[merge],grooveInnerLower[-1]],[ridge[merge+1],grooveOuterLower[merge]])
   
   #set new last edge
   lastEdge = copy.copy(ridge)
@@ -0,0 +1,81 @@
+# a small record for the tests to render: a few seconds of a tremolo
+# tone on a two inch disc at 2000 theta steps per revolution, six
+# grooves in all, so every engine and output path runs in under a second
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import os
+import sys
+import wave
+import hashlib
+import numpy
+import records
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+SPEC = records.RecordSpec(dpi=150, diameter=2.0, inner_rad=0.3, outer_rad=0.9, steps_per_rev=2000)
+SECONDS = 12
+SAMPLE_RATE = 44100
+NO_CACHE = {"audioCacheDir": None, "baseCacheDir": None} # every render starts from the audio and draws its own base
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Returns the test signal, a 440 hz tone with a slow tremolo
+def signal(seconds=SECONDS):
+  t = numpy.arange(int(seconds*SAMPLE_RATE))/float(SAMPLE_RATE)
+  return numpy.sin(2*numpy.pi*440*t)*numpy.sin(2*numpy.pi*0.7*t)
+
+# Writes the signal (or the given samples, -1 to 1) as a 16 bit mono wav
+def write_wav(filename, audio=None):
+  samples = signal() if audio is None else audio
+  f = wave.open(filename, "wb")
+  f.setnchannels(1)
+  f.setsampwidth(2)
+  f.setframerate(SAMPLE_RATE)
+  f.writeframes(numpy.round(32767*numpy.asarray(samples)).astype("<i2").tobytes())
+  f.close()
+
+# Returns the md5 of the given file's contents
+def file_hash(filename):
+  with open(filename, "rb") as f:
+    return hashlib.md5(f.read()).hexdigest()
+
+# Renders the signal (or the given audio) into the given directory with
+# the named stl_generator settings, without printing its progress,
+# and returns the mesh file written
+def render(directory, name, audio=None, **settings):
+  options = dict(NO_CACHE)
+  options.update(settings)
+  output = os.path.join(directory, name + "." + options.get("meshFormat", "stl"))
+  stdout = sys.stdout
+  sys.stdout = open(os.devnull, "w")
+  try:
+    return records.render_stl(SPEC, signal() if audio is None else audio, output, **options)
+  finally:
+    sys.stdout.close()
+    sys.stdout = stdout
+
+# Cuts the signal into laser files named after the given name in the
+# given directory, without printing its progress, and returns the
+# files written. The laser generator keeps its own spiral pitch and
+# cycle, so only the spec's radii and diameter apply
+def render_laser(directory, name, **settings):
+  spec = records.RecordSpec(diameter=SPEC.diameter, inner_rad=SPEC.inner_rad, outer_rad=SPEC.outer_rad)
+  stdout = sys.stdout
+  sys.stdout = open(os.devnull, "w")
+  try:
+    return records.render_laser(spec, signal(), os.path.join(directory, name), audio_cache_dir=None, **settings)
+  finally:
+    sys.stdout.close()
+    sys.stdout = stdout
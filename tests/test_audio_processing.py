@@ -0,0 +1,228 @@
+# tests for the shared audio decoding, covering the RIFF chunk walker,
+# sample decoding at every width, the channel modes and the resampler.
+# run from the top of the repo with
+#   python -m unittest discover tests
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import os
+import io
+import wave
+import shutil
+import struct
+import tempfile
+import unittest
+import numpy
+import audio_processing
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Returns the bytes of a wav holding the given (frames, channels) samples,
+# already in the file's own scale, as format_tag samples sampwidth bytes wide.
+# extensible wraps the tag in a WAVE_FORMAT_EXTENSIBLE fmt chunk,
+# extra is a list of (id, bytes) chunks put before the data chunk
+def wav_bytes(frames, sampwidth, format_tag=audio_processing.WAVE_FORMAT_PCM, extensible=False, extra=()):
+  frames = numpy.asarray(frames)
+  channels = frames.shape[1]
+  if format_tag == audio_processing.WAVE_FORMAT_IEEE_FLOAT:
+    data = frames.astype("<f%d" % sampwidth).tobytes()
+  elif sampwidth == 1:
+    data = (frames + 128).astype(numpy.uint8).tobytes()
+  elif sampwidth == 3:
+    data = frames.astype("<i4").view(numpy.uint8).reshape(-1, 4)[:, :3].tobytes()
+  else:
+    data = frames.astype("<i%d" % sampwidth).tobytes()
+
+  block = sampwidth*channels
+  fields = (channels, 44100, 44100*block, block, 8*sampwidth)
+  if extensible: # the real tag is the start of the sub-format guid
+    fmt = struct.pack("<HHIIHHHHI", audio_processing.WAVE_FORMAT_EXTENSIBLE, *(fields + (22, 8*sampwidth, 3)))
+    fmt += struct.pack("<H", format_tag) + b"\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71"
+  else:
+    fmt = struct.pack("<HHIIHH", format_tag, *fields)
+
+  chunks = [(b"fmt ", fmt)] + list(extra) + [(b"data", data)]
+  body = b"".join(struct.pack("<4sI", name, len(content)) + content + b"\x00"*(len(content) % 2)
+    for name, content in chunks)
+  return struct.pack("<4sI4s", b"RIFF", 4 + len(body), b"WAVE") + body
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+class WavHeaderTest(unittest.TestCase):
+
+  def test_pcm(self):
+    raw = wav_bytes(numpy.zeros((10, 2)), 2)
+    header = audio_processing.read_wav_header(io.BytesIO(raw))
+    self.assertEqual(header["format"], audio_processing.WAVE_FORMAT_PCM)
+    self.assertEqual((header["channels"], header["rate"], header["sampwidth"]), (2, 44100.0, 2))
+    self.assertEqual((header["offset"], header["size"]), (44, 40))
+
+  # the format tag comes from the sub-format guid
+  def test_extensible(self):
+    raw = wav_bytes(numpy.zeros((10, 1)), 4, audio_processing.WAVE_FORMAT_IEEE_FLOAT, extensible=True)
+    header = audio_processing.read_wav_header(io.BytesIO(raw))
+    self.assertEqual(header["format"], audio_processing.WAVE_FORMAT_IEEE_FLOAT)
+    self.assertTrue(audio_processing.is_float_format(header))
+
+  # odd sized chunks are padded to an even length
+  def test_skips_other_chunks(self):
+    extra = [(b"LIST", b"odd"), (b"fact", b"\x0a\x00\x00\x00")]
+    raw = wav_bytes(numpy.arange(10).reshape(10, 1), 2, extra=extra)
+    f = io.BytesIO(raw)
+    header = audio_processing.read_wav_header(f)
+    self.assertEqual(header["size"], 20)
+    self.assertEqual(raw[header["offset"]:header["offset"]+4], b"\x00\x00\x01\x00")
+
+  def test_bad_files(self):
+    for raw in (b"RIFX\x00\x00\x00\x00WAVE", wav_bytes(numpy.zeros((2, 1)), 2)[:36]):
+      self.assertRaises(ValueError, audio_processing.read_wav_header, io.BytesIO(raw))
+    data_first = struct.pack("<4sI4s4sI", b"RIFF", 12, b"WAVE", b"data", 0)
+    self.assertRaises(ValueError, audio_processing.read_wav_header, io.BytesIO(data_first))
+    header = {"format": audio_processing.WAVE_FORMAT_EXTENSIBLE}
+    self.assertRaises(ValueError, audio_processing.is_float_format, header)
+
+class DecodeTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  # writes the wav and returns what decode_wav makes of it
+  def decode(self, raw, amplitude=1.0, channels=audio_processing.CHANNEL_LEFT):
+    filename = os.path.join(self.directory, "test.wav")
+    with open(filename, "wb") as f:
+      f.write(raw)
+    return audio_processing.decode_wav(filename, amplitude, channels)
+
+  # every integer width decodes to the same samples, full scale or not
+  def test_integer_widths(self):
+    ramp = numpy.array([0, 1, -1, 50, -100, 127, -128])
+    for sampwidth in (1, 2, 3, 4):
+      scale = 2**(8*sampwidth-8)
+      frames = (ramp*scale).reshape(-1, 1)
+      raw = wav_bytes(frames, sampwidth)
+      header = audio_processing.read_wav_header(io.BytesIO(raw))
+      data = raw[header["offset"]:header["offset"]+header["size"]]
+      decoded = audio_processing.decode_frames(data, sampwidth, 1)
+      numpy.testing.assert_array_equal(decoded[:, 0], ramp*scale)
+      numpy.testing.assert_allclose(self.decode(raw), ramp/128.0, rtol=1e-6)
+
+  def test_float_widths(self):
+    frames = numpy.array([[0.25, -0.5], [0.125, 0.0], [-0.0625, 1.0]])
+    for sampwidth in (4, 8):
+      raw = wav_bytes(frames, sampwidth, audio_processing.WAVE_FORMAT_IEEE_FLOAT, extensible=True)
+      numpy.testing.assert_array_equal(self.decode(raw, 0.5), [0.5, 0.25, -0.125])
+
+  # matches the wave module on a plain 16 bit stereo file
+  def test_matches_wave_module(self):
+    frames = numpy.random.RandomState(1).randint(-32768, 32768, size=(1000, 2))
+    raw = wav_bytes(frames, 2)
+    w = wave.open(io.BytesIO(raw))
+    expected = numpy.frombuffer(w.readframes(w.getnframes()), dtype="<i2").reshape(-1, 2)
+    w.close()
+    header = audio_processing.read_wav_header(io.BytesIO(raw))
+    numpy.testing.assert_array_equal(audio_processing.decode_frames(raw[header["offset"]:], 2, 2), expected)
+
+  def test_channel_modes(self):
+    frames = numpy.array([[100, -20, 7], [-40, 60, 1], [20, 20, -9]])
+    raw = wav_bytes(frames, 2)
+    numpy.testing.assert_allclose(self.decode(raw, 1.0, audio_processing.CHANNEL_LEFT), [1.0, -0.4, 0.2], rtol=1e-6)
+    numpy.testing.assert_allclose(self.decode(raw, 29.0, audio_processing.CHANNEL_MEAN), [29.0, 7.0, 31/3.0], rtol=1e-6)
+    numpy.testing.assert_allclose(self.decode(raw, 1.0, audio_processing.CHANNEL_MID), [1.0, 0.25, 0.5], rtol=1e-6)
+
+  # silence stays silent instead of dividing by zero
+  def test_silence(self):
+    numpy.testing.assert_array_equal(self.decode(wav_bytes(numpy.zeros((5, 1)), 2)), numpy.zeros(5))
+
+class ResampleTest(unittest.TestCase):
+
+  # a sine of the given frequency sampled at rate, count samples long
+  def tone(self, frequency, rate, count):
+    return numpy.sin(2*numpy.pi*frequency*numpy.arange(count)/float(rate))
+
+  def test_rate_ratio(self):
+    self.assertEqual(audio_processing.rate_ratio(44100, 11025), (1, 4))
+    self.assertEqual(audio_processing.rate_ratio(44100, 48000), (160, 147))
+    self.assertEqual(audio_processing.rate_ratio(44100, 44100), (1, 1))
+    self.assertRaises(ValueError, audio_processing.rate_ratio, 44100, 1e-9)
+
+  def test_length(self):
+    for count in (0, 1, 7, 1000, 4097):
+      for target in (11025, 14700, 48000):
+        (up, down) = audio_processing.rate_ratio(44100, target)
+        out = audio_processing.resample(numpy.ones(count), 44100, target)
+        self.assertEqual(len(out), -(-count*up//down))
+        self.assertEqual(out.dtype, numpy.float32)
+
+  def test_same_rate(self):
+    signal = self.tone(1000, 44100, 500)
+    numpy.testing.assert_array_equal(audio_processing.resample(signal, 44100, 44100), signal.astype(numpy.float32))
+
+  # tones below the new nyquist come through at the same level and in time
+  # with the input, away from the edges where the filter runs off the signal
+  def test_passband(self):
+    for target in (11025, 14700, 48000):
+      out = audio_processing.resample(self.tone(1000, 44100, 44100), 44100, target)
+      expected = self.tone(1000, target, len(out))
+      numpy.testing.assert_allclose(out[200:-200], expected[200:-200], atol=2e-3)
+
+  # a tone above the new nyquist is filtered out instead of folding back down
+  def test_stopband(self):
+    out = audio_processing.resample(self.tone(7000, 44100, 44100), 44100, 11025)
+    self.assertLess(numpy.abs(out[200:-200]).max(), 1e-3)
+    decimated = self.tone(7000, 44100, 44100)[::4]
+    self.assertGreater(numpy.abs(decimated).max(), 0.9)
+
+  def test_dc_gain(self):
+    for target in (11025, 14700, 48000):
+      out = audio_processing.resample(numpy.ones(20000), 44100, target)
+      numpy.testing.assert_allclose(out[200:-200], 1.0, atol=1e-4)
+
+  # the output doesn't depend on how it is chunked or where the samples come from
+  def test_chunks_and_streams(self):
+    signal = numpy.random.RandomState(2).uniform(-1, 1, size=(50000, 1))
+    directory = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(directory, "test.wav")
+      with open(filename, "wb") as f:
+        f.write(wav_bytes(signal, 4, audio_processing.WAVE_FORMAT_IEEE_FLOAT))
+      audio = audio_processing.decode_wav(filename, 1.0)
+      for target in (11025, 14700):
+        whole = audio_processing.resample(audio, 44100, target)
+        numpy.testing.assert_array_equal(audio_processing.resample(audio, 44100, target, chunk=1), whole)
+        stream = audio_processing.WavStream(filename, 1.0, block_frames=3000)
+        numpy.testing.assert_array_equal(audio_processing.resample(stream, 44100, target), whole)
+    finally:
+      shutil.rmtree(directory)
+
+  # a resampled stream reads back the same normalized samples as the
+  # whole resampled track, by position, by index array and across chunks
+  def test_resampled_stream(self):
+    signal = numpy.random.RandomState(3).uniform(-1, 1, size=50000)
+    for target in (11025, 14700):
+      whole = audio_processing.normalize(audio_processing.resample(signal, 44100, target), 0.5)
+      stream = audio_processing.ResampledStream(signal, 44100, target, 0.5, chunk=1)
+      self.assertEqual(len(stream), len(whole))
+      numpy.testing.assert_array_equal(stream[numpy.arange(len(whole))], whole)
+      indices = numpy.arange(0, len(whole), 7)
+      numpy.testing.assert_array_equal(stream[indices], whole[indices])
+      self.assertEqual(stream[len(whole) - 1], whole[-1])
+      self.assertEqual(stream[3], whole[3]) # moving back starts over
+    silence = audio_processing.ResampledStream(numpy.zeros(1000), 44100, 11025, 0.5)
+    numpy.testing.assert_array_equal(silence[numpy.arange(len(silence))], numpy.zeros(250))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,126 @@
+# tests that a render killed partway through and resumed from its
+# checkpoint writes the same record as one drawn straight through,
+# streamed or stored, in every format and with worker processes
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import os
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+import stl_generator
+import synthetic
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+CHECKPOINT_EVERY = 2 # grooves
+CRASH_AFTER = 5 # grooves drawn when the interrupted render dies, one past its last checkpoint
+CRASH_STATUS = 3 # exit status of the interrupted render
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Renders the test record with checkpoints and dies like a killed
+# process, leaving everything as it is, once CRASH_AFTER grooves
+# are drawn. Run it in a process of its own
+def interrupted_render(directory, settings):
+  save = stl_generator.saveCheckpoint
+  def save_and_die(grooveNum, radius, sampleNum):
+    save(grooveNum, radius, sampleNum)
+    if grooveNum >= CRASH_AFTER:
+      os._exit(CRASH_STATUS)
+  stl_generator.saveCheckpoint = save_and_die
+  synthetic.render(directory, "resumed", checkpointEvery=CHECKPOINT_EVERY, **settings)
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+class CheckpointTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  # runs interrupted_render with the given settings in its own process
+  # and checks it died partway through, leaving a checkpoint
+  def interrupt(self, **settings):
+    process = multiprocessing.Process(target=interrupted_render, args=(self.directory, settings))
+    process.start()
+    process.join()
+    self.assertEqual(process.exitcode, CRASH_STATUS)
+    output = os.path.join(self.directory, "resumed." + settings.get("meshFormat", "stl"))
+    self.assertTrue(os.path.exists(os.path.join(stl_generator.checkpointPath(output), "state.pickle")))
+
+  # resumes the interrupted render with the given settings and returns
+  # the mesh file and the groove it carried on from, None if it started over
+  def resume(self, **settings):
+    restored = [None]
+    restore = stl_generator.restoreCheckpoint
+    def restore_and_record(checkpoint, outputFilename):
+      restored[0] = checkpoint["grooveNum"]
+      return restore(checkpoint, outputFilename)
+    stl_generator.restoreCheckpoint = restore_and_record
+    try:
+      output = synthetic.render(self.directory, "resumed", resume=True, **settings)
+    finally:
+      stl_generator.restoreCheckpoint = restore
+    return (output, restored[0])
+
+  # interrupts a render with the given settings, then resumes it with
+  # resume_settings (by default the same plus checkpoints) and checks it
+  # carries on from the last checkpoint and comes out the same as a
+  # render drawn straight through, deleting the checkpoint
+  def assertResumes(self, resume_settings=None, **settings):
+    reference = synthetic.file_hash(synthetic.render(self.directory, "reference", **settings))
+    self.interrupt(**settings)
+    if resume_settings is None:
+      resume_settings = dict(settings, checkpointEvery=CHECKPOINT_EVERY)
+    (output, groove) = self.resume(**resume_settings)
+    self.assertEqual(groove, CRASH_AFTER//CHECKPOINT_EVERY*CHECKPOINT_EVERY)
+    self.assertEqual(synthetic.file_hash(output), reference, "%r resumed differently" % settings)
+    self.assertFalse(os.path.exists(stl_generator.checkpointPath(output)))
+
+  def test_streamed(self):
+    for meshFormat in ("stl", "ply", "obj", "3mf"):
+      self.assertResumes(meshFormat=meshFormat)
+
+  def test_stored(self):
+    for meshFormat in ("stl", "ply"):
+      self.assertResumes(meshFormat=meshFormat, streamMesh=False)
+    self.assertResumes(memmapDir=self.directory)
+
+  def test_workers_and_pipeline(self):
+    self.assertResumes(workers=3, grooveChunk=1)
+    self.assertResumes(pipelineMode=True)
+    self.assertResumes(decimateMicrons=5)
+
+  # the same command with --resume and nothing else still finishes the record
+  def test_resume_alone(self):
+    self.assertResumes(resume_settings={})
+
+  # a checkpoint of different audio is ignored, not carried on from
+  def test_other_audio(self):
+    reference = synthetic.file_hash(synthetic.render(self.directory, "reference"))
+    self.interrupt(audio=0.5*synthetic.signal()[::-1])
+    (output, groove) = self.resume(checkpointEvery=CHECKPOINT_EVERY)
+    self.assertEqual(groove, None)
+    self.assertEqual(synthetic.file_hash(output), reference)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,97 @@
+# tests that every way of drawing the grooves builds the same record:
+# the serial and vector engines, worker processes and the pipeline
+# all have to write byte for byte the same mesh
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import os
+import shutil
+import tempfile
+import unittest
+import synthetic
+import audio_processing
+import stl_generator
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+class EngineTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  # renders with each group of settings and checks every
+  # file hashes the same as the render with none of them
+  def assertSameMesh(self, variants, **settings):
+    reference = synthetic.file_hash(synthetic.render(self.directory, "reference", **settings))
+    for number, variant in enumerate(variants):
+      variant = dict(settings, **variant)
+      output = synthetic.render(self.directory, "variant%d" % number, **variant)
+      self.assertEqual(synthetic.file_hash(output), reference, "%r changed the mesh" % variant)
+
+  def test_serial_engine(self):
+    for meshFormat in ("stl", "ply"):
+      self.assertSameMesh([{"vectorEngine": False}], meshFormat=meshFormat)
+
+  # several grooves to a task and one, so tasks both join onto the groove
+  # drawn here and rebuild the edge before theirs
+  def test_workers(self):
+    for meshFormat in ("stl", "ply"):
+      self.assertSameMesh([{"workers": 3, "grooveChunk": 1}, {"workers": 2, "grooveChunk": 4}], meshFormat=meshFormat)
+    self.assertSameMesh([{"workers": 3, "grooveChunk": 1}], decimateMicrons=5)
+
+  # a kept mesh holds float32 vertices, and the stl normals are worked
+  # out from those same float32 vertices when streaming too
+  def test_mesh_store(self):
+    for meshFormat in ("stl", "ply"):
+      self.assertSameMesh([{"streamMesh": False}, {"streamMesh": False, "memmapDir": self.directory}], meshFormat=meshFormat)
+    self.assertSameMesh([{"streamMesh": False}], decimateMicrons=5)
+
+  def test_pipeline(self):
+    for meshFormat in ("stl", "ply"):
+      self.assertSameMesh([{"pipelineMode": True}, {"pipelineMode": True, "workers": 3, "grooveChunk": 1}],
+        meshFormat=meshFormat)
+
+  # at full rate without anti-aliasing the pipeline streams the wav,
+  # decoding blocks ahead in a thread instead of all at once up front
+  def test_pipeline_decoding(self):
+    audio = os.path.join(self.directory, "test.wav")
+    synthetic.write_wav(audio, synthetic.signal(4))
+    self.assertSameMesh([{"pipelineMode": True}, {"streamAudio": True}], audio=audio, stepsPerRev=None, antiAlias=False)
+
+  # streaming resamples the track a chunk at a time as the grooves read it
+  def test_streamed_resampling(self):
+    audio = os.path.join(self.directory, "test.wav")
+    synthetic.write_wav(audio)
+    self.assertSameMesh([{"streamAudio": True}, {"streamAudio": True, "vectorEngine": False}], audio=audio)
+    self.assertSameMesh([{"streamAudio": True}], audio=audio, decimateMicrons=5)
+
+  # without anti-aliasing a revolution steps sampleStep samples at a time,
+  # so a track of int(sampleStep*N) samples has no sample after its last
+  # revolution to close it with. The closing height is 0 instead
+  def test_audio_ending_on_a_revolution(self):
+    stl_generator.configure(synthetic.SPEC)
+    audio = synthetic.signal()[:int(stl_generator.rateDivisor*6*synthetic.SPEC.steps_per_rev)]
+    self.assertSameMesh([{"vectorEngine": False}, {"workers": 3, "grooveChunk": 1}], audio=audio, antiAlias=False)
+
+  # anti-aliasing resamples to exactly one sample a step, so any track
+  # that resamples to a whole number of revolutions ends on one
+  def test_resampled_audio_ending_on_a_revolution(self):
+    stl_generator.configure(synthetic.SPEC)
+    targetRate = stl_generator.samplingRate/stl_generator.rateDivisor
+    (up, down) = audio_processing.rate_ratio(stl_generator.samplingRate, targetRate)
+    audio = synthetic.signal()[:6*synthetic.SPEC.steps_per_rev*down//up]
+    self.assertEqual(len(audio_processing.resample(audio, stl_generator.samplingRate, targetRate)), 6*synthetic.SPEC.steps_per_rev)
+    self.assertSameMesh([{"vectorEngine": False}, {"workers": 3, "grooveChunk": 1}], audio=audio)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,105 @@
+# tests that pin the stitching fixes the mesh checker found in the stl
+# generator: each one checks the part of a render that fix changed, so
+# a regression shows up here by name instead of as a count in test_render
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import math
+import shutil
+import tempfile
+import unittest
+import numpy
+import synthetic
+import audio_processing
+import stl_generator
+import mesh_check
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+class GeometryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  # renders with the given settings and returns the welded
+  # (float64 vertices, faces) of the file written
+  def render(self, **settings):
+    (vertices, faces) = mesh_check.weld(*mesh_check.read_mesh(synthetic.render(self.directory, "record", **settings)))
+    return (numpy.asarray(vertices, dtype=numpy.float64), numpy.asarray(faces, dtype=numpy.int64))
+
+  # setUpRecordShape hands the record's top edge to the first groove
+  # through the global lastEdge. Assigned as a local, the first groove was
+  # joined to nothing, and the top between the edge and the groove was open:
+  # no triangle of it reached the record's outer edge
+  def test_edge_joins_first_groove(self):
+    (vertices, faces) = self.render()
+    triangles = vertices[faces]
+    radii = numpy.hypot(triangles[:, :, 0] - stl_generator.diameter/2, triangles[:, :, 1] - stl_generator.diameter/2)
+    top = (triangles[:, :, 2] == numpy.float32(stl_generator.recordHeight)).all(axis=1)
+    edge = stl_generator.diameter/2 - 1e-6
+    strip = top & (radii.max(axis=1) > edge) & (radii.min(axis=1) < edge)
+    self.assertEqual(strip.sum(), 2*(stl_generator.angularGrid().count + 1))
+
+  # drawPenultGroove closes the penultimate groove's floor and ridge at
+  # theta 0, where the locked groove starts, and fills the floor where the
+  # ridge comes down onto it. Before, both stopped a step short of 2pi and
+  # the ridge crossed the floor past a point on it, leaving six open edges
+  # and a T-junction there. Now the only flaws are the start cap's flat
+  # sliver and the point where the wide groove narrows to nothing, and the
+  # render has exactly the triangles fullResolutionTriangles counts
+  def test_locked_groove_seams(self):
+    (vertices, faces) = self.render()
+    report = mesh_check.check_welded(vertices, faces, stl_generator.grooveLayout())
+    problems = report["problems"]
+    for name in ("holes", "non_manifold"):
+      self.assertEqual(problems[name]["count"], 0, "%s at %r" % (name, problems[name]["locations"]))
+    self.assertEqual(problems["degenerate"]["count"], 2)
+    self.assertEqual(problems["zero_area"]["count"], 1)
+
+    count = stl_generator.angularGrid().count
+    audioLen = audio_processing.resampled_length(len(synthetic.signal()), stl_generator.samplingRate,
+      stl_generator.samplingRate/stl_generator.rateDivisor)
+    self.assertEqual(report["triangles"],
+      stl_generator.fullResolutionTriangles(stl_generator.spiralGrooveCount(audioLen, count), count))
+
+  # every triangle faces out of the record, so the mesh encloses a
+  # positive volume: the disc less its hole and a few percent for the
+  # grooves. Before, the first triangle of every strip quad faced in,
+  # and the two halves of the surface cancelled out to about nothing.
+  # stl strips, indexed strips and rings zipped by angle are all checked
+  def test_winding(self):
+    for settings in ({}, {"meshFormat": "ply"}, {"decimateMicrons": 5}):
+      (vertices, faces) = self.render(**settings)
+      triangles = vertices[faces]
+      volume = (triangles[:, 0]*numpy.cross(triangles[:, 1], triangles[:, 2])).sum()/6
+      disc = math.pi*((stl_generator.diameter/2)**2 - stl_generator.innerHole**2)*stl_generator.recordHeight
+      self.assertTrue(0.95 < volume/disc < 1, "%r encloses %g of the disc" % (settings, volume/disc))
+      report = mesh_check.check_welded(vertices, faces)
+      self.assertEqual(report["problems"]["flipped"]["count"], 0, "flipped triangles with %r" % settings)
+
+  # finishStartCap closes the start cap onto the vertex the first groove's
+  # outer upper edge closes on. It used to work that point out again from
+  # the radius left after the revolution, which only lands on the same
+  # float32 point when a revolution is exactly one groove pitch of radius
+  # steps. On this small disc at the default steps per revolution it welded
+  # apart, leaving 2 open edges and 1 non-manifold edge where the first
+  # groove starts
+  def test_start_cap(self):
+    for (case, settings) in (("2000 steps", {}), ("default steps", {"stepsPerRev": None, "audio": synthetic.signal(4)})):
+      (vertices, faces) = self.render(**settings)
+      problems = mesh_check.check_welded(vertices, faces, stl_generator.grooveLayout())["problems"]
+      for name in ("holes", "non_manifold"):
+        self.assertEqual(problems[name]["count"], 0, "%s at %r at %s" % (name, problems[name]["locations"], case))
+
+if __name__ == "__main__":
+  unittest.main()
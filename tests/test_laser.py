@@ -0,0 +1,116 @@
+# tests that the laser generator still cuts the original spiral:
+# the segments of every pdf are compared, as a set, with the ones the
+# original generator drew one canvas.line at a time, so joining them
+# into toolpaths and reordering them doesn't count as a change
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import re
+import zlib
+import struct
+import hashlib
+import shutil
+import tempfile
+import unittest
+import synthetic
+import laser_output
+import laser_cut_generator
+import records
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+# (segments, md5 of the sorted segments) of each pdf the original
+# generator drew for the synthetic signal on the synthetic disc
+BASELINE = [(4872, "e1dd7ca5c2bcb3c280ea779e6cec0eff"), (4858, "30848e1ffc404ec071c1b8b014303a6d")]
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Takes ascii85 text (reportlab's page streams) and returns the bytes it encodes
+def ascii85(text):
+  text = "".join(text.split())
+  if text.endswith("~>"):
+    text = text[:-2]
+  decoded = []
+  group = []
+  for char in text:
+    if char == "z" and not group:
+      decoded.append("\0\0\0\0")
+      continue
+    group.append(ord(char) - 33)
+    if len(group) == 5:
+      decoded.append(struct.pack(">I", reduce(lambda value, digit: value*85 + digit, group)))
+      group = []
+  if group: # a short last group is padded with the highest digit and cut back
+    count = len(group)
+    decoded.append(struct.pack(">I", reduce(lambda value, digit: value*85 + digit, group + [84]*(5 - count)))[:count - 1])
+  return "".join(decoded)
+
+# Returns the straight segments stroked in a pdf as pairs of points,
+# each pair in sorted order so the direction they were cut in doesn't matter
+def segments(filename):
+  with open(filename, "rb") as f:
+    data = f.read()
+  found = []
+  for match in re.finditer(r"<<(.*?)>>\s*stream\r?\n(.*?)endstream", data, re.S):
+    (dictionary, content) = match.groups()
+    if "ASCII85Decode" in dictionary:
+      content = ascii85(content)
+    if "FlateDecode" in dictionary:
+      content = zlib.decompress(content)
+    tokens = content.split()
+    point = None
+    for i, token in enumerate(tokens):
+      if token == "m":
+        point = tuple(tokens[i-2:i])
+      elif token == "l":
+        found.append(tuple(sorted((point, tuple(tokens[i-2:i])))))
+        point = tuple(tokens[i-2:i])
+  return found
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+@unittest.skipIf(laser_output.canvas is None, "pdf output needs reportlab")
+class LaserTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def assertBaseline(self, files):
+    drawn = []
+    for filename in files:
+      found = segments(filename)
+      drawn.append((len(found), hashlib.md5(repr(sorted(found))).hexdigest()))
+    self.assertEqual(drawn, BASELINE)
+
+  # a cycle is 5880 steps of 2pi/5880 plus the one the rounding leaves
+  # just short of 2pi, as in the original theta loop
+  def test_cycle_steps(self):
+    laser_cut_generator.configure(records.RecordSpec())
+    self.assertEqual(laser_cut_generator.cycleGrid().count, 5881)
+
+  def test_spiral(self):
+    self.assertBaseline(synthetic.render_laser(self.directory, "spiral"))
+
+  def test_workers(self):
+    self.assertBaseline(synthetic.render_laser(self.directory, "workers", workers=2))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,201 @@
+# tests for the mesh checker: welding, each kind of problem on small
+# hand made meshes, every mesh format it reads, and clean renders
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy
+import mesh_check
+import mesh_output
+import stl_generator
+import synthetic
+
+#######################################
+#                                     #
+#            IO FUNCTIONS             #
+#                                     #
+#######################################
+
+# Returns the (vertices, faces) of an octahedron around the origin,
+# every triangle wound to face out
+def octahedron():
+  vertices = numpy.array([[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]], dtype=numpy.float64)
+  faces = numpy.array([[x, y, z] for x in (0, 3) for y in (1, 4) for z in (2, 5)])
+  corners = vertices[faces]
+  inward = (numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])*corners.sum(axis=1)).sum(axis=1) < 0
+  faces[inward] = faces[inward][:, ::-1]
+  return (vertices, faces)
+
+# Takes (vertices, faces) and returns them as a triangle soup, the way an stl
+# stores them: three vertices of its own for every face
+def soup(vertices, faces):
+  return (numpy.asarray(vertices)[numpy.asarray(faces)].reshape(-1, 3), numpy.arange(3*len(faces)).reshape(-1, 3))
+
+# Returns check()'s problem counts for the (vertices, faces) as a soup
+def counts(vertices, faces):
+  report = mesh_check.check(*soup(vertices, faces))
+  return dict((name, problem["count"]) for name, problem in report["problems"].items())
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+class ProblemTest(unittest.TestCase):
+
+  # checks the (vertices, faces) have the given problem counts and no others
+  def assertCounts(self, vertices, faces, **expected):
+    found = counts(vertices, faces)
+    for name in mesh_check.PROBLEMS:
+      self.assertEqual(found[name], expected.get(name, 0), "%s: %r" % (name, found))
+
+  def test_closed(self):
+    (vertices, faces) = octahedron()
+    self.assertCounts(vertices, faces)
+    report = mesh_check.check(*soup(vertices, faces))
+    self.assertEqual((report["vertices"], report["triangles"]), (6, 8))
+
+  def test_hole(self):
+    (vertices, faces) = octahedron()
+    self.assertCounts(vertices, faces[1:], holes=3)
+
+  def test_flipped(self):
+    (vertices, faces) = octahedron()
+    faces[0] = faces[0][::-1]
+    self.assertCounts(vertices, faces, flipped=3)
+
+  def test_non_manifold(self):
+    (vertices, faces) = octahedron()
+    fin = numpy.concatenate((faces, [faces[0][::-1]]))
+    self.assertEqual(counts(vertices, fin)["non_manifold"], 3)
+
+  # degenerate triangles are left out of the edge checks
+  def test_degenerate(self):
+    (vertices, faces) = octahedron()
+    self.assertCounts(vertices, numpy.concatenate((faces, [[0, 0, 1]])), degenerate=1)
+
+  def test_zero_area(self):
+    (vertices, faces) = octahedron()
+    vertices = numpy.concatenate((vertices, [[0.5, 0.5, 0]])) # halfway along the edge from 0 to 1
+    self.assertEqual(counts(vertices, numpy.concatenate((faces, [[0, 1, 6]])))["zero_area"], 1)
+
+  # two triangles wound the same way round their shared edge but doubled back over it
+  def test_folded(self):
+    vertices = numpy.array([[0, 0, 0], [1, 0, 0], [0.5, 1, 0], [0.5, 1, 0.01]])
+    found = counts(vertices, [[0, 1, 2], [1, 0, 3]])
+    self.assertEqual((found["folded"], found["flipped"]), (1, 0))
+
+class WeldTest(unittest.TestCase):
+
+  def setUp(self):
+    self.settings = (mesh_check.CHECK_CHUNK, mesh_check.POSITION_HASH)
+
+  def tearDown(self):
+    (mesh_check.CHECK_CHUNK, mesh_check.POSITION_HASH) = self.settings
+
+  # welds a shuffled soup of repeated points and checks it against
+  # numpy.unique: every position once, numbered where it first turns up,
+  # and every face still on the same points
+  def assertWelds(self, count=5000):
+    random = numpy.random.RandomState(3)
+    pool = random.uniform(-2, 2, size=(count//10, 3)).astype(numpy.float32)
+    pool[:10, 0] = 0.0
+    pool = numpy.concatenate((pool, pool[:, [1, 0, 2]])) # the same coordinates in another order, a collision with POSITION_HASH 1
+    vertices = pool[random.randint(0, len(pool), size=count)].astype(numpy.float64)
+    zeros = numpy.flatnonzero(vertices[:, 0] == 0)
+    vertices[zeros[::2], 0] = -0.0 # the same place as 0.0
+    faces = random.randint(0, count, size=(count, 3))
+
+    (welded, welded_faces) = mesh_check.weld(vertices, faces)
+    (unique, firsts) = numpy.unique(mesh_check.position_bits(vertices), axis=0, return_index=True)
+    self.assertEqual(len(welded), len(unique))
+    numpy.testing.assert_array_equal(welded, vertices[numpy.sort(firsts)].astype(numpy.float32))
+    numpy.testing.assert_array_equal(welded[welded_faces], vertices[faces].astype(numpy.float32) + numpy.float32(0.0))
+
+  def test_weld(self):
+    self.assertWelds()
+
+  # many chunks and buckets, so lookback runs over chunk edges
+  def test_small_chunks(self):
+    mesh_check.CHECK_CHUNK = 64
+    self.assertWelds()
+
+  # with a multiplier of 1 different positions often share a hash
+  def test_hash_collisions(self):
+    mesh_check.POSITION_HASH = 1
+    self.assertWelds()
+    mesh_check.CHECK_CHUNK = 64
+    self.assertWelds()
+
+  def test_empty(self):
+    (welded, faces) = mesh_check.weld(numpy.zeros((0, 3)), numpy.zeros((0, 3), dtype=numpy.int64))
+    self.assertEqual((welded.shape, faces.shape), ((0, 3), (0, 3)))
+    self.assertEqual(counts(numpy.zeros((0, 3)), numpy.zeros((0, 3), dtype=numpy.int64))["holes"], 0)
+
+class FileTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  # runs main() on the files without printing and returns its exit status
+  def main(self, *args):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+      return mesh_check.main(list(args))
+    finally:
+      sys.stdout.close()
+      sys.stdout = stdout
+
+  # every format reads back as the same closed octahedron
+  def test_formats(self):
+    (vertices, faces) = octahedron()
+    for extension, writer in sorted(mesh_output.WRITERS.items()):
+      filename = os.path.join(self.directory, "octahedron." + extension)
+      out = writer(filename)
+      if extension == "stl":
+        out.write(vertices, faces)
+      else:
+        out.add_vertices(vertices)
+        out.add_faces(faces)
+      out.close()
+      report = mesh_check.check_file(filename)
+      self.assertEqual((report["vertices"], report["triangles"]), (6, 8), extension)
+      self.assertEqual(sum(problem["count"] for problem in report["problems"].values()), 0, extension)
+
+  def test_exit_status(self):
+    (vertices, faces) = octahedron()
+    for name, kept in (("closed", faces), ("open", faces[1:])):
+      out = mesh_output.StlWriter(os.path.join(self.directory, name + ".stl"))
+      out.write(vertices, kept)
+      out.close()
+    self.assertEqual(self.main(os.path.join(self.directory, "closed.stl"), "--no-grooves"), 0)
+    self.assertEqual(self.main(os.path.join(self.directory, "closed.stl"), os.path.join(self.directory, "open.stl"),
+      "--no-grooves"), 1)
+
+  # a render has no holes, non-manifold edges or flipped winding,
+  # as stl or ply, at full resolution or decimated, and at the default
+  # steps per revolution, which aren't a whole number
+  def test_render(self):
+    for meshFormat in ("stl", "ply"):
+      for (case, settings) in (("full", {}), ("decimated", {"decimateMicrons": 5}),
+          ("default steps", {"stepsPerRev": None, "audio": synthetic.signal(4)})):
+        output = synthetic.render(self.directory, "record", meshFormat=meshFormat, **settings)
+        report = mesh_check.check_file(output, stl_generator.grooveLayout())
+        for name in mesh_check.FAILING:
+          self.assertEqual(report["problems"][name]["count"], 0, "%s in %s %s" % (name, case, meshFormat))
+        self.assertEqual(self.main(output, "--no-grooves"), 0)
+
+if __name__ == "__main__":
+  unittest.main()
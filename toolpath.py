@@ -0,0 +1,153 @@
+# toolpath stage for the laser cut generator
+# sits between the spiral and an output backend: joins runs that
+# carry on from where the last one ended into one continuous
+# polyline, orders the polylines so the head travels as little as
+# possible between them, and estimates how long the cutter spends
+# cutting and travelling. coordinates are in pdf points, like
+# the backends
+
+#######################################
+#                                     #
+#              IMPORTS                #
+#                                     #
+#######################################
+import math
+import collections
+import numpy
+import laser_output
+
+#######################################
+#                                     #
+#              GLOBALS                #
+#                                     #
+#######################################
+
+POINTS_PER_MM = laser_output.POINTS_PER_INCH/laser_output.MM_PER_INCH
+CUT_FEED = laser_output.GCODE_FEED # mm/min while cutting
+TRAVEL_FEED = 6000 # mm/min for rapid moves with the laser off
+PIERCE_SECONDS = 0.1 # laser on/off, head settling and acceleration, per path started
+HOME = (0.0, 0.0) # where the head starts and ends each file, the bed's bottom left corner
+HOLD_POINTS = 2**18 # points held for ordering before they are handed on to the backend
+
+#######################################
+#                                     #
+#        GEOMETRY FUNCTIONS           #
+#                                     #
+#######################################
+
+# Returns the length of the polyline through the x and y lists
+def path_length(x_vals, y_vals):
+  if len(x_vals) < 2:
+    return 0.0
+  return float(numpy.hypot(numpy.diff(x_vals), numpy.diff(y_vals)).sum())
+
+# Takes a list of (x list, y list) paths and the head's position
+# and returns them in cutting order: from wherever the head is,
+# the path whose nearer end is closest next, reversed if that is
+# its last point
+def order_paths(paths, position):
+  remaining = list(paths)
+  ordered = []
+  while remaining:
+    best = None
+    for i, (x_vals, y_vals) in enumerate(remaining):
+      for reverse, (x, y) in ((False, (x_vals[0], y_vals[0])), (True, (x_vals[-1], y_vals[-1]))):
+        distance = math.hypot(x - position[0], y - position[1])
+        if best is None or distance < best[0]:
+          best = (distance, i, reverse)
+    (distance, i, reverse) = best
+    (x_vals, y_vals) = remaining.pop(i)
+    if reverse:
+      (x_vals, y_vals) = (x_vals[::-1], y_vals[::-1])
+    ordered.append((x_vals, y_vals))
+    position = (x_vals[-1], y_vals[-1])
+  return ordered
+
+#######################################
+#                                     #
+#              CLASSES                #
+#                                     #
+#######################################
+
+# Takes the same drawing calls as a backend and hands them on to it.
+# Polylines are held until the color changes, a circle is drawn, the
+# file is saved or more than HOLD_POINTS points are waiting, then
+# merged, ordered and passed on as one call, so the backend keeps
+# streaming a window of the spiral at a time (a path that runs on
+# past a window is cut as two, the second starting where the first ends).
+# Circles and color changes keep their order (cutlines go last, the
+# hole before the rim), only the travel to them is counted.
+# report() gives the file's cut and travel lengths and times
+class Toolpath:
+  def __init__(self, backend):
+    self.backend = backend
+    self.filename = backend.filename
+    self.position = HOME
+    self.paths = [] # [x list, y list] waiting to be ordered
+    self.held = 0 # points in them
+    self.cut_length = 0.0
+    self.travel_length = 0.0
+    self.pierces = 0
+
+  def set_color(self, r, g, b):
+    self.flush()
+    self.backend.set_color(r, g, b)
+
+  # takes a list of (x list, y list) runs, joining each onto
+  # the path before it when it starts where that one ended
+  def polylines(self, runs):
+    for x_vals, y_vals in runs:
+      if len(x_vals) < 2:
+        continue
+      if self.paths and self.paths[-1][0][-1] == x_vals[0] and self.paths[-1][1][-1] == y_vals[0]:
+        self.paths[-1][0].extend(x_vals[1:])
+        self.paths[-1][1].extend(y_vals[1:])
+      else:
+        self.paths.append([list(x_vals), list(y_vals)])
+      self.held += len(x_vals)
+    if self.held > HOLD_POINTS:
+      self.flush()
+
+  # circles start and end at their rightmost point, as g-code cuts them
+  def circle(self, x, y, r):
+    self.flush()
+    self.travel_to(x + r, y)
+    self.cut_length += 2*math.pi*r
+    self.backend.circle(x, y, r)
+
+  # orders the held paths and passes them on
+  def flush(self):
+    runs = order_paths(self.paths, self.position)
+    self.paths = []
+    self.held = 0
+    for x_vals, y_vals in runs:
+      self.travel_to(x_vals[0], y_vals[0])
+      self.cut_length += path_length(x_vals, y_vals)
+      self.position = (x_vals[-1], y_vals[-1])
+    if runs:
+      self.backend.polylines(runs)
+
+  # moves the head to x, y with the laser off to start a path there
+  def travel_to(self, x, y):
+    self.travel_length += math.hypot(x - self.position[0], y - self.position[1])
+    self.pierces += 1
+    self.position = (x, y)
+
+  # passes on what is left, sends the head home and saves the backend
+  def save(self):
+    self.flush()
+    self.travel_length += math.hypot(HOME[0] - self.position[0], HOME[1] - self.position[1])
+    self.position = HOME
+    self.backend.save()
+
+  # returns the paths cut, the cut and travel lengths (inches)
+  # and the estimated seconds spent on each, travel including
+  # the time to start every path
+  def report(self):
+    report = collections.OrderedDict()
+    report["paths"] = self.pierces
+    report["cut_inches"] = self.cut_length/laser_output.POINTS_PER_INCH
+    report["travel_inches"] = self.travel_length/laser_output.POINTS_PER_INCH
+    report["cut_seconds"] = self.cut_length/POINTS_PER_MM/CUT_FEED*60
+    report["travel_seconds"] = self.travel_length/POINTS_PER_MM/TRAVEL_FEED*60 + self.pierces*PIERCE_SECONDS
+    return report